@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк движков сбора на локальной заглушке (mockserver.py) с
+фиксированной задержкой и числом страниц: страниц/с, врачей/с, CPU, пиковый RSS,
+время разбора и сети. Каждый движок запускается в отдельном процессе.
+
+    python bench_engines.py --specialties 10 --doctors 200 --latency 0.05 --out bench.json
+
+sync  - последовательный scrape_specialty из scrape_moscow_doctors.py
+v2    - обход общего списка scrape_all_doctors из scrape_moscow_doctors_v2.py
+v2-async - тот же список через scrape_all_doctors_async (crawl_listing)
+async - общий обход crawl из scrape_moscow_async.py с пулом процессов разбора
+async-inline - то же, но разбор в event loop
+
+Паузы между запросами в синхронных движках (вежливость к сайту, а не скорость
+движка) по умолчанию отключены, --keep-sleeps их оставляет.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import mockserver
+
+ENGINES = ['sync', 'v2', 'v2-async', 'async', 'async-inline']
+
+
+def specialty_paths(count):
+    return [f"/moskva/bench{i}/" for i in range(count)]
+
+
+class Stopwatch:
+    """Суммарное время вызовов функций модуля по корзинам"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def wrap(self, module, name, bucket):
+        func = getattr(module, name)
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.seconds[bucket] = self.seconds.get(bucket, 0.0) + time.perf_counter() - started
+
+        setattr(module, name, timed)
+
+    def get(self, bucket):
+        return self.seconds.get(bucket, 0.0)
+
+
+def no_sleep(seconds):
+    pass
+
+
+def run_sync(specialties, keep_sleeps):
+    import scrape_moscow_doctors as engine
+    watch = Stopwatch()
+    watch.wrap(engine, 'get_html', 'fetch')
+    for name in ('analyze_page', 'parse_doctors_from_page'):
+        watch.wrap(engine, name, 'parse')
+    if not keep_sleeps:
+        engine.time.sleep = no_sleep
+
+    doctors = 0
+    for path in specialties:
+        doctors += len(engine.scrape_specialty(path))
+    return {'doctors': doctors, 'parse_seconds': watch.get('parse'), 'network_seconds': watch.get('fetch')}
+
+
+def run_v2(specialties, keep_sleeps):
+    import journal
+    import scrape_moscow_doctors_v2 as engine
+    watch = Stopwatch()
+    watch.wrap(engine, 'get_html', 'fetch')
+    for name in ('analyze_page', 'get_total_doctors', 'parse_doctors_from_page'):
+        watch.wrap(engine, name, 'parse')
+    if not keep_sleeps:
+        engine.time.sleep = no_sleep
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        with journal.CrawlJournal(path, header={'timestamp': 'bench'}) as log:
+            engine.scrape_all_doctors(log)
+        _, entries = journal.read_journal(path)
+        doctors = sum(len(entry['doctors']) for entry in entries)
+    return {'doctors': doctors, 'parse_seconds': watch.get('parse'), 'network_seconds': watch.get('fetch')}
+
+
+def run_v2_async(workers):
+    import journal
+    import metrics
+    import scrape_moscow_async
+    import scrape_moscow_doctors_v2 as engine
+    watch = Stopwatch()
+    if not workers:
+        watch.wrap(scrape_moscow_async, 'parse_page', 'parse')
+    engine.BASE_URL = scrape_moscow_async.BASE_URL
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        with journal.CrawlJournal(path, header={'timestamp': 'bench'}) as log:
+            asyncio.run(engine.scrape_all_doctors_async(log, parse_workers=workers))
+        _, entries = journal.read_journal(path)
+        doctors = sum(len(entry['doctors']) for entry in entries)
+    if workers:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        parse = children.ru_utime + children.ru_stime
+    else:
+        parse = watch.get('parse')
+    # Латентность загрузок - из метрик движка: PageTimings живёт внутри scrape_all_doctors_async
+    return {'doctors': doctors, 'parse_seconds': parse, 'network_seconds': metrics.FETCH_SECONDS.get()['sum']}
+
+
+def run_async(specialties, workers):
+    import scrape_moscow_async as engine
+    watch = Stopwatch()
+    if not workers:
+        watch.wrap(engine, 'parse_page', 'parse')
+
+    async def crawl():
+        limiter = engine.AdaptiveLimiter()
+        timings = engine.PageTimings()
+        pool = engine.ParsePool(workers) if workers else None
+        doctors = 0
+        try:
+            async with engine.create_session() as session:
+                async for _, _, _, page_doctors in engine.crawl(session, limiter, specialties, timings=timings,
+                                                                retry=engine.RetryPolicy(), pool=pool):
+                    doctors += len(page_doctors)
+        finally:
+            if pool is not None:
+                pool.close()
+        return doctors, sum(timings.latencies)
+
+    doctors, network = asyncio.run(crawl())
+    if workers:
+        # Разбор шёл в дочерних процессах: их CPU и есть время разбора
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        parse = children.ru_utime + children.ru_stime
+    else:
+        parse = watch.get('parse')
+    return {'doctors': doctors, 'parse_seconds': parse, 'network_seconds': network}
+
+
+def peak_rss_mb(usage):
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def cpu_seconds():
+    """CPU процесса и уже завершившихся дочерних (пула разбора)"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def run_engine(args):
+    """Дочерний процесс: один движок, результат - JSON в stdout"""
+    specialties = specialty_paths(args.specialties)
+    # Импорт всех движков - до замера и одинаковый для всех, чтобы не искажать время и RSS
+    import journal  # noqa: F401
+    import scrape_moscow_async  # noqa: F401
+    import scrape_moscow_doctors  # noqa: F401
+    import scrape_moscow_doctors_v2  # noqa: F401
+
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    if args.engine == 'sync':
+        result = run_sync(specialties, args.keep_sleeps)
+    elif args.engine == 'v2':
+        result = run_v2(specialties, args.keep_sleeps)
+    elif args.engine == 'v2-async':
+        result = run_v2_async(args.parse_workers)
+    else:
+        result = run_async(specialties, args.parse_workers if args.engine == 'async' else 0)
+    wall = time.perf_counter() - started
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result.update({
+        'wall_seconds': wall,
+        'cpu_seconds': cpu_seconds() - cpu_before,
+        'peak_rss_mb': peak_rss_mb(own),
+        'children_peak_rss_mb': peak_rss_mb(children),
+    })
+    print(json.dumps(result))
+
+
+def bench(engine, site, base_url, args):
+    before = site.requests[200]
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-engine', engine,
+           '--specialties', str(args.specialties), '--parse-workers', str(args.parse_workers)]
+    if args.keep_sleeps:
+        cmd.append('--keep-sleeps')
+    env = dict(os.environ, PRODOCTOROV_BASE_URL=base_url)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Скраперы печатают прогресс - в отчёт идёт только последняя строка
+        output = subprocess.run(cmd, env=env, cwd=tmp, capture_output=True, text=True, check=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    pages = site.requests[200] - before
+    wall = result['wall_seconds']
+    return {
+        'pages': pages,
+        'doctors': result['doctors'],
+        'wall_seconds': round(wall, 3),
+        'pages_per_sec': round(pages / wall, 1),
+        'doctors_per_sec': round(result['doctors'] / wall, 1),
+        'cpu_seconds': round(result['cpu_seconds'], 3),
+        'peak_rss_mb': result['peak_rss_mb'],
+        'children_peak_rss_mb': result['children_peak_rss_mb'],
+        'parse_seconds': round(result['parse_seconds'], 3),
+        'network_seconds': round(result['network_seconds'], 3),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк движков сбора на локальной заглушке")
+    parser.add_argument('--engine', action='append', choices=ENGINES, help='только эти движки (можно несколько)')
+    parser.add_argument('--specialties', type=int, default=5, help='специальностей в обходе')
+    parser.add_argument('--doctors', type=int, default=200, help='врачей в каждой специальности')
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа заглушки, с')
+    parser.add_argument('--parse-workers', type=int, default=os.cpu_count() or 1,
+                        help='процессов разбора для движка async')
+    parser.add_argument('--keep-sleeps', action='store_true', help='не отключать паузы синхронных движков')
+    parser.add_argument('--out', help='записать отчёт JSON в файл')
+    parser.add_argument('--json', action='store_true', help='вывести отчёт как JSON')
+    parser.add_argument('--run-engine', choices=ENGINES, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(args):
+    if args.run_engine:
+        args.engine = args.run_engine
+        run_engine(args)
+        return
+
+    engines = args.engine or ENGINES
+    # v2 обходит один общий список /moskva/vrach/ - в нём столько же врачей, сколько во всех специальностях
+    counts = {path.strip('/').split('/')[-1]: args.doctors for path in specialty_paths(args.specialties)}
+    counts['vrach'] = args.doctors * args.specialties
+    site = mockserver.MockSite(counts, latency=args.latency)
+
+    with mockserver.ServerThread(site) as base_url:
+        results = {engine: bench(engine, site, base_url, args) for engine in engines}
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': {
+            'specialties': args.specialties,
+            'doctors_per_specialty': args.doctors,
+            'latency': args.latency,
+            'parse_workers': args.parse_workers,
+            'keep_sleeps': args.keep_sleeps,
+        },
+        'engines': results,
+    }
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"Специальностей: {args.specialties}, врачей в каждой: {args.doctors}, задержка: {args.latency}s")
+    base = results.get('sync', {}).get('pages_per_sec')
+    for engine, r in results.items():
+        speedup = f" (x{r['pages_per_sec'] / base:.1f} к sync)" if base else ""
+        print(f"  {engine:<13} {r['pages_per_sec']:>7} стр/с {r['doctors_per_sec']:>9} врачей/с  "
+              f"CPU {r['cpu_seconds']:>6}s  RSS {r['peak_rss_mb']:>6} МБ  "
+              f"разбор {r['parse_seconds']}s / сеть {r['network_seconds']}s{speedup}")
+
+
+if __name__ == "__main__":
+    main(parse_args())
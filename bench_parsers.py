@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк движков парсинга: страниц в секунду на страницах из fixtures/,
+экономия CPU на первой странице специальности от разбора за один проход и
+стоимость функций разбора скраперов на страницу и на карточку с аллокациями
+(tracemalloc). Работает без сети.
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+import parsers
+import scrape_moscow_async
+import scrape_moscow_doctors
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_pages():
+    return list(load_named_pages().values())
+
+
+def load_named_pages():
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+
+def bench_backend(parse, pages, min_time):
+    """Гоняет парсер по страницам, пока не наберётся min_time секунд"""
+    parsed = 0
+    cards = 0
+    started = time.perf_counter()
+    while True:
+        for html in pages:
+            cards += len(parse(html))
+            parsed += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+    return {
+        'pages': parsed,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(parsed / elapsed, 1),
+        'cards_per_sec': round(cards / elapsed, 1),
+    }
+
+
+def separate_total(html):
+    """Прежний разбор total: отдельное дерево BeautifulSoup ради одного meta"""
+    meta = BeautifulSoup(html, 'html.parser').select_one('meta[name="description"]')
+    return parsers.total_from_description(meta.get('content', '')) if meta else None
+
+
+def bench_first_page(backend, html, repeat):
+    """
+    CPU на первую страницу специальности: раньше total из meta и парсинг
+    карточек строили два дерева, теперь analyze_page строит одно
+    """
+    started = time.process_time()
+    for _ in range(repeat):
+        separate_total(html)
+        parsers.parse_doctors(html, backend)
+    separate = (time.process_time() - started) / repeat
+
+    started = time.process_time()
+    for _ in range(repeat):
+        parsers.analyze_page(html, backend)
+    single = (time.process_time() - started) / repeat
+
+    return {
+        'separate_ms': round(separate * 1000, 3),
+        'single_ms': round(single * 1000, 3),
+        'saved_ms_per_specialty': round((separate - single) * 1000, 3),
+    }
+
+
+# Функции разбора скраперов: (имя, подготовка аргумента из html, функция).
+# Синхронный скрапер разбирает тем же движком (--parser), что и асинхронный.
+FUNCTIONS = [
+    ('async.parse_doctors_from_html', lambda html: html, scrape_moscow_async.parse_doctors_from_html),
+    ('async.parse_page(first_page)', lambda html: html, lambda html: scrape_moscow_async.parse_page(html, True)),
+    ('sync.parse_doctors_from_page', lambda html: html,
+     lambda html: scrape_moscow_doctors.parse_doctors_from_page('bench', html)),
+]
+
+
+def bench_function(func, arg, cards, min_time):
+    """Время на вызов и на карточку страницы, затем отдельный прогон под tracemalloc"""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        func(arg)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+    per_call = elapsed / calls
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+
+    return {
+        'calls': calls,
+        'ms_per_page': round(per_call * 1000, 3),
+        'us_per_card': round(per_call * 1e6 / cards, 1) if cards else None,
+        'peak_kb': round(peak / 1024, 1),
+        'retained_kb': round(sum(stat.size_diff for stat in stats) / 1024, 1),
+        'allocated_blocks': sum(max(stat.count_diff, 0) for stat in stats),
+    }
+
+
+def bench_functions(named_pages, min_time):
+    """{страница: {функция: замер}} по всему корпусу fixtures/"""
+    results = {}
+    for name, html in named_pages.items():
+        cards = len(parsers.parse_doctors_bs4(html))
+        results[name] = {'cards': cards}
+        for func_name, prepare, func in FUNCTIONS:
+            results[name][func_name] = bench_function(func, prepare(html), cards, min_time)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--min-time', type=float, default=2.0, help='секунд на каждый движок')
+    parser.add_argument('--backend', action='append', help='только эти движки (можно несколько)')
+    parser.add_argument('--first-page-repeat', type=int, default=50,
+                        help='повторов для замера первой страницы специальности')
+    parser.add_argument('--function-time', type=float, default=0.5,
+                        help='секунд на каждую функцию разбора и страницу корпуса (0 - пропустить)')
+    parser.add_argument('--json', action='store_true', help='вывести результат как JSON')
+    args = parser.parse_args()
+
+    named_pages = load_named_pages()
+    pages = list(named_pages.values())
+    backends = args.backend or list(parsers.BACKENDS)
+
+    results = {}
+    for name in backends:
+        results[name] = bench_backend(parsers.get_parser(name), pages, args.min_time)
+
+    first_page = named_pages['listing_full.html']
+    first_page_results = {
+        name: bench_first_page(name, first_page, args.first_page_repeat)
+        for name in backends
+    }
+
+    functions = bench_functions(named_pages, args.function_time) if args.function_time > 0 else {}
+
+    if args.json:
+        print(json.dumps({'backends': results, 'first_page': first_page_results, 'functions': functions},
+                         ensure_ascii=False, indent=2))
+        return
+
+    print(f"Страниц в корпусе: {len(pages)}")
+    base = results.get('bs4', {}).get('pages_per_sec')
+    for name, r in results.items():
+        speedup = f" (x{r['pages_per_sec'] / base:.1f} к bs4)" if base else ""
+        print(f"  {name:<11} {r['pages_per_sec']:>8} стр/с  {r['cards_per_sec']:>9} карточек/с{speedup}")
+
+    print("\nПервая страница специальности (CPU, мс): два разбора -> один")
+    for name, r in first_page_results.items():
+        print(f"  {name:<11} {r['separate_ms']:>8} -> {r['single_ms']:<8} экономия {r['saved_ms_per_specialty']} мс")
+
+    for page, page_results in functions.items():
+        print(f"\n{page} ({page_results['cards']} карточек): мс/стр, мкс/карточку, пик КБ, блоков")
+        for func_name, _, _ in FUNCTIONS:
+            r = page_results[func_name]
+            per_card = r['us_per_card'] if r['us_per_card'] is not None else '-'
+            print(f"  {func_name:<30} {r['ms_per_page']:>8} {per_card:>8} {r['peak_kb']:>8} {r['allocated_blocks']:>7}")
+
+
+if __name__ == "__main__":
+    main()
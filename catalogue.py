@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+Каталог специальностей по городам. Адрес специальности - /<город>/<специальность>/.
+Список специальностей города берётся с его главной страницы (/<город>/): ссылки
+на специальности с числом врачей. Он хранится на диске и обновляется раз в
+INDEX_TTL_DAYS дней. Пока индекс не загружен (или сайт его не отдал), действует
+общий для всех городов SPECIALTY_SLUGS: специальность, первая страница которой
+в городе отдаёт 404, из каталога этого города убирается.
+"""
+
+import html as html_lib
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+CATALOGUE_FILE = 'catalogue.json'
+DEFAULT_CITY = 'moskva'
+INDEX_TTL_DAYS = 7
+DOCTORS_PER_PAGE = 20
+
+# Ссылка индекса: <a href="/<город>/<специальность>/">Название <span>число</span></a>
+INDEX_LINK = re.compile(r'<a\b[^>]*?\bhref="/([a-z0-9-]+)/([a-z0-9-]+)/"[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+INDEX_TAG = re.compile(r'<[^>]*>')
+INDEX_COUNT = re.compile(r'(\d[\d\s]*)\s*$')
+
+# Города prodoctorov.ru: адрес -> название
+CITIES = {
+    'moskva': 'Москва',
+    'spb': 'Санкт-Петербург',
+    'ekaterinburg': 'Екатеринбург',
+    'novosibirsk': 'Новосибирск',
+    'kazan': 'Казань',
+    'krasnodar': 'Краснодар',
+    'samara': 'Самара',
+}
+
+# Специальности (без vrach - общего списка всех врачей города)
+SPECIALTY_SLUGS = [
+    "abdominalniy-hirurg",
+    "akusher",
+    "akusherka",
+    "algolog",
+    "allergolog",
+    "androlog",
+    "anesteziolog-reanimatolog",
+    "arrhythmolog",
+    "artrolog",
+    "afaziolog",
+    "bariatricheskiy-hirurg",
+    "venerolog",
+    "vertebrolog",
+    "kosmetolog",
+    "vrach-lechebnoy-fizkultury",
+    "vrach-obshyay-praktiki",
+    "podolog",
+    "vrach-skoroy-pomoshi",
+    "ultrazvukovoy-diagnost",
+    "vrach-frm",
+    "vrach-efferentnoy-terapii",
+    "gastroenterolog",
+    "gematolog",
+    "gemostaziolog",
+    "genetik",
+    "gepatolog",
+    "geriatr",
+    "ginekolog",
+    "ginekilog-hirurg",
+    "ginekolog-endokrinolog",
+    "gipnolog",
+    "girudoterapevt",
+    "gnatolog",
+    "gnoynyy-hirurg",
+    "gomeopat",
+    "dermatovenerolog",
+    "dermatolog",
+    "detskiy-allergolog",
+    "detskiy-androlog",
+    "detskiy-anesteziolog-reanimatolog",
+    "detskiy-aritmolog",
+    "detskiy-venerolog",
+    "detskiy-vertebrolog",
+    "detskiy-vrach-kosmetolog",
+    "detskiy-vrach-lfk",
+    "detskiy-vrach-uzi",
+    "detskiy-gastroenterolog",
+    "detskiy-gematolog",
+    "detskiy-genetik",
+    "detskiy-gepatolog",
+    "detskiy-ginekolog",
+    "detskiy-ginekolog-endokrinolog",
+    "detskiy-gnatolog",
+    "detskiy-gomeopat",
+    "detskiy-dermatolog",
+    "detskiy-dietolog",
+    "detskiy-immunolog",
+    "detskiy-instruktor-lfk",
+    "detskiy-infekcionist",
+    "detskiy-kardiolog",
+    "detskiy-kineziolog",
+    "detskiy-otorinolaringolog",
+    "detskiy-lor-hirurg",
+    "detskiy-mammolog",
+    "detskiy-manualnyy-terapevt",
+    "detskiy-massagist",
+    "detskiy-mikolog",
+    "detskiy-narkolog",
+    "detskiy-nevrolog",
+    "detskiy-nyayropsiholog",
+    "detskiy-nyayrohirurg",
+    "detskiy-nefrolog",
+    "detskiy-nutriciolog",
+    "detskiy-onkolog",
+    "detskiy-onkolog-dermatolog",
+    "detskiy-ortodont",
+    "detskiy-ortoped-travmatolog",
+    "detskiy-osteopat",
+    "detskiy-otonevrolog",
+    "detskiy-oftalmolog",
+    "detskiy-parodontolog",
+    "detskiy-plasticheskiy-hirurg",
+    "detskiy-podolog",
+    "detskiy-proktolog",
+    "detskiy-psihiatr",
+    "detskiy-psiholog",
+    "detskiy-psihoterapevt",
+    "detskiy-pulmonolog",
+    "detskiy-reabilitolog",
+    "detskiy-revmatolog",
+    "detskiy-rentgenolog",
+    "detskiy-refleksoterapevt",
+    "detskiy-seksolog",
+    "detskiy-somnolog",
+    "detskiy-sosudistyy-hirurg",
+    "detskiy-sportivnyy-vrach",
+    "detskiy-stomatolog",
+    "detskiy-stomatolog-gigienist",
+    "detskiy-stomatolog-ortoped",
+    "detskiy-stomatolog-hirurg",
+    "detskiy-surdolog",
+    "detskiy-torakalnyy-hirurg",
+    "detskiy-travmatolog",
+    "detskiy-triholog",
+    "detskiy-urolog",
+    "detskiy-fizioterapevt",
+    "detskiy-flebolog",
+    "detskiy-foniatr",
+    "detskiy-ftiziatr",
+    "detskiy-hirurg",
+    "detskiy-hirurg-ortoped",
+    "detskiy-hirurg-travmatolog",
+    "detskiy-chelyustno-licevoy-hirurg",
+    "detskiy-endokrinolog",
+    "detskiy-epileptolog",
+    "defektolog",
+    "diabetolog",
+    "dietolog",
+    "immunolog",
+    "instruktor-lfk",
+    "infekcionist",
+    "kardiolog",
+    "kardiohirurg",
+    "kinesiolog",
+    "kistevoy-hirurg",
+    "klinicheskiy-psiholog",
+    "klinicheskiy-pharmakolog",
+    "kosmetolog-estetist",
+    "lazernyy-hirurg",
+    "limfolog",
+    "logoped",
+    "logoped-dlya-vzroslyh",
+    "otorinolaringolog",
+    "lor-hirurg",
+    "maloinvazivnyy-hirurg",
+    "mammolog",
+    "manualnyy-terapevt",
+    "massazhist",
+    "medsestra",
+    "mikolog",
+    "narkolog",
+    "nevrolog",
+    "neuropsiholog",
+    "neyrourolog",
+    "neyrofiziolog",
+    "nyayrohirurg",
+    "neonatolog",
+    "nefrolog",
+    "nutriciolog",
+    "ozhogovyy-hirurg",
+    "onkolog",
+    "onkolog-gematolog",
+    "onkolog-ginekolog",
+    "onkolog-dermatolog",
+    "onkolog-mammolog",
+    "onkolog-proktolog",
+    "onkolog-urolog",
+    "optometrist",
+    "ortoped",
+    "osteopat",
+    "otonevrolog",
+    "oftalmolog",
+    "hirurg-oftalmolog",
+    "parazitolog",
+    "paradontolog",
+    "pediatr",
+    "perinatolog",
+    "plasticheskiy-hirurg",
+    "podolog-estetist",
+    "proktolog",
+    "profpatolog",
+    "psihiatr",
+    "psihoanalitik",
+    "psiholog",
+    "psihoterapevt",
+    "pulmonolog",
+    "radiolog",
+    "radioterapevt",
+    "reabilitolog",
+    "revmatolog",
+    "rentgenolog",
+    "reproduktolog",
+    "refleksoterapevt",
+    "seksolog",
+    "semyaynyy-psiholog",
+    "somnolog",
+    "sosudistyj-hirurg",
+    "specialist-po-grudnomu-vskarmlivaniy",
+    "sportivnyy-vrach",
+    "stomatolog",
+    "stomatolog-gigienist",
+    "stomatolog-implantolog",
+    "ortodont",
+    "stomatolog-ortoped",
+    "stomatolog-hirurg",
+    "stomatolog-endodontist",
+    "sudebno-medicinskiy-ekspert",
+    "surdolog",
+    "terapevt",
+    "toksikolog",
+    "torakalnyy-onkolog",
+    "torakalnyy-hirurg",
+    "travmatolog",
+    "transfuziolog",
+    "triholog",
+    "uroginekolog",
+    "urolog",
+    "feldsher",
+    "fizioterapevt",
+    "fitoterapevt",
+    "flebolog",
+    "foniatr",
+    "ftiziatr",
+    "funkcionalnyy-diagnost",
+    "himioterapevt",
+    "hirurg",
+    "hirurg-ortoped",
+    "hirurg-travmatolog",
+    "hirurg-endokrinolog",
+    "chelyustno-licevoy-hirurg",
+    "embriolog",
+    "endokrinolog",
+    "endoskopist",
+    "epileptolog",
+    "ergoterapevt",
+]
+
+
+def specialty_path(city, slug):
+    return f"/{city}/{slug}/"
+
+
+def city_from_path(path):
+    return path.strip('/').split('/')[0]
+
+
+def output_prefix(city):
+    """Префикс итоговых файлов: у Москвы прежний moscow_, у остальных - адрес города"""
+    return 'moscow' if city == 'moskva' else city
+
+
+def index_path(city):
+    return f"/{city}/"
+
+
+def parse_index(html, city):
+    """
+    Специальности с главной страницы города: {slug: число врачей} в порядке
+    страницы. Ссылки без числа (меню, клиники) пропускаются, как и общий список vrach.
+    """
+    counts = {}
+    for link_city, slug, text in INDEX_LINK.findall(html):
+        if link_city != city or slug == 'vrach' or slug in counts:
+            continue
+        text = html_lib.unescape(INDEX_TAG.sub(' ', text)).replace('\xa0', ' ').strip()
+        match = INDEX_COUNT.search(text)
+        if match:
+            counts[slug] = int(''.join(match.group(1).split()))
+    return counts
+
+
+def estimate_pages(count):
+    return max(1, -(-count // DOCTORS_PER_PAGE))
+
+
+class Catalogue:
+    """
+    Каталог на диске: {"cities": {город: {"specialties": [...], "counts": {...},
+    "source": "index" | "slugs", "updated": ...}}}. Город, которого ещё нет
+    в файле, получает полный SPECIALTY_SLUGS.
+    """
+
+    def __init__(self, path=CATALOGUE_FILE):
+        self.path = path
+        self.cities = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.cities = json.load(f).get('cities', {})
+
+    def specialties(self, city):
+        entry = self.cities.get(city)
+        return list(entry['specialties']) if entry else list(SPECIALTY_SLUGS)
+
+    def counts(self, city):
+        entry = self.cities.get(city)
+        return dict(entry.get('counts', {})) if entry else {}
+
+    def count(self, path):
+        """Число врачей специальности по индексу или None"""
+        return self.counts(city_from_path(path)).get(path.strip('/').split('/')[-1])
+
+    def paths(self, city):
+        """Пути специальностей города: сначала крупные по индексу - меньше хвост обхода"""
+        counts = self.counts(city)
+        slugs = sorted(self.specialties(city), key=lambda slug: -counts.get(slug, 0))
+        return [specialty_path(city, slug) for slug in slugs]
+
+    def jobs(self, cities):
+        """
+        Пути всех (город, специальность) вперемешку по городам: в общей очереди
+        обхода первые страницы разных городов идут параллельно
+        """
+        per_city = [self.paths(city) for city in cities]
+        jobs = []
+        for index in range(max(map(len, per_city), default=0)):
+            jobs += [paths[index] for paths in per_city if index < len(paths)]
+        return jobs
+
+    def update(self, city, specialties, counts=None, source='slugs'):
+        self.cities[city] = {
+            'specialties': list(specialties),
+            'counts': dict(counts or {}),
+            'source': source,
+            'updated': datetime.now().isoformat(timespec='seconds'),
+        }
+
+    def is_stale(self, city, ttl_days=INDEX_TTL_DAYS, now=None):
+        """Индекс города не загружался или старше ttl_days"""
+        entry = self.cities.get(city)
+        if not entry or entry.get('source') != 'index':
+            return True
+        updated = datetime.fromisoformat(entry['updated'])
+        return (now or datetime.now()) - updated > timedelta(days=ttl_days)
+
+    def load_index(self, city, html):
+        """Каталог города из его главной страницы; 0 - специальностей не нашлось, каталог прежний"""
+        counts = parse_index(html, city)
+        if counts:
+            self.update(city, counts, counts, source='index')
+        return len(counts)
+
+    def prune(self, city, missing):
+        """Убирает специальности, которых в городе нет; True - каталог изменился"""
+        missing = set(missing)
+        current = self.specialties(city)
+        if city in self.cities and not missing & set(current):
+            return False
+        entry = self.cities.get(city, {})
+        counts = {slug: count for slug, count in entry.get('counts', {}).items() if slug not in missing}
+        self.update(city, [slug for slug in current if slug not in missing], counts, entry.get('source', 'slugs'))
+        if 'updated' in entry:
+            self.cities[city]['updated'] = entry['updated']  # срок индекса - от его загрузки
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'cities': self.cities}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
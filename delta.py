@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Дельта-обход: по первой странице каждой специальности (total из meta и отпечаток
+карточек) решаем, изменилась ли она с прошлого прогона. Неизменённые берутся из
+прошлой базы, полностью перезагружаются только изменённые. Итог - новые,
+пропавшие и изменившие рейтинг/отзывы врачи.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+
+import sinks
+import store
+
+
+def fingerprint(doctors):
+    """Отпечаток страницы: id, рейтинг и число отзывов карточек по порядку"""
+    cards = [(doc['id'], doc.get('rating'), doc.get('reviews_count')) for doc in doctors]
+    return hashlib.sha1(json.dumps(cards).encode('utf-8')).hexdigest()
+
+
+def snapshot(analysis):
+    """Снимок первой страницы из parsers.analyze_page для журнала и базы"""
+    return {'total': analysis['total'], 'fingerprint': fingerprint(analysis['doctors'])}
+
+
+def is_unchanged(previous, current):
+    """
+    previous - (total, fingerprint) из прошлой базы. Без отпечатка (база из JSON)
+    сравниваются только total; без снимка специальность считается изменённой.
+    """
+    if previous is None or current['total'] is None:
+        return False
+    total, previous_fingerprint = previous
+    if total != current['total']:
+        return False
+    return previous_fingerprint is None or previous_fingerprint == current['fingerprint']
+
+
+def open_previous(path):
+    """
+    Результат прошлого прогона как DoctorStore. moscow_doctors_full_*.json
+    один раз импортируется в .sqlite рядом с ним.
+    """
+    if path.endswith('.json'):
+        db_path = os.path.splitext(path)[0] + '.sqlite'
+        if not os.path.exists(db_path):
+            with open(path, encoding='utf-8') as f:
+                doctors = json.load(f)
+            with store.DoctorStore(db_path) as db:
+                for doc in doctors:
+                    for specialty in doc.get('specialties') or [None]:
+                        db.add([doc], specialty)
+        path = db_path
+    return store.DoctorStore(path)
+
+
+def entry_snapshot(entry):
+    """
+    Снимок специальности для новой базы по первой странице из журнала. Вне
+    дельта-режима total из meta в журнал не пишется - в базе его заменит
+    число найденных врачей.
+    """
+    return entry.get('total'), entry.get('fingerprint') or fingerprint(entry['doctors'])
+
+
+DIFF_NEW = "SELECT {fields} FROM doctors d WHERE d.id NOT IN (SELECT id FROM previous.doctors) ORDER BY d.rowid"
+DIFF_REMOVED = ("SELECT {fields} FROM previous.doctors d WHERE d.id NOT IN (SELECT id FROM main.doctors) "
+                "ORDER BY d.rowid")
+DIFF_CHANGED = """
+SELECT d.id, d.name, p.rating, d.rating, p.reviews_count, d.reviews_count
+FROM doctors d JOIN previous.doctors p ON p.id = d.id
+WHERE d.rating IS NOT p.rating OR d.reviews_count IS NOT p.reviews_count
+ORDER BY d.rowid
+"""
+
+
+def diff(previous_path, current_path):
+    """Разница двух баз: {'new': [...], 'removed': [...], 'changed': [...]}"""
+    fields = ', '.join(f'd.{field}' for field in sinks.DOCTOR_FIELDS)
+    conn = sqlite3.connect(current_path)
+    try:
+        conn.execute('ATTACH DATABASE ? AS previous', (previous_path,))
+        result = {
+            'new': [dict(zip(sinks.DOCTOR_FIELDS, row)) for row in conn.execute(DIFF_NEW.format(fields=fields))],
+            'removed': [dict(zip(sinks.DOCTOR_FIELDS, row))
+                        for row in conn.execute(DIFF_REMOVED.format(fields=fields))],
+            'changed': [
+                {
+                    'id': doc_id,
+                    'name': name,
+                    'rating': [old_rating, rating],
+                    'reviews_count': [old_reviews, reviews],
+                }
+                for doc_id, name, old_rating, rating, old_reviews, reviews in conn.execute(DIFF_CHANGED)
+            ],
+        }
+    finally:
+        conn.close()
+    return result
+
+
+def write_diff(previous_path, current_path, diff_path):
+    result = diff(previous_path, current_path)
+    with open(diff_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return result
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Сжатый кэш сырого HTML страниц списка для повторного разбора без сети.
+Файлы лежат по специальностям, имя - номер страницы и хэш содержимого:
+<root>/<специальность>/<page>-<sha1>.html.zst (или .gz без zstandard).
+Размер ограничен, при переполнении удаляются давно не читанные файлы (LRU:
+порядок обращений - в памяти, между запусками - по mtime).
+"""
+
+import collections
+import gzip
+import hashlib
+import os
+
+try:
+    import zstandard
+    CODEC = 'zst'
+except ImportError:
+    zstandard = None
+    CODEC = 'gz'
+
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def compress(data, codec=CODEC):
+    if codec == 'zst':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def read_page(path):
+    """HTML из файла кэша; кодек - по расширению. Вызывается и в дочерних процессах."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.endswith('.zst'):
+        data = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        data = gzip.decompress(data)
+    return data.decode('utf-8')
+
+
+def shard_name(specialty_path):
+    return specialty_path.strip('/').replace('/', '__')
+
+
+class RawHtmlCache:
+    """
+    Кэш HTML на диске; индекс (специальность, страница) -> файл строится при
+    открытии. Недописанные .tmp после падения при открытии удаляются.
+    """
+
+    def __init__(self, root, max_bytes=MAX_CACHE_BYTES, codec=CODEC):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.codec = codec
+        self.size = 0
+        self.written = 0
+        self.unchanged = 0
+        self.evicted = 0
+        self._index = {}  # (shard, page) -> путь
+        self._sizes = collections.OrderedDict()  # путь -> размер, от давно использованных к недавним
+        os.makedirs(root, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        found = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.tmp'):
+                    os.remove(entry.path)
+                    continue
+                page, _, rest = entry.name.partition('-')
+                if not page.isdigit() or '.html.' not in rest:
+                    continue
+                stat = entry.stat()
+                found.append((stat.st_mtime, shard.name, int(page), entry.path, stat.st_size))
+        for _, shard, page, path, size in sorted(found):
+            self._index[(shard, page)] = path
+            self._sizes[path] = size
+            self.size += size
+
+    def _used(self, path):
+        self._sizes.move_to_end(path)
+        os.utime(path)
+
+    def put(self, specialty_path, page, html):
+        """html - str или сырые байты ответа (UTF-8)"""
+        data = html if isinstance(html, bytes) else html.encode('utf-8')
+        shard = shard_name(specialty_path)
+        name = f"{page}-{hashlib.sha1(data).hexdigest()}.html.{self.codec}"
+        path = os.path.join(self.root, shard, name)
+
+        old_path = self._index.get((shard, page))
+        if old_path == path:
+            # Содержимое не изменилось - только отмечаем обращение
+            self.unchanged += 1
+            self._used(path)
+            return
+        if old_path is not None:
+            self._remove(old_path)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(compress(data, self.codec))
+        os.replace(tmp_path, path)
+
+        self._index[(shard, page)] = path
+        self._sizes[path] = os.path.getsize(path)
+        self.size += self._sizes[path]
+        self.written += 1
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def has(self, specialty_path, page):
+        return (shard_name(specialty_path), page) in self._index
+
+    def touch(self, specialty_path, page):
+        """Страница не изменилась (304) - только отмечаем обращение; False - её нет в кэше"""
+        path = self._index.get((shard_name(specialty_path), page))
+        if path is None:
+            return False
+        self.unchanged += 1
+        self._used(path)
+        return True
+
+    def get(self, specialty_path, page):
+        path = self._index.get((shard_name(specialty_path), page))
+        if path is None:
+            return None
+        self._used(path)
+        return read_page(path)
+
+    def pages(self, specialty_path):
+        """{page: путь к файлу} по специальности"""
+        shard = shard_name(specialty_path)
+        return {page: path for (name, page), path in self._index.items() if name == shard}
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self.size -= self._sizes.pop(path, 0)
+        shard = os.path.basename(os.path.dirname(path))
+        page = int(os.path.basename(path).partition('-')[0])
+        if self._index.get((shard, page)) == path:
+            del self._index[(shard, page)]
+
+    def evict(self):
+        """Удаляет самые давно использованные файлы, пока кэш не влезет в max_bytes"""
+        while self.size > self.max_bytes and self._sizes:
+            self._remove(next(iter(self._sizes)))
+            self.evicted += 1
+
+    def format(self):
+        return (f"{len(self._index)} страниц, {self.size / 1024 ** 2:.1f} МБ ({self.codec}), "
+                f"записано {self.written}, без изменений {self.unchanged}, вытеснено {self.evicted}")
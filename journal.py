@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Журнал обхода: append-only JSON Lines завершённых единиц (специальность, страница)
+вместе с найденными врачами. По нему восстанавливается состояние для --resume,
+из него же собираются итоговые CSV/JSON.
+"""
+
+import json
+import os
+import time
+
+import sinks
+
+
+class CrawlJournal(sinks.JsonLinesSink):
+    """
+    Журнал с пакетным fsync: на диск гарантированно попадает каждая fsync_every-я
+    запись или всё, что накопилось за fsync_interval секунд.
+    """
+
+    def __init__(self, path, header=None, fsync_every=50, fsync_interval=5.0):
+        if header is not None:
+            # Новый журнал: старый файл (если был) заменяется
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'type': 'header', **header}, ensure_ascii=False) + '\n')
+        else:
+            _drop_partial_tail(path)
+        super().__init__(path, chunk_size=fsync_every)
+        self.fsync_interval = fsync_interval
+        self._synced_at = time.monotonic()
+
+    def record(self, specialty, page, doctors, last_page=None, **extra):
+        entry = {
+            'type': 'unit',
+            'specialty': specialty,
+            'page': page,
+            'last_page': last_page,
+            'doctors': doctors,
+            **extra,
+        }
+        self.write(entry)
+        if time.monotonic() - self._synced_at >= self.fsync_interval:
+            self.flush()
+        return entry
+
+    def flush(self):
+        super().flush()
+        os.fsync(self._file.fileno())
+        self._synced_at = time.monotonic()
+
+
+def _drop_partial_tail(path):
+    """Обрезает недописанную при падении строку, иначе следующая запись склеится с ней"""
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+
+
+def read_journal(path):
+    """Заголовок и итератор по записям; оборванная при падении последняя строка пропускается"""
+    with open(path, encoding='utf-8') as f:
+        header = json.loads(f.readline())
+
+    def entries():
+        with open(path, encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('type') == 'unit':
+                    yield entry
+
+    return header, entries()
+
+
+class ResumeState:
+    """Что уже сделано по журналу: готовые страницы, число страниц, найденные id"""
+
+    def __init__(self):
+        self.done = set()  # (specialty, page)
+        self.last_pages = {}  # specialty -> last_page
+        self.seen_ids = set()
+        self.found = {}  # specialty -> врачей найдено
+        self.new = {}  # specialty -> из них новых
+        self.pages = {}  # specialty -> готовых страниц
+
+    @classmethod
+    def from_entries(cls, entries):
+        state = cls()
+        for entry in entries:
+            state.add(entry)
+        return state
+
+    def add(self, entry):
+        """Учитывает запись журнала; False - не загрузилась или уже учтена"""
+        if entry.get('failed'):
+            return False  # страница не загрузилась - при продолжении её нужно загрузить снова
+        specialty = entry['specialty']
+        key = (specialty, entry['page'])
+        if key in self.done:
+            return False
+        self.done.add(key)
+        if entry.get('last_page') is not None:
+            self.last_pages[specialty] = entry['last_page']
+        self.pages[specialty] = self.pages.get(specialty, 0) + 1
+        self.found[specialty] = self.found.get(specialty, 0) + len(entry['doctors'])
+        for doc in entry['doctors']:
+            if doc['id'] not in self.seen_ids:
+                self.seen_ids.add(doc['id'])
+                self.new[specialty] = self.new.get(specialty, 0) + 1
+        return True
+
+    def is_complete(self, specialty):
+        last_page = self.last_pages.get(specialty)
+        return last_page is not None and self.pages.get(specialty, 0) >= last_page
+
+
+def journal_records(path, specialty_name=None, keep=None):
+    """
+    Записи врачей для сборки итоговых файлов. specialty_name(specialty) даёт метку
+    специальности; без неё записи идут без специальностей. keep(specialty) - только
+    эти записи (например, один город). Повторы страниц пропускаются.
+    """
+    _, entries = read_journal(path)
+    done = set()
+    for entry in entries:
+        if entry.get('failed') or (keep is not None and not keep(entry['specialty'])):
+            continue
+        key = (entry['specialty'], entry['page'])
+        if key in done:
+            continue
+        done.add(key)
+        label = specialty_name(entry['specialty']) if specialty_name else None
+        yield from sinks.doctor_records(entry['doctors'], label)
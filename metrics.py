@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Метрики обхода: счётчики, gauge и гистограммы в духе Prometheus, экспорт в
+текстовом формате на локальном порту и необязательная JSON-лента событий.
+Метрики - глобальные объекты модуля, как в prometheus_client: скраперы
+обновляют их в местах загрузки и разбора, без передачи по цепочке вызовов.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sinks
+
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PARSE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def values(self):
+        """{значения меток: значение} - копия для чтения из другого потока"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        for key, value in self.values().items():
+            yield self.name, format_labels(self.labels, key), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {format_value(value)}" for name, labels, value in self.samples()]
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            state['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def get(self, **labels):
+        state = self._values.get(self._key(labels))
+        return dict(state, counts=list(state['counts'])) if state else {'counts': [], 'sum': 0.0, 'count': 0}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, dict(state, counts=list(state['counts']))) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state['counts']):
+                cumulative += count
+                yield (f"{self.name}_bucket", format_labels(self.labels, key, [('le', format_value(bound))]),
+                       cumulative)
+            yield f"{self.name}_sum", format_labels(self.labels, key), state['sum']
+            yield f"{self.name}_count", format_labels(self.labels, key), state['count']
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter('prodoctorov_requests_total', 'HTTP-ответы по статусу', ['status']))
+BYTES = REGISTRY.register(Counter('prodoctorov_downloaded_bytes_total', 'Загружено байт тел ответов'))
+RETRIES = REGISTRY.register(Counter('prodoctorov_retries_total', 'Повторные попытки загрузки'))
+IN_FLIGHT = REGISTRY.register(Gauge('prodoctorov_requests_in_flight', 'Запросов в полёте'))
+FETCH_SECONDS = REGISTRY.register(Histogram('prodoctorov_fetch_seconds', 'Время загрузки страницы',
+                                            FETCH_BUCKETS))
+PARSE_SECONDS = REGISTRY.register(Histogram('prodoctorov_parse_seconds', 'Время разбора страницы',
+                                            PARSE_BUCKETS))
+PAGES = REGISTRY.register(Counter('prodoctorov_pages_total', 'Страниц списка обработано'))
+DOCTORS = REGISTRY.register(Counter('prodoctorov_doctors_total', 'Найдено карточек врачей'))
+SPECIALTIES_DONE = REGISTRY.register(Counter('prodoctorov_specialties_done_total', 'Специальностей обойдено'))
+SPECIALTY_RATE = REGISTRY.register(Gauge('prodoctorov_specialty_doctors_per_second',
+                                         'Врачей в секунду по завершённой специальности', ['specialty']))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1', registry=REGISTRY):
+    """/metrics в фоновом потоке - работает и рядом с event loop, и в синхронном скрапере"""
+    handler = type('Handler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Timeline(sinks.JsonLinesSink):
+    """JSON Lines лента событий: 't' - секунды от начала обхода"""
+
+    def __init__(self, path, chunk_size=200):
+        super().__init__(path, chunk_size)
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def event(self, kind, **fields):
+        with self._lock:
+            self.write({'t': round(time.monotonic() - self._started, 4), 'event': kind, **fields})
+
+
+TIMELINE = None
+
+
+def start_timeline(path):
+    global TIMELINE
+    TIMELINE = Timeline(path)
+    return TIMELINE
+
+
+def stop_timeline():
+    global TIMELINE
+    if TIMELINE is not None:
+        TIMELINE.close()
+        TIMELINE = None
+
+
+def event(kind, **fields):
+    if TIMELINE is not None:
+        TIMELINE.event(kind, **fields)
+
+
+def observe_fetch(url, status, seconds, size=0):
+    """Один HTTP-ответ (или ошибка без статуса): счётчики, гистограмма и событие ленты"""
+    REQUESTS.inc(status=status if status is not None else 'error')
+    if size:
+        BYTES.inc(size)
+    FETCH_SECONDS.observe(seconds)
+    event('fetch', url=url, status=status, seconds=round(seconds, 4), bytes=size)
+
+
+def observe_parse(url, seconds):
+    PARSE_SECONDS.observe(seconds)
+    event('parse', url=url, seconds=round(seconds, 4))
+
+
+def observe_page(specialty, page, doctors):
+    """Страница принята обходом - разобрана заново или взята из кэша"""
+    PAGES.inc()
+    DOCTORS.inc(doctors)
+    event('page', specialty=specialty, page=page, doctors=doctors)
+
+
+SPECIALTY_STARTED = {}  # специальность -> time.monotonic() первой страницы, взятой в работу
+
+
+def start_specialty(specialty):
+    """Обход специальности начался; повторные вызовы время не сдвигают"""
+    SPECIALTY_STARTED.setdefault(specialty, time.monotonic())
+
+
+def observe_specialty(specialty, doctors, seconds=None):
+    """Специальность готова; seconds=None - время от start_specialty этой специальности"""
+    started = SPECIALTY_STARTED.pop(specialty, None)
+    if seconds is None:
+        seconds = time.monotonic() - started if started is not None else 0.0
+    SPECIALTIES_DONE.inc()
+    rate = doctors / seconds if seconds > 0 else 0.0
+    SPECIALTY_RATE.set(round(rate, 2), specialty=specialty)
+    event('specialty', specialty=specialty, doctors=doctors, seconds=round(seconds, 3), rate=round(rate, 2))
+
+
+def format_summary():
+    fetch = FETCH_SECONDS.get()
+    parse = PARSE_SECONDS.get()
+    statuses = ', '.join(f"{key[0]}: {value}" for key, value in sorted(REQUESTS.values().items()))
+    return (f"ответы {{{statuses}}}, {BYTES.get() / 1024 ** 2:.1f} МБ, "
+            f"загрузка {fetch['sum']:.1f}s / {fetch['count']}, разбор {parse['sum']:.1f}s / {parse['count']}, "
+            f"повторов {RETRIES.get()}")
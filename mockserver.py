@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Локальная замена prodoctorov.ru для тестов и бенчмарков: отдаёт страницы списков
+/<город>/<специальность>/?page=N - синтетические или записанные recorder.py.
+Задержка, доля ошибок и число врачей по специальностям настраиваются.
+
+    python mockserver.py --port 8080 --latency 0.05 --error-rate 0.01
+    PRODOCTOROV_BASE_URL=http://127.0.0.1:8080 python scrape_moscow_async.py
+"""
+
+import argparse
+import asyncio
+import collections
+import random
+import threading
+import zlib
+
+from aiohttp import web
+
+import htmlcache
+
+DOCTORS_PER_PAGE = 20
+DEFAULT_DOCTORS = 200
+
+CARD = """<div class="b-doctor-card b-doctor-card_shadow" data-doctor-id="{id}" data-doctor-name="{name}">
+  <div class="b-doctor-card__top">
+    <div class="b-doctor-card__avatar">
+      <div class="b-stars-rate b-stars-rate_small">
+        <div class="b-stars-rate__progress" style="width: {rating:.2f}em;"></div>
+      </div>
+      <a href="/moskva/vrach/{id}-vrach/#otzivi" class="b-link b-link_underline">{reviews}&nbsp;отзывов</a>
+    </div>
+    <div class="b-doctor-card__center">
+      <a class="b-doctor-card__name-link" href="/moskva/vrach/{id}-vrach/#filter=default">{name}</a>
+      <div class="b-doctor-card__spec">
+            {spec}
+      </div>
+    </div>
+  </div>
+</div>
+"""
+
+PAGE = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<meta name="description" content="{description}">
+</head>
+<body>
+<main class="b-container">
+<div class="b-doctor-list">
+{cards}</div>
+<ul class="b-pagination-vuetify-imitation">{links}</ul>
+</main>
+</body>
+</html>
+"""
+
+
+class MockSite:
+    """
+    Настройки заглушки. doctors - {специальность: число врачей}, остальные
+    специальности получают default_doctors. Каждый overlap-й врач общий для всех
+    специальностей, чтобы дедупликация тоже работала. recordings - каталог
+    htmlcache с записанными страницами: они отдаются вместо синтетических.
+    hide_total - как на части реальных специальностей: в meta нет числа врачей,
+    а пагинатор показывает только соседние страницы. Ключ "город/специальность"
+    в doctors задаёт число врачей в другом городе; missing - такие ключи,
+    на которые сайт отвечает 404 (специальности нет в городе). index - список
+    специальностей для главной страницы города /<город>/ (без него там 404).
+    broken - пары (специальность, страница), которые всегда отвечают 500.
+    redirect_past_end - страницы за концом списка перенаправляются на первую.
+    """
+
+    def __init__(self, doctors=None, default_doctors=DEFAULT_DOCTORS, latency=0.0, jitter=0.0, error_rate=0.0,
+                 overlap=5, recordings=None, seed=0, hide_total=False, missing=(), index=None, broken=(),
+                 redirect_past_end=False):
+        self.doctors = doctors or {}
+        self.default_doctors = default_doctors
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.overlap = overlap
+        self.hide_total = hide_total
+        self.missing = set(missing)
+        self.index = index
+        self.broken = set(broken)
+        self.redirect_past_end = redirect_past_end
+        self.recordings = htmlcache.RawHtmlCache(recordings) if recordings else None
+        self.random = random.Random(seed)
+        self.requests = collections.Counter()  # статус -> число ответов
+
+    def total(self, specialty, city='moskva'):
+        return self.doctors.get(f"{city}/{specialty}", self.doctors.get(specialty, self.default_doctors))
+
+    def doctor_id(self, specialty, index, city='moskva'):
+        key = specialty if city == 'moskva' else f"{city}/{specialty}"
+        if self.overlap and index % self.overlap == 0:
+            return 1000000000 + index
+        return zlib.crc32(key.encode('utf-8')) % 10000 * 100000 + index
+
+    def render(self, specialty, page, city='moskva'):
+        total = self.total(specialty, city)
+        last_page = max(1, -(-total // DOCTORS_PER_PAGE))
+        cards = []
+        for index in range((page - 1) * DOCTORS_PER_PAGE, min(page * DOCTORS_PER_PAGE, total)):
+            doctor_id = self.doctor_id(specialty, index, city)
+            cards.append(CARD.format(
+                id=doctor_id,
+                name=f"Врач {doctor_id}",
+                rating=3 + doctor_id % 20 / 10,
+                reviews=doctor_id % 300,
+                spec=specialty,
+            ))
+        window = {1, page - 1, page, page + 1} if self.hide_total else {1, page - 1, page, page + 1, last_page}
+        pages = sorted(window & set(range(1, last_page + 1)))
+        links = ''.join(f'<li><a href="/{city}/{specialty}/?page={n}">{n}</a></li>' for n in pages)
+        if self.hide_total:
+            description = "Врачи в Москве. Рейтинг лучших специалистов, отзывы пациентов."
+        else:
+            description = f"{total} врачей в Москве. Рейтинг лучших врачей, отзывы пациентов."
+        return PAGE.format(description=description, cards=''.join(cards), links=links)
+
+    def render_index(self, city):
+        links = [f'<a href="/{city}/vrach/">Все врачи</a>', f'<a href="/{city}/lpu/">Клиники</a>']
+        for specialty in self.index:
+            if f"{city}/{specialty}" not in self.missing:
+                links.append(f'<a href="/{city}/{specialty}/">{specialty} '
+                             f'<span class="count">{self.total(specialty, city)}</span></a>')
+        return f"<html><body><ul>{''.join(f'<li>{link}</li>' for link in links)}</ul></body></html>"
+
+    async def handle_index(self, request):
+        if self.index is None:
+            self.requests[404] += 1
+            return web.Response(status=404)
+        self.requests[200] += 1
+        return web.Response(text=self.render_index(request.match_info['city']), content_type='text/html')
+
+    async def handle(self, request):
+        city = request.match_info['city']
+        specialty = request.match_info['specialty']
+        page = int(request.query.get('page', 1))
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.requests[503] += 1
+            return web.Response(status=503)
+        if (specialty, page) in self.broken:
+            self.requests[500] += 1
+            return web.Response(status=500)
+        if f"{city}/{specialty}" in self.missing:
+            self.requests[404] += 1
+            return web.Response(status=404)
+        if self.redirect_past_end and page > max(1, -(-self.total(specialty, city) // DOCTORS_PER_PAGE)):
+            self.requests[302] += 1
+            raise web.HTTPFound(f"/{city}/{specialty}/")
+
+        html = None
+        if self.recordings is not None:
+            html = self.recordings.get(f"/{city}/{specialty}/", page)
+        if html is None:
+            html = self.render(specialty, page, city)
+        self.requests[200] += 1
+        return web.Response(text=html, content_type='text/html')
+
+
+def make_app(site):
+    app = web.Application()
+    app.router.add_get('/{city}/', site.handle_index)
+    app.router.add_get('/{city}/{specialty}/', site.handle)
+    return app
+
+
+async def start(site, host='127.0.0.1', port=0):
+    """Запускает заглушку в текущем event loop: (runner, base_url)"""
+    runner = web.AppRunner(make_app(site))
+    await runner.setup()
+    tcp_site = web.TCPSite(runner, host, port)
+    await tcp_site.start()
+    port = tcp_site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+class ServerThread:
+    """Заглушка в отдельном потоке со своим event loop - для синхронных скраперов"""
+
+    def __init__(self, site, host='127.0.0.1', port=0):
+        self.site = site
+        self.host = host
+        self.port = port
+        self.base_url = None
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._runner, self.base_url = self._loop.run_until_complete(start(self.site, self.host, self.port))
+        self._ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self.base_url
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_specialty_counts(values):
+    counts = {}
+    for value in values or []:
+        name, _, count = value.partition('=')
+        counts[name.strip('/').split('/')[-1]] = int(count)
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная заглушка prodoctorov.ru")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, до N с')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503')
+    parser.add_argument('--doctors', type=int, default=DEFAULT_DOCTORS, help='врачей в специальности по умолчанию')
+    parser.add_argument('--specialty', action='append', metavar='NAME=COUNT',
+                        help='число врачей конкретной специальности (можно несколько раз)')
+    parser.add_argument('--recordings', metavar='DIR', help='каталог записанных recorder.py страниц')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--hide-total', action='store_true', help='без числа врачей в meta и последней страницы')
+    return parser.parse_args(argv)
+
+
+def main(args):
+    site = MockSite(parse_specialty_counts(args.specialty), args.doctors, args.latency, args.jitter,
+                    args.error_rate, recordings=args.recordings, seed=args.seed, hide_total=args.hide_total)
+    print(f"PRODOCTOROV_BASE_URL=http://{args.host}:{args.port}")
+    web.run_app(make_app(site), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Поиск последней страницы списка, когда в meta description нет числа врачей.
+Сначала галоп - пачка страниц 2, 4, 8, 16 сразу (при необходимости следующая
+пачка дальше), затем двоичный поиск последней непустой страницы между
+последней непустой и первой пустой. Всего O(log страниц) лишних запросов.
+
+Если число врачей известно заранее (каталог, catalogue.py), первым шагом
+проверяется подсказка: страница hint и следующая за ней. Подсказка верна -
+поиск закончен за два запроса, иначе он продолжается от неё.
+
+Сам поиск не делает запросов: движок спрашивает next_pages(), качает их как
+умеет (параллельно или по очереди) и сообщает результат через record().
+Страница, которая так и не загрузилась, - не пустая и не непустая: о ней
+сообщает record_failure(), границы поиска она не сдвигает, а last_page её
+не отбрасывает (страница остаётся в обходе и в повторах).
+"""
+
+GALLOP_WIDTH = 4
+
+
+def is_empty_page(doctors, first_ids=frozenset()):
+    """
+    Пустая страница - без карточек. Страницу за концом списка сайт может
+    отдать как первую (редирект) - такие тоже считаются пустыми.
+    """
+    if not doctors:
+        return True
+    return bool(first_ids) and all(doc['id'] in first_ids for doc in doctors)
+
+
+class PageCountSearch:
+    """
+    Состояние поиска: lo - последняя известная непустая страница, hi - первая
+    известная пустая, failed - не загрузившиеся. Непустые страницы идут подряд
+    от первой. hint - ожидаемая последняя страница.
+    """
+
+    def __init__(self, width=GALLOP_WIDTH, hint=None):
+        self.width = width
+        self.hint = hint
+        self.lo = 1
+        self.hi = None
+        self.probed = 0
+        self.failed = set()
+        self._gallop = 1  # последняя страница, запрошенная галопом
+        self._batch = set()  # страницы последнего шага галопа
+        self._pending = set()
+
+    def next_pages(self):
+        """Страницы для следующего шага; [] - поиск закончен (или ждёт record)"""
+        if self._pending:
+            return []
+        if self.hint is not None:
+            pages = [self.hint, self.hint + 1] if self.hint > 1 else [2]
+            self._gallop = pages[-1]
+            self.hint = None
+        elif self.hi is None:
+            if self._batch and self._batch <= self.failed:
+                # Не загрузилась вся пачка галопа - дальше не ищем, граница - первая из них
+                self.hi = min(self._batch)
+                return self.next_pages()
+            pages = []
+            for _ in range(self.width):
+                self._gallop *= 2
+                pages.append(self._gallop)
+            self._batch = set(pages)
+        else:
+            page = self._bisect()
+            if page is None:
+                return []
+            pages = [page]
+        self._pending.update(pages)
+        self.probed += len(pages)
+        return pages
+
+    def _bisect(self):
+        """Середина между lo и hi, а если она не загрузилась - ближайшая к ней загружаемая"""
+        middle = (self.lo + self.hi) // 2
+        for offset in range(self.hi - self.lo):
+            for page in (middle - offset, middle + offset):
+                if self.lo < page < self.hi and page not in self.failed:
+                    return page
+        return None
+
+    def record(self, page, non_empty):
+        self._pending.discard(page)
+        self.failed.discard(page)
+        if non_empty:
+            self.lo = max(self.lo, page)
+        elif self.hi is None or page < self.hi:
+            self.hi = page
+        if self.hi is not None and self.hi <= self.lo:
+            # Дыра в списке (ошибка загрузки посередине) - верим непустой странице
+            self.hi = None if self._gallop <= self.lo else self._gallop
+
+    def record_failure(self, page):
+        self._pending.discard(page)
+        self.failed.add(page)
+
+    @property
+    def done(self):
+        return not self._pending and self.hi is not None and self._bisect() is None
+
+    @property
+    def last_page(self):
+        """Последняя непустая страница; не загрузившиеся между ней и первой пустой - тоже в счёт"""
+        unknown = [page for page in self.failed if page > self.lo and (self.hi is None or page < self.hi)]
+        return max([self.lo] + unknown)
@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Парсеры карточек врачей со страниц списка prodoctorov.ru
+Несколько движков с одинаковым результатом: bs4 (эталон), lxml, selectolax
+и fastscan - регулярки по сырым байтам без построения DOM
+"""
+
+import html as html_lib
+import logging
+import math
+import re
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://prodoctorov.ru"
+DOCTORS_PER_PAGE = 20
+# Увеличивать при любом изменении разбора: сохранённые результаты старых версий не используются
+PARSER_VERSION = 1
+TOTAL_RE = re.compile(r'(\d+)\s*(?:врач|доктор|гинеколог|терапевт|педиатр|хирург|специалист)', re.IGNORECASE)
+
+
+def clean_url(url):
+    if '#' in url:
+        url = url.split('#')[0]
+    return url
+
+
+def clean_text(text):
+    if not text:
+        return ""
+    return ' '.join(text.split())
+
+
+def parse_rating(style):
+    """width: 4.6800em -> 4.68"""
+    if style and 'width:' in style:
+        try:
+            return float(style.split('width:')[1].split('em')[0].strip())
+        except ValueError:
+            pass
+    return None
+
+
+def parse_reviews(text):
+    try:
+        return int(''.join(filter(str.isdigit, text)))
+    except ValueError:
+        return None
+
+
+def total_from_description(content):
+    """Общее количество врачей из meta description"""
+    match = TOTAL_RE.search(content or '')
+    return int(match.group(1)) if match else None
+
+
+def make_analysis(description, page_labels, doctors):
+    """
+    Итог разбора страницы: total из meta, последняя страница пагинатора
+    и оценка числа страниц (по total, иначе по пагинатору)
+    """
+    total = total_from_description(description)
+    pages = [int(text) for text in page_labels if text.isdigit()]
+    pagination_last = max(pages) if pages else None
+    if total:
+        last_page = math.ceil(total / DOCTORS_PER_PAGE)
+    else:
+        last_page = pagination_last or 1
+    return {
+        'total': total,
+        'pagination_last': pagination_last,
+        'last_page': last_page,
+        'doctors': doctors,
+    }
+
+
+def make_doctor(doctor_id, name, href, rating, reviews_count, specialty, base_url):
+    return {
+        'id': doctor_id,
+        'name': name,
+        'url': clean_url(base_url + href),
+        'rating': rating,
+        'reviews_count': reviews_count,
+        'specialty_display': specialty,
+    }
+
+
+def parse_doctors_bs4(html, base_url=BASE_URL):
+    """Эталонный парсер: BeautifulSoup + html.parser"""
+    return _doctors_bs4(BeautifulSoup(html, 'html.parser'), base_url)
+
+
+def analyze_bs4(html, base_url=BASE_URL):
+    soup = BeautifulSoup(html, 'html.parser')
+    meta = soup.select_one('meta[name="description"]')
+    labels = [a.get_text(strip=True) for a in soup.select(PAGINATION_SELECTOR)]
+    return make_analysis(meta.get('content', '') if meta else None, labels, _doctors_bs4(soup, base_url))
+
+
+def _doctors_bs4(soup, base_url):
+    doctors = []
+    for card in soup.select('div.b-doctor-card[data-doctor-id]'):
+        doctor_id = card.get('data-doctor-id')
+        name = card.get('data-doctor-name', '')
+        link_el = card.select_one('a.b-doctor-card__name-link')
+        href = link_el.get('href') if link_el else None
+
+        rating_el = card.select_one('div.b-stars-rate__progress')
+        rating = parse_rating(rating_el.get('style', '')) if rating_el else None
+
+        reviews_el = card.select_one('a[href*="#otzivi"]')
+        reviews_count = parse_reviews(reviews_el.text) if reviews_el else None
+
+        spec_el = card.select_one('div.b-doctor-card__spec')
+        specialty = clean_text(spec_el.get_text()) if spec_el else None
+
+        if href and doctor_id:
+            doctors.append(make_doctor(doctor_id, name, href, rating, reviews_count, specialty, base_url))
+
+    return doctors
+
+
+PAGINATION_SELECTOR = 'ul.b-pagination-vuetify-imitation a'
+
+
+def _has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+LXML_CARDS = f"//div[{_has_class('b-doctor-card')} and @data-doctor-id]"
+LXML_LINK = f".//a[{_has_class('b-doctor-card__name-link')}]"
+LXML_RATING = f".//div[{_has_class('b-stars-rate__progress')}]"
+LXML_REVIEWS = ".//a[contains(@href, '#otzivi')]"
+LXML_SPEC = f".//div[{_has_class('b-doctor-card__spec')}]"
+LXML_DESCRIPTION = "//meta[@name='description']/@content"
+LXML_PAGINATION = f"//ul[{_has_class('b-pagination-vuetify-imitation')}]//a"
+
+
+def _lxml_tree(html):
+    if not html or not html.strip():
+        return None
+    return lxml.html.fromstring(html)
+
+
+def parse_doctors_lxml(html, base_url=BASE_URL):
+    """Парсер на lxml (XPath)"""
+    return _doctors_lxml(_lxml_tree(html), base_url)
+
+
+def analyze_lxml(html, base_url=BASE_URL):
+    tree = _lxml_tree(html)
+    if tree is None:
+        return make_analysis(None, [], [])
+    description = tree.xpath(LXML_DESCRIPTION)
+    labels = [a.text_content().strip() for a in tree.xpath(LXML_PAGINATION)]
+    return make_analysis(description[0] if description else None, labels, _doctors_lxml(tree, base_url))
+
+
+def _doctors_lxml(tree, base_url):
+    doctors = []
+    if tree is None:
+        return doctors
+
+    for card in tree.xpath(LXML_CARDS):
+        doctor_id = card.get('data-doctor-id')
+        name = card.get('data-doctor-name', '')
+        link_el = card.xpath(LXML_LINK)
+        href = link_el[0].get('href') if link_el else None
+
+        rating_el = card.xpath(LXML_RATING)
+        rating = parse_rating(rating_el[0].get('style', '')) if rating_el else None
+
+        reviews_el = card.xpath(LXML_REVIEWS)
+        reviews_count = parse_reviews(reviews_el[0].text_content()) if reviews_el else None
+
+        spec_el = card.xpath(LXML_SPEC)
+        specialty = clean_text(spec_el[0].text_content()) if spec_el else None
+
+        if href and doctor_id:
+            doctors.append(make_doctor(doctor_id, name, href, rating, reviews_count, specialty, base_url))
+
+    return doctors
+
+
+def parse_doctors_selectolax(html, base_url=BASE_URL):
+    """Парсер на selectolax (lexbor)"""
+    return _doctors_selectolax(HTMLParser(html), base_url)
+
+
+def analyze_selectolax(html, base_url=BASE_URL):
+    tree = HTMLParser(html)
+    meta = tree.css_first('meta[name="description"]')
+    labels = [a.text(strip=True) for a in tree.css(PAGINATION_SELECTOR)]
+    description = meta.attributes.get('content') or '' if meta else None
+    return make_analysis(description, labels, _doctors_selectolax(tree, base_url))
+
+
+def _doctors_selectolax(tree, base_url):
+    doctors = []
+    for card in tree.css('div.b-doctor-card[data-doctor-id]'):
+        attrs = card.attributes
+        doctor_id = attrs.get('data-doctor-id')
+        name = attrs.get('data-doctor-name') or ''
+        link_el = card.css_first('a.b-doctor-card__name-link')
+        href = link_el.attributes.get('href') if link_el else None
+
+        rating_el = card.css_first('div.b-stars-rate__progress')
+        rating = parse_rating(rating_el.attributes.get('style') or '') if rating_el else None
+
+        reviews_el = card.css_first('a[href*="#otzivi"]')
+        reviews_count = parse_reviews(reviews_el.text()) if reviews_el else None
+
+        spec_el = card.css_first('div.b-doctor-card__spec')
+        specialty = clean_text(spec_el.text()) if spec_el else None
+
+        if href and doctor_id:
+            doctors.append(make_doctor(doctor_id, name, href, rating, reviews_count, specialty, base_url))
+
+    return doctors
+
+
+def _attr(name):
+    return re.compile(rb'\s' + name + rb'\s*=\s*"([^"]*)"', re.IGNORECASE)
+
+
+ATTR_ID = _attr(rb'data-doctor-id')
+ATTR_NAME = _attr(rb'data-doctor-name')
+ATTR_HREF = _attr(rb'href')
+ATTR_STYLE = _attr(rb'style')
+ATTR_CONTENT = _attr(rb'content')
+ATTR_CLASS = _attr(rb'class')
+FAST_PAGE_LINK = re.compile(rb'<a\b[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+FAST_TAG = re.compile(rb'<[^>]*>')
+
+
+def _as_bytes(html):
+    if isinstance(html, str):
+        return html.encode('utf-8')
+    return html or b''
+
+
+def _fast_attr(pattern, tag):
+    match = pattern.search(tag)
+    return html_lib.unescape(match.group(1).decode('utf-8', 'replace')) if match else None
+
+
+def _fast_text(fragment):
+    return html_lib.unescape(FAST_TAG.sub(b'', fragment).decode('utf-8', 'replace'))
+
+
+def _find_tag(data, marker, tag_name, start=0, end=None, check=None):
+    """
+    Ищет байтовый marker и возвращает открывающий тег tag_name вокруг него:
+    (начало, конец, тег) или None. check(tag) - дополнительная проверка тега.
+    """
+    end = len(data) if end is None else end
+    prefix = b'<' + tag_name
+    pos = start
+    while True:
+        pos = data.find(marker, pos, end)
+        if pos < 0:
+            return None
+        tag_start = data.rfind(b'<', start, pos)
+        tag_end = data.find(b'>', pos, end)
+        if (tag_start >= 0 and tag_end >= 0
+                and data.find(b'>', tag_start, pos) < 0
+                and data[tag_start:tag_start + len(prefix)].lower() == prefix
+                and data[tag_start + len(prefix):tag_start + len(prefix) + 1] in (b' ', b'\t', b'\n', b'\r')):
+            tag = data[tag_start:tag_end + 1]
+            if check is None or check(tag):
+                return tag_start, tag_end + 1, tag
+        pos += len(marker)
+
+
+def _has_class_token(name):
+    def check(tag):
+        match = ATTR_CLASS.search(tag)
+        return bool(match) and name in match.group(1).split()
+    return check
+
+
+IS_CARD = _has_class_token(b'b-doctor-card')
+IS_LINK = _has_class_token(b'b-doctor-card__name-link')
+IS_RATING = _has_class_token(b'b-stars-rate__progress')
+IS_SPEC = _has_class_token(b'b-doctor-card__spec')
+IS_PAGINATION = _has_class_token(b'b-pagination-vuetify-imitation')
+
+
+def _is_reviews_link(tag):
+    href = ATTR_HREF.search(tag)
+    return bool(href) and b'#otzivi' in href.group(1)
+
+
+def _is_description(tag):
+    return b'name="description"' in tag
+
+
+def _card_starts(data):
+    starts = []
+    pos = 0
+    while True:
+        found = _find_tag(data, b'data-doctor-id=', b'div', pos, check=IS_CARD)
+        if found is None:
+            return starts
+        starts.append(found)
+        pos = found[1]
+
+
+def _inner(data, found, closing, end):
+    """Содержимое элемента до первого закрывающего тега closing"""
+    close = data.find(closing, found[1], end)
+    return data[found[1]:close if close >= 0 else end]
+
+
+def parse_doctors_fastscan(html, base_url=BASE_URL):
+    """
+    Карточки поиском по байтам ответа. Карточка - участок от её открывающего
+    тега до следующей карточки. Не замечает смену вёрстки сама - см. FastScanParser.
+    """
+    data = _as_bytes(html)
+    doctors = []
+    starts = _card_starts(data)
+
+    for i, (_, card_start, tag) in enumerate(starts):
+        card_end = starts[i + 1][0] if i + 1 < len(starts) else len(data)
+
+        doctor_id = _fast_attr(ATTR_ID, tag)
+        name = _fast_attr(ATTR_NAME, tag) or ''
+
+        link = _find_tag(data, b'b-doctor-card__name-link', b'a', card_start, card_end, IS_LINK)
+        href = _fast_attr(ATTR_HREF, link[2]) if link else None
+
+        rating_el = _find_tag(data, b'b-stars-rate__progress', b'div', card_start, card_end, IS_RATING)
+        rating = parse_rating(_fast_attr(ATTR_STYLE, rating_el[2]) or '') if rating_el else None
+
+        reviews_el = _find_tag(data, b'#otzivi', b'a', card_start, card_end, _is_reviews_link)
+        reviews_count = None
+        if reviews_el:
+            reviews_count = parse_reviews(_fast_text(_inner(data, reviews_el, b'</a>', card_end)))
+
+        spec_el = _find_tag(data, b'b-doctor-card__spec', b'div', card_start, card_end, IS_SPEC)
+        specialty = clean_text(_fast_text(_inner(data, spec_el, b'</div>', card_end))) if spec_el else None
+
+        if href and doctor_id:
+            doctors.append(make_doctor(doctor_id, name, href, rating, reviews_count, specialty, base_url))
+
+    return doctors
+
+
+class FastScanParser:
+    """
+    fastscan с самопроверкой: каждая sample_every-я страница (и самая первая)
+    сверяется с полным парсером. При расхождении fastscan отключается,
+    и дальше всё идёт через полный парсер. Счётчики - свои в каждом процессе
+    пула: take_stats() отдаёт прирост с прошлого вызова, родитель их складывает.
+    """
+
+    def __init__(self, reference=None, sample_every=50):
+        self.reference = reference
+        self.sample_every = sample_every
+        self.pages = 0
+        self.checked = 0
+        self.fallbacks = 0
+        self.disabled = False
+        self._taken = {}
+
+    def _full(self, html, base_url):
+        if isinstance(html, bytes):
+            html = html.decode('utf-8', 'replace')
+        return get_parser(self.reference or FULL_PARSERS[0])(html, base_url)
+
+    def __call__(self, html, base_url=BASE_URL):
+        self.pages += 1
+        if self.disabled:
+            return self._full(html, base_url)
+
+        doctors = parse_doctors_fastscan(html, base_url)
+
+        # Маркеры карточек есть, а карточек нет - вёрстка поменялась, страница целиком на полный парсер
+        if not doctors and b'data-doctor-id' in _as_bytes(html):
+            self.fallbacks += 1
+            return self._full(html, base_url)
+
+        if (self.pages - 1) % self.sample_every == 0:
+            self.checked += 1
+            expected = self._full(html, base_url)
+            if doctors != expected:
+                self.disabled = True
+                logger.warning("fastscan расходится с полным парсером, переключаемся на %s",
+                               self.reference or FULL_PARSERS[0])
+                return expected
+
+        return doctors
+
+    def stats(self):
+        return {
+            'pages': self.pages,
+            'checked': self.checked,
+            'fallbacks': self.fallbacks,
+            'disabled': self.disabled,
+        }
+
+    def take_stats(self):
+        """Прирост счётчиков с прошлого вызова; disabled - как есть"""
+        stats = self.stats()
+        delta = {key: stats[key] - self._taken.get(key, 0) for key in SCAN_COUNTERS}
+        delta['disabled'] = stats['disabled']
+        self._taken = stats
+        return delta
+
+
+SCAN_COUNTERS = ('pages', 'checked', 'fallbacks')
+
+
+def add_scan_stats(total, stats):
+    """Складывает счётчики fastscan (из разных процессов) в total; disabled - хоть в одном"""
+    for key in SCAN_COUNTERS:
+        total[key] = total.get(key, 0) + stats.get(key, 0)
+    total['disabled'] = total.get('disabled', False) or stats.get('disabled', False)
+    return total
+
+
+def format_scan_stats(stats):
+    return (f"страниц {stats.get('pages', 0)}, сверено {stats.get('checked', 0)}, "
+            f"на полный парсер {stats.get('fallbacks', 0)}"
+            + (", отключён после расхождения" if stats.get('disabled') else ""))
+
+
+def analyze_fastscan(html, base_url=BASE_URL):
+    data = _as_bytes(html)
+    meta = _find_tag(data, b'description', b'meta', check=_is_description)
+    description = _fast_attr(ATTR_CONTENT, meta[2]) if meta else None
+    pagination = _find_tag(data, b'b-pagination-vuetify-imitation', b'ul', check=IS_PAGINATION)
+    labels = []
+    if pagination:
+        items = _inner(data, pagination, b'</ul>', len(data))
+        labels = [_fast_text(a).strip() for a in FAST_PAGE_LINK.findall(items)]
+    return make_analysis(description, labels, FAST_SCAN(data, base_url))
+
+
+BACKENDS = {'bs4': parse_doctors_bs4}
+ANALYZERS = {'bs4': analyze_bs4}
+if lxml is not None:
+    BACKENDS['lxml'] = parse_doctors_lxml
+    ANALYZERS['lxml'] = analyze_lxml
+if HTMLParser is not None:
+    BACKENDS['selectolax'] = parse_doctors_selectolax
+    ANALYZERS['selectolax'] = analyze_selectolax
+
+# Полные (DOM) парсеры, от быстрого к медленному; самый быстрый - по умолчанию
+FULL_PARSERS = [name for name in ('selectolax', 'lxml', 'bs4') if name in BACKENDS]
+DEFAULT_BACKEND = FULL_PARSERS[0]
+
+# fastscan не выбирается по умолчанию: он для массовых перекраулов.
+# Ему тело ответа отдаётся байтами, как пришло, - без декодирования в str
+FAST_SCAN = FastScanParser()
+BYTES_BACKENDS = {'fastscan'}
+BACKENDS['fastscan'] = FAST_SCAN
+ANALYZERS['fastscan'] = analyze_fastscan
+
+
+def backend_name(backend=None):
+    """Проверенное имя движка (по умолчанию - самый быстрый доступный)"""
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Парсер {backend!r} недоступен, есть: {', '.join(BACKENDS)}")
+    return backend
+
+
+def parser_identity(backend=None):
+    """Движок и версия разбора - метка сохранённых результатов (validators.py)"""
+    return f"{backend_name(backend)}:{PARSER_VERSION}"
+
+
+def get_parser(backend=None):
+    """Функция парсинга по имени движка"""
+    return BACKENDS[backend_name(backend)]
+
+
+def parse_doctors(html, backend=None, base_url=BASE_URL):
+    return get_parser(backend)(html, base_url)
+
+
+def analyze_page(html, backend=None, base_url=BASE_URL):
+    """
+    Один разбор страницы вместо отдельного дерева ради meta и parse_doctors:
+    {'total', 'pagination_last', 'last_page', 'doctors'}
+    """
+    return ANALYZERS[backend_name(backend)](html, base_url)
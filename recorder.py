@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Запись страниц списков prodoctorov.ru на диск (в формате htmlcache) для
+воспроизведения через mockserver.py --recordings.
+
+    python recorder.py --out recordings --pages 3 /moskva/ginekolog/ /moskva/terapevt/
+"""
+
+import argparse
+import asyncio
+
+import catalogue
+import htmlcache
+import parsers
+import scrape_moscow_async as scraper
+
+
+async def record(specialties, out_dir, max_pages=None, concurrency=4):
+    """Первая страница каждой специальности, затем остальные (не больше max_pages); возвращает кэш"""
+    cache = htmlcache.RawHtmlCache(out_dir)
+    limiter = scraper.AdaptiveLimiter(initial=min(concurrency, scraper.INITIAL_CONCURRENT), max_limit=concurrency)
+    retry = scraper.RetryPolicy()
+
+    async with scraper.create_session(max_connections=concurrency) as session:
+        first_urls = [scraper.BASE_URL + path for path in specialties]
+        first_pages = await scraper.fetch_pages(session, limiter, first_urls, retry=retry)
+
+        jobs = []
+        for path, html in zip(specialties, first_pages):
+            if html is None:
+                print(f"  {path}: не загрузилась")
+                continue
+            cache.put(path, 1, html)
+            analysis = parsers.analyze_page(html, base_url=scraper.BASE_URL)
+            last_page, probed = analysis['last_page'], {}
+            if analysis['total'] is None:
+                # Найденные поиском страницы discover_pages сам кладёт в кэш
+                last_page, probed = await scraper.discover_pages(session, limiter, path, analysis['doctors'],
+                                                                 retry=retry, html_cache=cache)
+            if max_pages:
+                last_page = min(last_page, max_pages)
+            jobs += [(path, page) for page in range(2, last_page + 1) if page not in probed]
+
+        urls = [f"{scraper.BASE_URL}{path}?page={page}" for path, page in jobs]
+        for (path, page), html in zip(jobs, await scraper.fetch_pages(session, limiter, urls, retry=retry)):
+            if html is not None:
+                cache.put(path, page, html)
+
+    print(f"Записано: {cache.format()}, {retry.format()}")
+    return cache
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Запись страниц списков для mockserver.py")
+    parser.add_argument('specialties', nargs='*', help='пути специальностей (по умолчанию - московские из каталога)')
+    parser.add_argument('--catalogue', default=catalogue.CATALOGUE_FILE, metavar='PATH',
+                        help='каталог специальностей по городам ("" - без файла)')
+    parser.add_argument('--out', default='recordings', help='каталог записи')
+    parser.add_argument('--pages', type=int, default=None, help='не больше N страниц на специальность')
+    parser.add_argument('--concurrency', type=int, default=4, help='одновременных запросов')
+    return parser.parse_args(argv)
+
+
+def main(args):
+    specialties = args.specialties or catalogue.Catalogue(args.catalogue).paths(catalogue.DEFAULT_CITY)
+    asyncio.run(record(specialties, args.out, args.pages, args.concurrency))
+
+
+if __name__ == "__main__":
+    main(parse_args())
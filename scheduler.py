@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Порядок обхода специальностей: самые долгие - первыми (LPT, longest processing
+time first). Число страниц специальности оценивается по журналу (точно),
+индексу города (catalogue.py) или кэшу валидаторов (прошлый обход); у
+специальностей без оценки сначала загружается первая страница - она и даёт
+число страниц.
+
+Очередь страниц общая для всех воркеров, поэтому LPT - это приоритет страниц:
+сначала первые страницы специальностей без оценки, затем страницы
+специальностей по убыванию числа страниц. Крупная специальность не остаётся
+одна в хвосте обхода.
+
+После обхода - отчёт: завершение каждой специальности по плану (страницы в
+порядке плана при средней скорости обхода) и на деле.
+"""
+
+REPORT_FIELDS = ['specialty', 'source', 'estimated_pages', 'pages', 'predicted_seconds', 'actual_seconds']
+
+
+class Schedule:
+    """
+    Оценки и факт по специальностям. largest_first=False - порядок как задан
+    (для сравнения), отчёт строится так же.
+    """
+
+    def __init__(self, largest_first=True):
+        self.largest_first = largest_first
+        self.order = []  # специальности в заданном порядке
+        self.estimates = {}  # путь -> (число страниц или None, источник)
+        self.pages = {}  # путь -> число страниц по первой странице
+        self.finished = {}  # путь -> секунд от начала обхода
+
+    def estimate(self, path, pages=None, source='probe'):
+        self.order.append(path)
+        self.estimates[path] = (pages, source if pages is not None else 'probe')
+
+    def set_pages(self, path, pages):
+        self.pages[path] = pages
+
+    def finish(self, path, seconds, pages=None):
+        self.finished[path] = seconds
+        if pages is not None:
+            self.pages[path] = pages
+
+    def expected_pages(self, path):
+        """Число страниц: известное по первой странице, иначе оценка (None - нет оценки)"""
+        if path in self.pages:
+            return self.pages[path]
+        return self.estimates.get(path, (None, None))[0]
+
+    def priority(self, path, page):
+        """Ключ очереди страниц: меньше - раньше"""
+        if not self.largest_first:
+            return ()
+        pages = self.expected_pages(path)
+        if pages is None:
+            return (0, 0, path, page)
+        return (1, -pages, path, page)
+
+    def plan(self):
+        """Специальности в порядке плана: без оценки - первыми, дальше по убыванию оценки"""
+        if not self.largest_first:
+            return list(self.order)
+        return sorted(self.order, key=lambda path: (self.estimates[path][0] is not None,
+                                                    -(self.estimates[path][0] or 0)))
+
+    def report(self):
+        """
+        Строки отчёта в порядке плана. Предсказанное завершение - страницы по
+        плану до этой специальности включительно (оценка, а без неё - факт)
+        делённые на среднюю скорость обхода, страниц в секунду.
+        """
+        done = [path for path in self.plan() if path in self.finished]
+        if not done:
+            return []
+        actual_pages = sum(self.pages.get(path, 0) for path in done)
+        makespan = max(self.finished[path] for path in done)
+        rate = actual_pages / makespan if makespan > 0 else 0.0
+        rows = []
+        planned = 0
+        for path in done:
+            estimated, source = self.estimates[path]
+            pages = self.pages.get(path, 0)
+            planned += estimated if estimated is not None else pages
+            rows.append({
+                'specialty': path,
+                'source': source,
+                'estimated_pages': estimated,
+                'pages': pages,
+                'predicted_seconds': round(planned / rate, 3) if rate else None,
+                'actual_seconds': round(self.finished[path], 3),
+            })
+        return rows
+
+    def format(self):
+        rows = self.report()
+        if not rows:
+            return "специальностей не завершено"
+        estimated = [row for row in rows if row['estimated_pages'] is not None]
+        error = sum(abs(row['estimated_pages'] - row['pages']) for row in estimated)
+        error_rate = error / max(1, sum(row['pages'] for row in estimated)) * 100
+        deviations = [abs(row['predicted_seconds'] - row['actual_seconds']) for row in rows
+                      if row['predicted_seconds'] is not None]
+        deviation = sum(deviations) / len(deviations) if deviations else 0.0
+        predicted = max((row['predicted_seconds'] or 0.0) for row in rows)
+        actual = max(row['actual_seconds'] for row in rows)
+        return (f"{'LPT' if self.largest_first else 'по порядку'}: с оценкой {len(estimated)}/{len(rows)}, "
+                f"ошибка оценки страниц {error_rate:.0f}%, завершение по плану {predicted:.1f}s, "
+                f"на деле {actual:.1f}s, среднее отклонение специальности {deviation:.1f}s")
@@ -4,459 +4,1262 @@
 Примерно в 10 раз быстрее синхронной версии
 """
 
+import argparse
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-import csv
-import json
-import re
+import collections
+import contextlib
+import itertools
 import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import time
+from email.utils import parsedate_to_datetime
 
-BASE_URL = "https://prodoctorov.ru"
+import catalogue
+import delta
+import htmlcache
+import journal
+import metrics
+import pagination
+import parsers
+import scheduler
+import sinks
+import store
+import validators
+
+try:
+    import brotli  # noqa: F401 - aiohttp распаковывает br, только если есть brotli
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# PRODOCTOROV_BASE_URL - например, локальный mockserver.py
+BASE_URL = os.environ.get("PRODOCTOROV_BASE_URL", "https://prodoctorov.ru")
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
+    'Accept-Encoding': ACCEPT_ENCODING,
 }
 
-# Ограничения для предотвращения блокировки
-MAX_CONCURRENT = 10  # Максимум параллельных запросов
-DELAY_BETWEEN_BATCHES = 1.0  # Пауза между батчами
-
-# Все специализации Москвы
-SPECIALTIES = [
-    "/moskva/abdominalniy-hirurg/",
-    "/moskva/akusher/",
-    "/moskva/akusherka/",
-    "/moskva/algolog/",
-    "/moskva/allergolog/",
-    "/moskva/androlog/",
-    "/moskva/anesteziolog-reanimatolog/",
-    "/moskva/arrhythmolog/",
-    "/moskva/artrolog/",
-    "/moskva/afaziolog/",
-    "/moskva/bariatricheskiy-hirurg/",
-    "/moskva/venerolog/",
-    "/moskva/vertebrolog/",
-    "/moskva/kosmetolog/",
-    "/moskva/vrach-lechebnoy-fizkultury/",
-    "/moskva/vrach-obshyay-praktiki/",
-    "/moskva/podolog/",
-    "/moskva/vrach-skoroy-pomoshi/",
-    "/moskva/ultrazvukovoy-diagnost/",
-    "/moskva/vrach-frm/",
-    "/moskva/vrach-efferentnoy-terapii/",
-    "/moskva/gastroenterolog/",
-    "/moskva/gematolog/",
-    "/moskva/gemostaziolog/",
-    "/moskva/genetik/",
-    "/moskva/gepatolog/",
-    "/moskva/geriatr/",
-    "/moskva/ginekolog/",
-    "/moskva/ginekilog-hirurg/",
-    "/moskva/ginekolog-endokrinolog/",
-    "/moskva/gipnolog/",
-    "/moskva/girudoterapevt/",
-    "/moskva/gnatolog/",
-    "/moskva/gnoynyy-hirurg/",
-    "/moskva/gomeopat/",
-    "/moskva/dermatovenerolog/",
-    "/moskva/dermatolog/",
-    "/moskva/detskiy-allergolog/",
-    "/moskva/detskiy-androlog/",
-    "/moskva/detskiy-anesteziolog-reanimatolog/",
-    "/moskva/detskiy-aritmolog/",
-    "/moskva/detskiy-venerolog/",
-    "/moskva/detskiy-vertebrolog/",
-    "/moskva/detskiy-vrach-kosmetolog/",
-    "/moskva/detskiy-vrach-lfk/",
-    "/moskva/detskiy-vrach-uzi/",
-    "/moskva/detskiy-gastroenterolog/",
-    "/moskva/detskiy-gematolog/",
-    "/moskva/detskiy-genetik/",
-    "/moskva/detskiy-gepatolog/",
-    "/moskva/detskiy-ginekolog/",
-    "/moskva/detskiy-ginekolog-endokrinolog/",
-    "/moskva/detskiy-gnatolog/",
-    "/moskva/detskiy-gomeopat/",
-    "/moskva/detskiy-dermatolog/",
-    "/moskva/detskiy-dietolog/",
-    "/moskva/detskiy-immunolog/",
-    "/moskva/detskiy-instruktor-lfk/",
-    "/moskva/detskiy-infekcionist/",
-    "/moskva/detskiy-kardiolog/",
-    "/moskva/detskiy-kineziolog/",
-    "/moskva/detskiy-otorinolaringolog/",
-    "/moskva/detskiy-lor-hirurg/",
-    "/moskva/detskiy-mammolog/",
-    "/moskva/detskiy-manualnyy-terapevt/",
-    "/moskva/detskiy-massagist/",
-    "/moskva/detskiy-mikolog/",
-    "/moskva/detskiy-narkolog/",
-    "/moskva/detskiy-nevrolog/",
-    "/moskva/detskiy-nyayropsiholog/",
-    "/moskva/detskiy-nyayrohirurg/",
-    "/moskva/detskiy-nefrolog/",
-    "/moskva/detskiy-nutriciolog/",
-    "/moskva/detskiy-onkolog/",
-    "/moskva/detskiy-onkolog-dermatolog/",
-    "/moskva/detskiy-ortodont/",
-    "/moskva/detskiy-ortoped-travmatolog/",
-    "/moskva/detskiy-osteopat/",
-    "/moskva/detskiy-otonevrolog/",
-    "/moskva/detskiy-oftalmolog/",
-    "/moskva/detskiy-parodontolog/",
-    "/moskva/detskiy-plasticheskiy-hirurg/",
-    "/moskva/detskiy-podolog/",
-    "/moskva/detskiy-proktolog/",
-    "/moskva/detskiy-psihiatr/",
-    "/moskva/detskiy-psiholog/",
-    "/moskva/detskiy-psihoterapevt/",
-    "/moskva/detskiy-pulmonolog/",
-    "/moskva/detskiy-reabilitolog/",
-    "/moskva/detskiy-revmatolog/",
-    "/moskva/detskiy-rentgenolog/",
-    "/moskva/detskiy-refleksoterapevt/",
-    "/moskva/detskiy-seksolog/",
-    "/moskva/detskiy-somnolog/",
-    "/moskva/detskiy-sosudistyy-hirurg/",
-    "/moskva/detskiy-sportivnyy-vrach/",
-    "/moskva/detskiy-stomatolog/",
-    "/moskva/detskiy-stomatolog-gigienist/",
-    "/moskva/detskiy-stomatolog-ortoped/",
-    "/moskva/detskiy-stomatolog-hirurg/",
-    "/moskva/detskiy-surdolog/",
-    "/moskva/detskiy-torakalnyy-hirurg/",
-    "/moskva/detskiy-travmatolog/",
-    "/moskva/detskiy-triholog/",
-    "/moskva/detskiy-urolog/",
-    "/moskva/detskiy-fizioterapevt/",
-    "/moskva/detskiy-flebolog/",
-    "/moskva/detskiy-foniatr/",
-    "/moskva/detskiy-ftiziatr/",
-    "/moskva/detskiy-hirurg/",
-    "/moskva/detskiy-hirurg-ortoped/",
-    "/moskva/detskiy-hirurg-travmatolog/",
-    "/moskva/detskiy-chelyustno-licevoy-hirurg/",
-    "/moskva/detskiy-endokrinolog/",
-    "/moskva/detskiy-epileptolog/",
-    "/moskva/defektolog/",
-    "/moskva/diabetolog/",
-    "/moskva/dietolog/",
-    "/moskva/immunolog/",
-    "/moskva/instruktor-lfk/",
-    "/moskva/infekcionist/",
-    "/moskva/kardiolog/",
-    "/moskva/kardiohirurg/",
-    "/moskva/kinesiolog/",
-    "/moskva/kistevoy-hirurg/",
-    "/moskva/klinicheskiy-psiholog/",
-    "/moskva/klinicheskiy-pharmakolog/",
-    "/moskva/kosmetolog-estetist/",
-    "/moskva/lazernyy-hirurg/",
-    "/moskva/limfolog/",
-    "/moskva/logoped/",
-    "/moskva/logoped-dlya-vzroslyh/",
-    "/moskva/otorinolaringolog/",
-    "/moskva/lor-hirurg/",
-    "/moskva/maloinvazivnyy-hirurg/",
-    "/moskva/mammolog/",
-    "/moskva/manualnyy-terapevt/",
-    "/moskva/massazhist/",
-    "/moskva/medsestra/",
-    "/moskva/mikolog/",
-    "/moskva/narkolog/",
-    "/moskva/nevrolog/",
-    "/moskva/neuropsiholog/",
-    "/moskva/neyrourolog/",
-    "/moskva/neyrofiziolog/",
-    "/moskva/nyayrohirurg/",
-    "/moskva/neonatolog/",
-    "/moskva/nefrolog/",
-    "/moskva/nutriciolog/",
-    "/moskva/ozhogovyy-hirurg/",
-    "/moskva/onkolog/",
-    "/moskva/onkolog-gematolog/",
-    "/moskva/onkolog-ginekolog/",
-    "/moskva/onkolog-dermatolog/",
-    "/moskva/onkolog-mammolog/",
-    "/moskva/onkolog-proktolog/",
-    "/moskva/onkolog-urolog/",
-    "/moskva/optometrist/",
-    "/moskva/ortoped/",
-    "/moskva/osteopat/",
-    "/moskva/otonevrolog/",
-    "/moskva/oftalmolog/",
-    "/moskva/hirurg-oftalmolog/",
-    "/moskva/parazitolog/",
-    "/moskva/paradontolog/",
-    "/moskva/pediatr/",
-    "/moskva/perinatolog/",
-    "/moskva/plasticheskiy-hirurg/",
-    "/moskva/podolog-estetist/",
-    "/moskva/proktolog/",
-    "/moskva/profpatolog/",
-    "/moskva/psihiatr/",
-    "/moskva/psihoanalitik/",
-    "/moskva/psiholog/",
-    "/moskva/psihoterapevt/",
-    "/moskva/pulmonolog/",
-    "/moskva/radiolog/",
-    "/moskva/radioterapevt/",
-    "/moskva/reabilitolog/",
-    "/moskva/revmatolog/",
-    "/moskva/rentgenolog/",
-    "/moskva/reproduktolog/",
-    "/moskva/refleksoterapevt/",
-    "/moskva/seksolog/",
-    "/moskva/semyaynyy-psiholog/",
-    "/moskva/somnolog/",
-    "/moskva/sosudistyj-hirurg/",
-    "/moskva/specialist-po-grudnomu-vskarmlivaniy/",
-    "/moskva/sportivnyy-vrach/",
-    "/moskva/stomatolog/",
-    "/moskva/stomatolog-gigienist/",
-    "/moskva/stomatolog-implantolog/",
-    "/moskva/ortodont/",
-    "/moskva/stomatolog-ortoped/",
-    "/moskva/stomatolog-hirurg/",
-    "/moskva/stomatolog-endodontist/",
-    "/moskva/sudebno-medicinskiy-ekspert/",
-    "/moskva/surdolog/",
-    "/moskva/terapevt/",
-    "/moskva/toksikolog/",
-    "/moskva/torakalnyy-onkolog/",
-    "/moskva/torakalnyy-hirurg/",
-    "/moskva/travmatolog/",
-    "/moskva/transfuziolog/",
-    "/moskva/triholog/",
-    "/moskva/uroginekolog/",
-    "/moskva/urolog/",
-    "/moskva/feldsher/",
-    "/moskva/fizioterapevt/",
-    "/moskva/fitoterapevt/",
-    "/moskva/flebolog/",
-    "/moskva/foniatr/",
-    "/moskva/ftiziatr/",
-    "/moskva/funkcionalnyy-diagnost/",
-    "/moskva/himioterapevt/",
-    "/moskva/hirurg/",
-    "/moskva/hirurg-ortoped/",
-    "/moskva/hirurg-travmatolog/",
-    "/moskva/hirurg-endokrinolog/",
-    "/moskva/chelyustno-licevoy-hirurg/",
-    "/moskva/embriolog/",
-    "/moskva/endokrinolog/",
-    "/moskva/endoskopist/",
-    "/moskva/epileptolog/",
-    "/moskva/ergoterapevt/",
-]
-
-
-def clean_url(url):
-    if '#' in url:
-        url = url.split('#')[0]
-    return url
-
-
-def clean_text(text):
-    if not text:
-        return ""
-    return ' '.join(text.split())
-
-
-def get_total_from_meta(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    meta = soup.select_one('meta[name="description"]')
-    if meta:
-        content = meta.get('content', '')
-        match = re.search(r'(\d+)\s*(?:врач|доктор|гинеколог|терапевт|педиатр|хирург|специалист)', content, re.IGNORECASE)
-        if match:
-            return int(match.group(1))
-    return None
-
-
-def parse_doctors_from_html(html):
-    doctors = []
-    soup = BeautifulSoup(html, 'html.parser')
-
-    for card in soup.select('div.b-doctor-card[data-doctor-id]'):
-        doctor_id = card.get('data-doctor-id')
-        name = card.get('data-doctor-name', '')
-        link_el = card.select_one('a.b-doctor-card__name-link')
-        href = link_el.get('href') if link_el else None
-
-        rating_el = card.select_one('div.b-stars-rate__progress')
-        rating = None
-        if rating_el:
-            style = rating_el.get('style', '')
-            if 'width:' in style:
-                try:
-                    rating = float(style.split('width:')[1].split('em')[0].strip())
-                except:
-                    pass
-
-        reviews_el = card.select_one('a[href*="#otzivi"]')
-        reviews_count = None
-        if reviews_el:
-            try:
-                reviews_count = int(''.join(filter(str.isdigit, reviews_el.text)))
-            except:
-                pass
-
-        spec_el = card.select_one('div.b-doctor-card__spec')
-        specialty = clean_text(spec_el.get_text()) if spec_el else None
-
-        if href and doctor_id:
-            doctors.append({
-                'id': doctor_id,
-                'name': name,
-                'url': clean_url(BASE_URL + href),
-                'rating': rating,
-                'reviews_count': reviews_count,
-                'specialty_display': specialty,
-            })
-
-    return doctors
-
-
-async def fetch_page(session, url, semaphore):
-    async with semaphore:
-        try:
-            async with session.get(url, headers=HEADERS, timeout=aiohttp.ClientTimeout(total=30)) as resp:
-                return await resp.text()
-        except Exception as e:
+# Параллельность подбирается на лету (AIMD), это её границы
+MIN_CONCURRENT = 1  # Минимум параллельных запросов
+INITIAL_CONCURRENT = 4  # Стартовое значение
+MAX_CONCURRENT = 30  # Потолок параллельных запросов
+REQUEST_TIMEOUT = 30  # Общий таймаут запроса, сек
+DNS_CACHE_TTL = 300  # Кэш DNS, сек
+KEEPALIVE_TIMEOUT = 30  # Сколько держать простаивающее соединение, сек
+THROTTLE_STATUSES = (429, 503)  # Сервер просит сбавить темп
+MAX_RETRY_AFTER = 120.0  # Не ждём по Retry-After дольше этого
+PARSER_BACKEND = parsers.DEFAULT_BACKEND  # bs4 / lxml / selectolax
+PARSE_WORKERS = os.cpu_count() or 1  # Процессов для парсинга HTML
+JOURNAL_FILE = 'moscow_async_journal.jsonl'
+VALIDATOR_CACHE_FILE = 'moscow_validators.sqlite'
+END_OF_DATA_EMPTY = 3  # Столько пустых страниц подряд - конец общего списка
+
+
+def parse_doctors_from_html(html, backend=None):
+    return parsers.parse_doctors(html, backend or PARSER_BACKEND, BASE_URL)
+
+
+def parse_page(html, first_page=False, backend=None, base_url=None):
+    """
+    Разбор страницы списка: (число страниц - только для первой, врачи).
+    Первая страница разбирается один раз сразу на total и карточки. Без total
+    в meta число страниц - None: пагинатор показывает не все страницы, их
+    число ищет discover_pages.
+    """
+    backend = backend or PARSER_BACKEND
+    base_url = base_url or BASE_URL
+    if not first_page:
+        return None, parsers.parse_doctors(html, backend, base_url)
+    analysis = parsers.analyze_page(html, backend, base_url)
+    return analysis['last_page'] if analysis['total'] else None, analysis['doctors']
+
+
+def parse_cached_page(path, first_page=False, backend=None, base_url=None):
+    """parse_page по файлу кэша HTML: чтение и распаковка - там же, где разбор"""
+    return parse_page(htmlcache.read_page(path), first_page, backend, base_url)
+
+
+def reset_scan_stats():
+    """Начало процесса пула: счётчики, унаследованные от родителя при fork, не в счёт"""
+    parsers.FAST_SCAN.take_stats()
+
+
+def parse_counted(parse, *args):
+    """Разбор в процессе пула: (результат, прирост счётчиков самопроверки fastscan этого процесса)"""
+    return parse(*args), parsers.FAST_SCAN.take_stats()
+
+
+def raw_body():
+    """Тело страниц списка - сырыми байтами, если парсер умеет их разбирать (fastscan)"""
+    return PARSER_BACKEND in parsers.BYTES_BACKENDS
+
+
+class ParsePool:
+    """
+    Парсинг HTML в пуле процессов, чтобы не занимать event loop.
+    Разбора ждут не больше max_pending страниц: остальные воркеры загрузки
+    стоят и не копят HTML в памяти. scan_stats - счётчики fastscan всех процессов.
+    """
+
+    def __init__(self, workers=PARSE_WORKERS, max_pending=None, backend=None):
+        self.workers = workers
+        self.backend = backend or PARSER_BACKEND
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=reset_scan_stats)
+        self.slots = asyncio.Semaphore(max_pending or workers * 2)
+        self.scan_stats = {}
+
+    async def _run(self, parse, *args):
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            result, stats = await loop.run_in_executor(self.executor, parse_counted, parse, *args)
+        parsers.add_scan_stats(self.scan_stats, stats)
+        return result
+
+    async def parse(self, html, first_page=False):
+        # backend и BASE_URL передаём явно: в дочернем процессе свои глобальные
+        return await self._run(parse_page, html, first_page, self.backend, BASE_URL)
+
+    async def parse_file(self, path, first_page=False):
+        """Разбор страницы из кэша HTML: в процесс передаётся только путь"""
+        return await self._run(parse_cached_page, path, first_page, self.backend, BASE_URL)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def parse_html(html, first_page=False, pool=None):
+    """Разбор в пуле процессов, а без пула - прямо в event loop"""
+    if pool is None:
+        return parse_page(html, first_page)
+    return await pool.parse(html, first_page)
+
+
+class PageTimings:
+    """Латентность загрузки страниц"""
+
+    def __init__(self):
+        self.latencies = []
+
+    def add_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)
+        return ordered[max(index, 0)]
+
+    def summary(self):
+        return {
+            'pages': len(self.latencies),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
+
+    def format(self):
+        s = self.summary()
+        if not s['pages']:
+            return "страниц: 0"
+        return f"страниц: {s['pages']}, p50: {s['p50']:.3f}s, p99: {s['p99']:.3f}s"
+
+
+class AdaptiveLimiter:
+    """
+    AIMD-регулятор числа параллельных запросов.
+    Пока ответы быстрые и без ошибок - лимит растёт на increase за "окно" запросов,
+    при 429/503, таймаутах, ошибках или росте латентности - умножается на decrease.
+    """
+
+    def __init__(self, initial=INITIAL_CONCURRENT, min_limit=MIN_CONCURRENT, max_limit=MAX_CONCURRENT,
+                 increase=1.0, decrease=0.5, latency_factor=2.0, smoothing=0.2):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+
+        self.limit = float(initial)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.latency = None  # EWMA латентности
+        self.baseline = None  # лучшая наблюдавшаяся EWMA
+        self.requests = 0
+        self.failures = 0
+        self.idle = 0.0  # слото-секунды, когда лимит позволял больше запросов, чем шло
+        self._idle_mark = None
+
+        self.started = time.monotonic()
+        self.history = [(0.0, int(self.limit))]
+        self._cond = asyncio.Condition()
+
+    @property
+    def current(self):
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self):
+        """Ждёт свободного слота и окончания паузы Retry-After, возвращает время старта"""
+        async with self._cond:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < self.current:
+                    break
+                await self._cond.wait()
+            self._track_idle()
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started, status=None, error=None, retry_after=None):
+        """Отдаёт слот и корректирует лимит по результату запроса"""
+        now = time.monotonic()
+        elapsed = now - started
+        self.requests += 1
+
+        throttled = error is not None or status in THROTTLE_STATUSES
+        if not throttled:
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency += self.smoothing * (elapsed - self.latency)
+            if self.baseline is None or self.latency < self.baseline:
+                self.baseline = self.latency
+        else:
+            self.failures += 1
+
+        slow = (self.baseline is not None
+                and self.latency > self.baseline * self.latency_factor)
+
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + min(retry_after, MAX_RETRY_AFTER))
+
+        if throttled or slow:
+            # Одно снижение на "перегрузку": запросы, начатые до прошлого снижения, не в счёт
+            if started >= self.last_decrease:
+                self._set_limit(max(self.min_limit, self.limit * self.decrease))
+                self.last_decrease = now
+                if slow:
+                    # Новая база - текущая латентность, иначе лимит будет падать до минимума
+                    self.baseline = self.latency
+        else:
+            self._set_limit(min(self.max_limit, self.limit + self.increase / max(self.limit, 1.0)))
+
+        async with self._cond:
+            self._track_idle()
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _track_idle(self):
+        now = time.monotonic()
+        if self._idle_mark is not None:
+            self.idle += max(0, self.current - self.in_flight) * (now - self._idle_mark)
+        self._idle_mark = now
+
+    def _set_limit(self, value):
+        before = self.current
+        self.limit = value
+        if self.current != before:
+            self.history.append((round(time.monotonic() - self.started, 3), self.current))
+
+    def summary(self):
+        limits = [limit for _, limit in self.history]
+        return {
+            'current': self.current,
+            'min': min(limits),
+            'max': max(limits),
+            'changes': len(self.history) - 1,
+            'requests': self.requests,
+            'failures': self.failures,
+            'idle': self.idle,
+        }
+
+    def format(self):
+        s = self.summary()
+        return (f"сейчас {s['current']}, диапазон {s['min']}-{s['max']}, изменений {s['changes']}, "
+                f"ошибок {s['failures']}/{s['requests']}, простой слотов {s['idle']:.1f}s")
+
+
+def parse_retry_after(value):
+    """Retry-After в секундах: число или HTTP-дата"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - time.time())
+
+
+class ConnectionStats:
+    """Счётчики соединений сессии: новые, переиспользованные, DNS-кэш"""
+
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+        self.dns_hits = 0
+        self.dns_misses = 0
+
+    def trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, ctx, params):
+            self.created += 1
+
+        async def on_reuse(session, ctx, params):
+            self.reused += 1
+
+        async def on_dns_hit(session, ctx, params):
+            self.dns_hits += 1
+
+        async def on_dns_miss(session, ctx, params):
+            self.dns_misses += 1
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_dns_cache_hit.append(on_dns_hit)
+        trace.on_dns_cache_miss.append(on_dns_miss)
+        return trace
+
+    def format(self):
+        total = self.created + self.reused
+        share = self.reused / total * 100 if total else 0.0
+        return (f"новых {self.created}, переиспользовано {self.reused} ({share:.0f}%), "
+                f"DNS кэш {self.dns_hits}/{self.dns_hits + self.dns_misses}")
+
+
+def create_session(stats=None, max_connections=MAX_CONCURRENT):
+    """
+    Сессия с общим пулом keep-alive соединений, кэшем DNS и лимитом на хост.
+    Заголовки и таймаут задаются на уровне сессии, а не каждого запроса.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=max_connections,
+        limit_per_host=max_connections,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    trace_configs = [stats.trace_config()] if stats is not None else None
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers=HEADERS,
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        trace_configs=trace_configs,
+    )
+
+
+class RetryPolicy:
+    """
+    Повторы запросов: экспоненциальная задержка с полным джиттером и бюджет попыток на URL.
+    Страницы, исчерпавшие бюджет, попадают в dead-letter и повторяются в конце прогона.
+    """
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.requested = set()
+        self.succeeded = set()
+        self.dead_letters = {}  # url -> последняя ошибка
+        self.permanent = {}  # url -> ошибка, которую нет смысла повторять
+        self.second_chance = set()
+        self.retries = 0
+        self.recovered = 0
+
+    def is_retryable(self, status, error):
+        if error is not None:
+            return isinstance(error, (asyncio.TimeoutError, aiohttp.ClientError))
+        return status in THROTTLE_STATUSES or (status is not None and status >= 500)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def record_success(self, url):
+        self.succeeded.add(url)
+        if url in self.second_chance:
+            self.recovered += 1
+
+    def forget(self, url):
+        """Пробная страница за концом списка - не часть обхода и не в счёт полноты"""
+        for urls in (self.requested, self.succeeded, self.second_chance):
+            urls.discard(url)
+        self.dead_letters.pop(url, None)
+        self.permanent.pop(url, None)
+
+    def record_failure(self, url, status, error, retryable):
+        reason = repr(error) if error is not None else f"HTTP {status}"
+        if retryable:
+            self.dead_letters[url] = reason
+        else:
+            self.permanent[url] = reason
+
+    def is_dead(self, url):
+        return url in self.dead_letters
+
+    def failed(self, url):
+        """Страница так и не загрузилась: исчерпала попытки или ошибка без повтора"""
+        return url in self.dead_letters or url in self.permanent
+
+    def requeue(self, url):
+        """Даёт странице из dead-letter ещё один полный бюджет попыток"""
+        self.dead_letters.pop(url, None)
+        self.second_chance.add(url)
+
+    def completeness(self):
+        if not self.requested:
+            return 1.0
+        return len(self.succeeded) / len(self.requested)
+
+    def format(self):
+        return (f"полнота {self.completeness() * 100:.2f}% ({len(self.succeeded)}/{len(self.requested)}), "
+                f"повторов {self.retries}, восстановлено в конце {self.recovered}, "
+                f"потеряно {len(self.dead_letters)}, без повтора {len(self.permanent)}")
+
+
+async def fetch_once(session, url, limiter, timings=None, cache=None, conditional=True, raw=False):
+    """
+    Один запрос: возвращает (html, status, error). С кэшем валидаторов запрос
+    условный, и на 304 вместо html - validators.NOT_MODIFIED. conditional=False -
+    нужно само тело (например, для --html-cache), валидаторы только запоминаются.
+    raw - html сырыми байтами ответа, без декодирования (см. raw_body).
+    """
+    started = await limiter.acquire()
+    status = None
+    error = None
+    retry_after = None
+    size = 0
+    headers = cache.conditional_headers(url) if cache is not None and conditional else None
+    metrics.IN_FLIGHT.inc()
+    try:
+        async with session.get(url, headers=headers) as resp:
+            status = resp.status
+            if status in THROTTLE_STATUSES:
+                retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                return None, status, None
+            if status == 304 and headers:
+                return validators.NOT_MODIFIED, status, None
+            if status >= 400:
+                return None, status, None
+            body = await resp.read()
+            size = len(body)
+            html = body if raw else await resp.text()
+            if cache is not None:
+                cache.remember(url, resp.headers)
+            return html, status, None
+    except Exception as e:
+        error = e
+        return None, status, error
+    finally:
+        latency = time.monotonic() - started
+        metrics.IN_FLIGHT.dec()
+        metrics.observe_fetch(url, status, latency, size)
+        if timings is not None:
+            timings.add_latency(latency)
+        await limiter.release(started, status, error, retry_after)
+
+
+async def fetch_page(session, url, limiter, timings=None, retry=None, cache=None, conditional=True, raw=False):
+    """Загружает страницу; с retry - повторяет временные ошибки, иначе одна попытка"""
+    if retry is None:
+        html, _, _ = await fetch_once(session, url, limiter, timings, cache, conditional, raw)
+        return html
+
+    retry.requested.add(url)
+    for attempt in range(retry.max_attempts):
+        html, status, error = await fetch_once(session, url, limiter, timings, cache, conditional, raw)
+        if html is not None:
+            retry.record_success(url)
+            return html
+
+        retryable = retry.is_retryable(status, error)
+        if not retryable or attempt + 1 == retry.max_attempts:
+            retry.record_failure(url, status, error, retryable)
             return None
 
+        # Ждём вне слота лимитера, чтобы остальные запросы продолжали идти
+        retry.retries += 1
+        metrics.RETRIES.inc()
+        metrics.event('retry', url=url, status=status, attempt=attempt + 1)
+        await asyncio.sleep(retry.backoff(attempt))
 
-async def scrape_specialty(session, semaphore, specialty_path):
-    """Собирает всех врачей по одной специальности"""
+
+async def fetch_pages(session, limiter, urls, timings=None, retry=None, handle=None):
+    """
+    Загружает urls скользящим окном: новый запрос стартует, как только освободился слот.
+    Возвращает html (или None) в порядке urls. Если задана корутина handle,
+    html сразу отдаётся ей, а в результат попадает то, что она вернула.
+    """
+    results = [None] * len(urls)
+
+    async def run(indices):
+        pending = collections.deque(indices)
+
+        async def worker():
+            while pending:
+                index = pending.popleft()
+                html = await fetch_page(session, urls[index], limiter, timings, retry)
+                if html is not None and handle is not None:
+                    html = await handle(html)
+                results[index] = html
+
+        await asyncio.gather(*(worker() for _ in range(min(limiter.max_limit, len(pending)))))
+
+    await run(range(len(urls)))
+
+    if retry is not None:
+        # Финальный проход по dead-letter
+        dead = [index for index, url in enumerate(urls) if retry.is_dead(url)]
+        for index in dead:
+            retry.requeue(urls[index])
+        if dead:
+            await run(dead)
+
+    return results
+
+
+def page_url(specialty_path, page):
+    first_url = BASE_URL + specialty_path
+    return first_url if page == 1 else f"{first_url}?page={page}"
+
+
+def specialty_name_from_path(specialty_path):
+    return specialty_path.strip('/').split('/')[-1]
+
+
+def needs_body(html_cache, specialty_path, page):
+    """Страницы нет в --html-cache - условный запрос не годится: на 304 сохранять нечего"""
+    return html_cache is not None and not html_cache.has(specialty_path, page)
+
+
+def save_html(html_cache, specialty_path, page, html):
+    if html is validators.NOT_MODIFIED:
+        html_cache.touch(specialty_path, page)
+    else:
+        html_cache.put(specialty_path, page, html)
+
+
+async def parse_listing(url, html, first_page=False, pool=None, cache=None):
+    """parse_html с кэшем валидаторов: на 304 или при том же хэше тела разбор не нужен"""
+    if cache is not None:
+        if html is validators.NOT_MODIFIED:
+            return cache.cached_result(url)
+        digest, cached = cache.match_body(url, html)
+        if cached is not None:
+            return cached
+    # С пулом это время вместе с ожиданием свободного процесса
+    started = time.monotonic()
+    page_count, doctors = await parse_html(html, first_page, pool)
+    metrics.observe_parse(url, time.monotonic() - started)
+    if cache is not None:
+        cache.store(url, digest, page_count, doctors)
+    return page_count, doctors
+
+
+async def discover_pages(session, limiter, specialty_path, first_doctors, timings=None, retry=None, pool=None,
+                         cache=None, html_cache=None, hint=None):
+    """
+    Число страниц специальности без total в meta: галоп и двоичный поиск
+    (pagination.PageCountSearch), страницы каждого шага качаются параллельно.
+    hint - число страниц по каталогу, проверяется первым.
+    Возвращает (last_page, {page: doctors}) - непустые пробные страницы
+    повторно не загружаются. Не загрузившаяся пробная страница остаётся в
+    last_page и в dead-letter: её загрузит обход, как обычную.
+    """
     first_url = BASE_URL + specialty_path
-    html = await fetch_page(session, first_url, semaphore)
+    first_ids = {doc['id'] for doc in first_doctors}
+    search = pagination.PageCountSearch(hint=hint)
+    found = {}
+
+    async def probe(page):
+        """(page, врачи); врачи None - не загрузилась, [] - пустая"""
+        url = f"{first_url}?page={page}"
+        html = await fetch_page(session, url, limiter, timings, retry, cache,
+                                conditional=not needs_body(html_cache, specialty_path, page), raw=raw_body())
+        if html is None and retry is not None and url not in retry.permanent:
+            return page, None
+        doctors = []
+        if html:
+            _, doctors = await parse_listing(url, html, False, pool, cache)
+        if pagination.is_empty_page(doctors, first_ids):
+            # 404 и прочие ошибки без повтора за концом списка - та же пустая страница
+            if retry is not None:
+                retry.forget(url)
+            return page, []
+        if html_cache is not None:
+            save_html(html_cache, specialty_path, page, html)
+        return page, doctors
+
+    while True:
+        pages = search.next_pages()
+        if not pages:
+            break
+        for page, doctors in await asyncio.gather(*(probe(page) for page in pages)):
+            if doctors is None:
+                search.record_failure(page)
+            else:
+                search.record(page, bool(doctors))
+            if doctors:
+                found[page] = doctors
 
-    if not html:
-        return []
+    metrics.event('pagination', specialty=specialty_path, last_page=search.last_page, probed=search.probed)
+    return search.last_page, {page: doctors for page, doctors in found.items() if page <= search.last_page}
 
-    total = get_total_from_meta(html)
-    if not total:
-        # Fallback - парсим только первую страницу
-        return parse_doctors_from_html(html)
 
-    last_page = math.ceil(total / 20)
-    all_doctors = parse_doctors_from_html(html)
+async def discover_catalogue(session, limiter, specialty_catalogue, cities, ttl_days=catalogue.INDEX_TTL_DAYS,
+                             timings=None):
+    """
+    Обновляет каталог городов, чей индекс устарел: главная страница города
+    качается один раз. Возвращает {город: число специальностей} - 0, если
+    индекс не загрузился или в нём не нашлось специальностей.
+    """
+    stale = [city for city in cities if specialty_catalogue.is_stale(city, ttl_days)]
+    urls = [BASE_URL + catalogue.index_path(city) for city in stale]
+    found = {}
+    for city, html in zip(stale, await fetch_pages(session, limiter, urls, timings, RetryPolicy())):
+        found[city] = specialty_catalogue.load_index(city, html) if html else 0
+    return found
 
-    # Генерируем URL для всех страниц
-    page_urls = [f"{first_url}?page={page}" for page in range(2, last_page + 1)]
 
-    # Загружаем все страницы батчами
-    for i in range(0, len(page_urls), MAX_CONCURRENT):
-        batch = page_urls[i:i + MAX_CONCURRENT]
-        tasks = [fetch_page(session, url, semaphore) for url in batch]
-        results = await asyncio.gather(*tasks)
+async def probe_specialties(session, limiter, specialties, timings=None, retry=None):
+    """Первые страницы специальностей для дельта-режима: analyze_page (или None) в порядке specialties"""
+    async def analyze(html):
+        return parsers.analyze_page(html, PARSER_BACKEND, BASE_URL)
 
-        for html in results:
+    urls = [BASE_URL + path for path in specialties]
+    return await fetch_pages(session, limiter, urls, timings, retry, handle=analyze)
+
+
+class ScheduledJobs(asyncio.PriorityQueue):
+    """Очередь страниц (specialty_path, page) в порядке scheduler.Schedule; равные - в порядке добавления"""
+
+    def __init__(self, schedule):
+        super().__init__()
+        self.schedule = schedule
+        self._sequence = itertools.count()
+
+    def put_nowait(self, job):
+        super().put_nowait((self.schedule.priority(*job), next(self._sequence), job))
+
+    def get_nowait(self):
+        return super().get_nowait()[2]
+
+
+async def crawl_worker(session, limiter, jobs, results, deferred, timings=None, retry=None, pool=None,
+                       done=frozenset(), cache=None, html_cache=None, hints=None, schedule=None):
+    """
+    Воркер общей очереди: качает страницу и отдаёт результат с пометкой специальности.
+    Исключение (упавший пул парсинга, ошибка SQLite, парсера) уходит в results -
+    crawl поднимет его, а не будет ждать очередь вечно.
+    """
+    while True:
+        specialty_path, page = await jobs.get()
+        try:
+            metrics.start_specialty(specialty_name_from_path(specialty_path))
+            url = page_url(specialty_path, page)
+            html = await fetch_page(session, url, limiter, timings, retry, cache,
+                                    conditional=not needs_body(html_cache, specialty_path, page), raw=raw_body())
+
+            if html is None and retry is not None and retry.is_dead(url) and url not in retry.second_chance:
+                # Откладываем до прохода по dead-letter, второй раз - уже нет
+                deferred.append((specialty_path, page))
+                continue
+
+            last_page = None
+            doctors = []
+            probed = {}
             if html:
-                doctors = parse_doctors_from_html(html)
-                all_doctors.extend(doctors)
+                if html_cache is not None:
+                    save_html(html_cache, specialty_path, page, html)
+                page_count, doctors = await parse_listing(url, html, page == 1, pool, cache)
+                if page == 1:
+                    if page_count is None:
+                        hint = hints.get(specialty_path) if hints else None
+                        page_count, probed = await discover_pages(session, limiter, specialty_path, doctors, timings,
+                                                                  retry, pool, cache, html_cache, hint)
+                    last_page = page_count
+                    if schedule is not None:
+                        schedule.set_pages(specialty_path, last_page)
+                    for next_page in range(2, last_page + 1):
+                        if (specialty_path, next_page) not in done and next_page not in probed:
+                            jobs.put_nowait((specialty_path, next_page))
+            elif page == 1:
+                last_page = 1
+
+            results.put_nowait((specialty_path, page, last_page, doctors))
+            # Страницы, загруженные при поиске числа страниц, - сразу за первой
+            for probed_page, probed_doctors in sorted(probed.items()):
+                if (specialty_path, probed_page) not in done:
+                    results.put_nowait((specialty_path, probed_page, None, probed_doctors))
+        except Exception as e:
+            results.put_nowait(e)
+            return
+        finally:
+            jobs.task_done()
+
+
+async def crawl(session, limiter, specialties, timings=None, retry=None, pool=None, resume=None, cache=None,
+                html_cache=None, hints=None, schedule=None):
+    """
+    Обходит все специализации через одну общую очередь страниц.
+    Отдаёт (specialty_path, page, last_page, doctors) по мере загрузки;
+    last_page известен только для первой страницы.
+    Страницы из dead-letter повторяются один раз, когда очередь опустела.
+    resume (journal.ResumeState) - уже готовые страницы пропускаются.
+    cache (validators.ValidatorCache) - условные запросы и повторное использование разбора.
+    html_cache (htmlcache.RawHtmlCache) - куда складывать сырой HTML загруженных страниц.
+    hints - {specialty_path: число страниц} по каталогу для поиска, когда в meta нет total.
+    schedule (scheduler.Schedule) - порядок страниц в очереди, иначе по порядку specialties.
+    """
+    jobs = ScheduledJobs(schedule) if schedule is not None else asyncio.Queue()
+    results = asyncio.Queue()
+    deferred = []
+    done = resume.done if resume is not None else frozenset()
+
+    for specialty_path in specialties:
+        last_page = resume.last_pages.get(specialty_path) if resume is not None else None
+        if last_page is None:
+            jobs.put_nowait((specialty_path, 1))
+            continue
+        # Первая страница уже в журнале - число страниц известно
+        for page in range(2, last_page + 1):
+            if (specialty_path, page) not in done:
+                jobs.put_nowait((specialty_path, page))
+
+    tasks = [
+        asyncio.create_task(crawl_worker(session, limiter, jobs, results, deferred, timings, retry, pool, done, cache,
+                                             html_cache, hints, schedule))
+        for _ in range(limiter.max_limit)
+    ]
+
+    async def close_when_done():
+        await jobs.join()
+        # Страницы, найденные на проходе по dead-letter, тоже получают свой второй шанс
+        while deferred:
+            for specialty_path, page in deferred:
+                retry.requeue(page_url(specialty_path, page))
+                jobs.put_nowait((specialty_path, page))
+            deferred.clear()
+            await jobs.join()
+        results.put_nowait(None)
+
+    closer = asyncio.create_task(close_when_done())
+
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        closer.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(closer, *tasks, return_exceptions=True)
+
+
+async def crawl_listing(session, limiter, listing_path, timings=None, retry=None, pool=None, resume=None,
+                        cache=None, first_page=1, last_page=None, first_ids=()):
+    """
+    Обход одного общего списка (например /moskva/vrach/) без деления на специальности.
+    Страницы раздаются воркерам по возрастанию и приходят в любом порядке - тот же
+    поток (listing_path, page, last_page, doctors), что у crawl; last_page первой
+    страницы - оценка по meta. Конец данных - END_OF_DATA_EMPTY пустых страниц
+    подряд: дальше страницы не раздаются, даже если meta обещала больше, и
+    раздаются дальше оценки, пока конец не найден. Одиночные пустые страницы до
+    конца и не загрузившиеся страницы повторяются один раз в конце прогона.
+    first_page/last_page - только этот диапазон страниц (шард, см. shards.py);
+    first_ids - id врачей первой страницы, если её загружает не этот обход:
+    без них страница за концом, которую сайт отдаёт как первую, - не пустая.
+    """
+    first_url = BASE_URL + listing_path
+    done = resume.done if resume is not None else frozenset()
+    results = asyncio.Queue()
+    empty = set()
+    failed = []
+    first_ids = set(first_ids)
+    # end - последняя страница с данными, когда конец найден; до того - стоп-кран в две оценки
+    state = {'next': max(2, first_page), 'end': None, 'limit': None}
 
-        if i > 0 and i % 100 == 0:
-            await asyncio.sleep(DELAY_BETWEEN_BATCHES)
+    def page_url(page):
+        return first_url if page == 1 else f"{first_url}?page={page}"
 
-    return all_doctors
+    async def load(page):
+        """(число страниц, врачи); врачи None - не загрузилась, [] - пустая"""
+        url = page_url(page)
+        html = await fetch_page(session, url, limiter, timings, retry, cache, raw=raw_body())
+        if html is None:
+            # 404 и прочие ошибки без повтора за концом списка - та же пустая страница
+            return None, [] if retry is None or url in retry.permanent else None
+        page_count, doctors = await parse_listing(url, html, page == 1, pool, cache)
+        if page > 1 and pagination.is_empty_page(doctors, first_ids):
+            doctors = []
+        return page_count, doctors
 
+    def mark_empty(page):
+        empty.add(page)
+        for start in range(page - END_OF_DATA_EMPTY + 1, page + 1):
+            if all(start + offset in empty for offset in range(END_OF_DATA_EMPTY)):
+                if state['end'] is None or start - 1 < state['end']:
+                    state['end'] = start - 1
+                    metrics.event('end_of_data', listing=listing_path, last_page=state['end'])
+
+    def has_next():
+        bound = state['end'] if state['end'] is not None else state['limit']
+        if last_page is not None:
+            bound = last_page if bound is None else min(bound, last_page)
+        return bound is None or state['next'] <= bound
+
+    async def worker():
+        while has_next():
+            page = state['next']
+            state['next'] += 1
+            if (listing_path, page) in done:
+                continue
+            _, doctors = await load(page)
+            if doctors is None:
+                failed.append(page)
+            elif doctors:
+                results.put_nowait((listing_path, page, None, doctors))
+            else:
+                mark_empty(page)
+
+    async def run():
+        estimate = resume.last_pages.get(listing_path) if resume is not None else None
+        if first_page == 1 and (listing_path, 1) not in done:
+            estimate, doctors = await load(1)
+            first_ids.update(doc['id'] for doc in doctors or [])
+            results.put_nowait((listing_path, 1, estimate, doctors or []))
+        if estimate:
+            state['limit'] = 2 * estimate
+        workers = [asyncio.create_task(worker()) for _ in range(limiter.max_limit)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+
+        # Второй шанс: не загрузившиеся и одиночные пустые страницы до конца данных
+        end = state['end'] or state['next'] - 1
+        suspicious = sorted(page for page in empty if page <= end) + [page for page in failed if page <= end]
+        for page in failed:
+            if retry is not None:
+                retry.requeue(page_url(page))
+        for page, (_, doctors) in zip(suspicious, await asyncio.gather(*(load(page) for page in suspicious))):
+            if doctors:
+                empty.discard(page)
+                results.put_nowait((listing_path, page, None, doctors))
+        # Пустые страницы и всё, что за концом данных, - не часть обхода
+        if retry is not None:
+            for page in empty.union(page for page in failed if page > end):
+                retry.forget(page_url(page))
+
+    async def run_or_report():
+        # Ошибка воркера - в поток результатов, иначе потребитель ждал бы конца вечно
+        try:
+            await run()
+        except Exception as e:
+            results.put_nowait(e)
+        else:
+            results.put_nowait(None)
+
+    runner = asyncio.create_task(run_or_report())
+    try:
+        while True:
+            item = await results.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await runner
+    finally:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+
+async def reparse_cache(html_cache, specialties, pool=None, resume=None):
+    """
+    Тот же поток (specialty_path, page, last_page, doctors), что у crawl, но из кэша
+    HTML и без сети. Страницы разбираются в пуле процессов; готовые по журналу пропускаются.
+    """
+    done = resume.done if resume is not None else frozenset()
+
+    async def parse(specialty_path, page, path, cached_last):
+        metrics.start_specialty(specialty_name_from_path(specialty_path))
+        started = time.monotonic()
+        if pool is not None:
+            last_page, doctors = await pool.parse_file(path, page == 1)
+        else:
+            last_page, doctors = parse_cached_page(path, page == 1)
+        metrics.observe_parse(path, time.monotonic() - started)
+        if page == 1 and last_page is None:
+            # Без total в meta - сколько страниц нашёл поиск при обходе, столько и в кэше
+            last_page = cached_last
+        return specialty_path, page, last_page, doctors
+
+    tasks = []
+    for specialty_path in specialties:
+        pages = html_cache.pages(specialty_path)
+        tasks += [
+            asyncio.ensure_future(parse(specialty_path, page, path, max(pages)))
+            for page, path in sorted(pages.items())
+            if (specialty_path, page) not in done
+        ]
+    for task in asyncio.as_completed(tasks):
+        yield await task
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Асинхронный сбор врачей Москвы с prodoctorov.ru")
+    parser.add_argument('--city', action='append', metavar='CITY',
+                        help=f"город из адреса сайта (можно несколько): {', '.join(catalogue.CITIES)}; "
+                             f"по умолчанию {catalogue.DEFAULT_CITY}")
+    parser.add_argument('--catalogue', default=catalogue.CATALOGUE_FILE, metavar='PATH',
+                        help='каталог специальностей по городам ("" - без файла)')
+    parser.add_argument('--index-ttl', type=float, default=catalogue.INDEX_TTL_DAYS, metavar='DAYS',
+                        help='через сколько дней заново загружать список специальностей с сайта')
+    parser.add_argument('--no-index', action='store_true',
+                        help='не загружать список специальностей, только каталог на диске')
+    parser.add_argument('--schedule', choices=['lpt', 'fifo'], default='lpt',
+                        help='порядок специальностей: lpt - самые долгие первыми, fifo - по каталогу')
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS,
+                        help='процессов для парсинга HTML (0 - парсить в event loop)')
+    parser.add_argument('--parser', choices=list(parsers.BACKENDS), default=PARSER_BACKEND,
+                        help='движок парсинга (fastscan - регулярки с выборочной сверкой)')
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help='адрес сайта, например локальный mockserver.py (или PRODOCTOROV_BASE_URL)')
+    parser.add_argument('--journal', default=JOURNAL_FILE, help='журнал готовых страниц')
+    parser.add_argument('--resume', action='store_true',
+                        help='продолжить прерванный обход по журналу, пропуская готовые страницы')
+    parser.add_argument('--validator-cache', default=VALIDATOR_CACHE_FILE, metavar='PATH',
+                        help='кэш ETag/Last-Modified/хэша страниц ("" - без кэша)')
+    parser.add_argument('--delta', metavar='PREVIOUS',
+                        help='дельта-обход относительно прошлого прогона (.sqlite или moscow_doctors_full_*.json)')
+    parser.add_argument('--html-cache', metavar='DIR', help='сохранять сжатый HTML страниц в DIR')
+    parser.add_argument('--html-cache-size', type=int, default=htmlcache.MAX_CACHE_BYTES // 1024 ** 2,
+                        metavar='MB', help='предел размера кэша HTML, старые страницы вытесняются')
+    parser.add_argument('--reparse-from-cache', action='store_true',
+                        help='без сети: разобрать заново страницы из --html-cache')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='отдавать метрики Prometheus на http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-timeline', metavar='PATH', help='писать ленту событий JSON Lines в PATH')
+    args = parser.parse_args(argv)
+    if args.reparse_from_cache and not args.html_cache:
+        parser.error('--reparse-from-cache требует --html-cache')
+    if args.reparse_from_cache and args.delta:
+        parser.error('--reparse-from-cache и --delta несовместимы')
+    if args.delta and args.city and len(args.city) > 1:
+        parser.error('--delta - только для одного города')
+    return args
+
+
+async def main(args):
+    global PARSER_BACKEND, BASE_URL
+    PARSER_BACKEND = args.parser
+    BASE_URL = args.base_url.rstrip('/')
+
+    start_time = datetime.now()
+    if args.resume and os.path.exists(args.journal):
+        header, entries = journal.read_journal(args.journal)
+        cities = header.get('cities') or [catalogue.DEFAULT_CITY]
+    else:
+        header = None
+        cities = list(dict.fromkeys(args.city or [catalogue.DEFAULT_CITY]))
+    limiter = AdaptiveLimiter()
+    timings = PageTimings()
+    connections = ConnectionStats()
+    retry = RetryPolicy()
+
+    # Список специальностей - с сайта раз в --index-ttl дней, в остальное время из файла
+    specialty_catalogue = catalogue.Catalogue(args.catalogue)
+    if header is None and not args.no_index and not args.reparse_from_cache:
+        async with create_session(connections) as session:
+            found = await discover_catalogue(session, limiter, specialty_catalogue, cities, args.index_ttl, timings)
+        for city, count in found.items():
+            if count:
+                print(f"Каталог {city}: {count} специальностей с сайта")
+            else:
+                print(f"Каталог {city}: список с сайта не загружен, остаётся прежний")
+        specialty_catalogue.save()
+    # Пары (город, специальность) вперемешку по городам - города обходятся параллельно
+    specialties = specialty_catalogue.jobs(cities)
+    # Число страниц по индексу - подсказка для поиска, когда в meta нет total
+    hints = {}
+    for path in specialties:
+        count = specialty_catalogue.count(path)
+        if count is not None:
+            hints[path] = catalogue.estimate_pages(count)
 
-async def main():
     print("=" * 60)
-    print("АСИНХРОННЫЙ СБОР ВРАЧЕЙ МОСКВЫ")
-    print(f"Специализаций: {len(SPECIALTIES)}")
-    print(f"Параллельных запросов: {MAX_CONCURRENT}")
+    print(f"АСИНХРОННЫЙ СБОР ВРАЧЕЙ: {', '.join(catalogue.CITIES.get(city, city) for city in cities)}")
+    print(f"Специализаций: {len(specialties)}")
+    print(f"Параллельных запросов: {MIN_CONCURRENT}-{MAX_CONCURRENT} (адаптивно)")
+    print(f"Процессов парсинга: {args.parse_workers or 'нет, в event loop'}, парсер: {args.parser}")
     print("=" * 60)
 
-    start_time = datetime.now()
-    all_doctors = {}
+    metrics_server = metrics.serve(args.metrics_port) if args.metrics_port else None
+    if args.metrics_timeline:
+        metrics.start_timeline(args.metrics_timeline)
+
+    resume = journal.ResumeState()
+    if header is not None:
+        timestamp = header['timestamp']
+        previous_path = header.get('delta')
+        log = journal.CrawlJournal(args.journal)
+    else:
+        timestamp = start_time.strftime("%Y%m%d_%H%M%S")
+        previous_path = args.delta
+        log = journal.CrawlJournal(args.journal, header={'timestamp': timestamp, 'delta': previous_path,
+                                                         'cities': cities})
+
+    # Итоговые файлы - отдельно по каждому городу
+    outputs = {}
+    for city in cities:
+        prefix = catalogue.output_prefix(city)
+        outputs[city] = {
+            'stats': f"{prefix}_doctors_stats_{timestamp}.csv",
+            'csv': f"{prefix}_doctors_full_{timestamp}.csv",
+            'json': f"{prefix}_doctors_full_{timestamp}.json",
+            'db': f"{prefix}_doctors_{timestamp}.sqlite",
+            'diff': f"{prefix}_doctors_delta_{timestamp}.json",
+        }
+
+    # Базы городов наполняются по ходу: записи журнала при продолжении, затем каждая
+    # загруженная страница - журнал читается один раз
+    stores = {city: store.fresh_store(files['db']) for city, files in outputs.items()}
+    snapshots = {city: {} for city in cities}
+
+    def keep(entry):
+        city = catalogue.city_from_path(entry['specialty'])
+        name = specialty_name_from_path(entry['specialty'])
+        stores[city].add(entry['doctors'], name)
+        if entry['page'] == 1:
+            snapshots[city][name] = delta.entry_snapshot(entry)
+
+    if header is not None:
+        for entry in entries:
+            if resume.add(entry):
+                keep(entry)
+        print(f"Продолжаем по журналу {args.journal}: готово страниц {len(resume.done)}")
+
+    previous = delta.open_previous(previous_path) if previous_path else None
+    if previous is not None:
+        # Сначала только первые страницы: неизменённые специальности берутся из прошлой базы
+        previous_snapshots = previous.snapshots()
+        probe_paths = [path for path in specialties if path not in resume.last_pages]
+        async with create_session(connections) as session:
+            probes = await probe_specialties(session, limiter, probe_paths, timings, retry)
+        carried = 0
+        for path, analysis in zip(probe_paths, probes):
+            if analysis is None or analysis['total'] is None:
+                continue  # не загрузилась или число страниц неизвестно - пойдёт обычным обходом
+            current = delta.snapshot(analysis)
+            name = specialty_name_from_path(path)
+            if delta.is_unchanged(previous_snapshots.get(name), current):
+                # Вся специальность - одной записью журнала, как будто страница одна
+                doctors = list(previous.specialty_doctors(name))
+                entry = log.record(path, 1, doctors, 1, **current)
+                carried += 1
+            else:
+                entry = log.record(path, 1, analysis['doctors'], analysis['last_page'], **current)
+            if resume.add(entry):
+                keep(entry)
+        print(f"Дельта: без изменений {carried} из {len(probe_paths)} специальностей, "
+              f"перезагружаются {len(probe_paths) - carried}")
+
+    # В памяти только id для подсчёта новых, сами врачи сразу уходят в журнал
+    seen_ids = resume.seen_ids
     stats = []
 
-    semaphore = asyncio.Semaphore(MAX_CONCURRENT)
-
-    async with aiohttp.ClientSession() as session:
-        for i, specialty in enumerate(SPECIALTIES, 1):
-            specialty_name = specialty.strip('/').split('/')[-1]
-            print(f"\n[{i}/{len(SPECIALTIES)}] {specialty_name}", end=" ", flush=True)
-
-            doctors = await scrape_specialty(session, semaphore, specialty)
-
-            new_count = 0
-            for doc in doctors:
-                doc_id = doc['id']
-                if doc_id not in all_doctors:
-                    all_doctors[doc_id] = doc
-                    all_doctors[doc_id]['specialties'] = []
-                    new_count += 1
-                if doc.get('rating') and not all_doctors[doc_id].get('rating'):
-                    all_doctors[doc_id]['rating'] = doc['rating']
-                if doc.get('reviews_count') and not all_doctors[doc_id].get('reviews_count'):
-                    all_doctors[doc_id]['reviews_count'] = doc['reviews_count']
-                all_doctors[doc_id]['specialties'].append(specialty_name)
-
-            print(f"-> {len(doctors)} найдено, {new_count} новых, всего: {len(all_doctors)}")
-
-            stats.append({
-                'specialty': specialty_name,
-                'total': len(doctors),
-                'new': new_count
-            })
-
-            # Checkpoint каждые 20 специализаций
-            if i % 20 == 0:
-                with open('moscow_async_checkpoint.json', 'w', encoding='utf-8') as f:
-                    json.dump({
-                        'doctors': list(all_doctors.values()),
-                        'stats': stats,
-                        'last_index': i
-                    }, f, ensure_ascii=False)
-                print(f"  [Checkpoint: {len(all_doctors)} врачей]")
-
-            await asyncio.sleep(0.5)  # Пауза между специализациями
-
-    # Сохранение результатов
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    csv_file = f"moscow_doctors_full_{timestamp}.csv"
-    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['id', 'name', 'url', 'rating', 'reviews_count', 'specialty_display', 'specialties'])
-        for doc in all_doctors.values():
-            writer.writerow([
-                doc['id'],
-                doc['name'],
-                doc['url'],
-                doc.get('rating', ''),
-                doc.get('reviews_count', ''),
-                doc.get('specialty_display', ''),
-                '; '.join(doc.get('specialties', []))
-            ])
-
-    json_file = f"moscow_doctors_full_{timestamp}.json"
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(list(all_doctors.values()), f, ensure_ascii=False, indent=2)
-
-    stats_file = f"moscow_doctors_stats_{timestamp}.csv"
-    with open(stats_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=['specialty', 'total', 'new'])
-        writer.writeheader()
-        writer.writerows(stats)
+    # Прогресс по каждой специальности: сколько страниц ждём и сколько пришло
+    progress = {
+        path: {
+            'last_page': resume.last_pages.get(path),
+            'pages': resume.pages.get(path, 0),
+            'total': resume.found.get(path, 0),
+            'new': resume.new.get(path, 0),
+            'failed': 0,
+        }
+        for path in specialties
+    }
+    finished = [path for path in specialties if resume.is_complete(path)]
+    pending = [path for path in specialties if not resume.is_complete(path)]
+    done_count = len(finished)
+
+    pool = ParsePool(args.parse_workers, backend=args.parser) if args.parse_workers > 0 else None
+    cache = None
+    if args.validator_cache and not args.reparse_from_cache:
+        cache = validators.ValidatorCache(args.validator_cache, parser=parsers.parser_identity(args.parser))
+    html_cache = None
+    if args.html_cache:
+        html_cache = htmlcache.RawHtmlCache(args.html_cache, args.html_cache_size * 1024 ** 2)
+
+    # План обхода: число страниц - по журналу, индексу города или прошлому обходу, иначе по первой странице
+    schedule = scheduler.Schedule(largest_first=args.schedule == 'lpt')
+    for path in pending:
+        cached = cache.cached_last_page(BASE_URL + path) if cache is not None else None
+        if path in resume.last_pages:
+            schedule.estimate(path, resume.last_pages[path], 'journal')
+        elif path in hints:
+            schedule.estimate(path, hints[path], 'index')
+        else:
+            schedule.estimate(path, cached, 'cache')
+
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(log)
+        # Статистика пересобирается: готовые по журналу специальности - сразу
+        stats_sinks = {}
+        for city, files in outputs.items():
+            if os.path.exists(files['stats']):
+                os.remove(files['stats'])
+            stats_sinks[city] = stack.enter_context(sinks.CsvAppendSink(files['stats'], ['specialty', 'total', 'new']))
+        for path in finished:
+            state = progress[path]
+            row = {'specialty': specialty_name_from_path(path), 'total': state['total'], 'new': state['new']}
+            stats.append(row)
+            stats_sinks[catalogue.city_from_path(path)].write(row)
+
+        # Завершение специальности в плане - от начала общего обхода: страницы всех специальностей идут вперемешку
+        crawl_started = time.monotonic()
+        async with create_session(connections) as session:
+            if args.reparse_from_cache:
+                pages = reparse_cache(html_cache, pending, pool, resume)
+            else:
+                pages = crawl(session, limiter, pending, timings=timings, retry=retry, pool=pool, resume=resume,
+                              cache=cache, html_cache=html_cache, hints=hints, schedule=schedule)
+            async for specialty, page, last_page, doctors in pages:
+                specialty_name = specialty_name_from_path(specialty)
+                state = progress[specialty]
+
+                # Не загрузившаяся страница - в журнал с пометкой: --resume загрузит её снова
+                failed = retry.failed(page_url(specialty, page))
+                entry = log.record(specialty, page, doctors, last_page, **({'failed': True} if failed else {}))
+                if not failed:
+                    keep(entry)
+                state['failed'] += failed
+                metrics.observe_page(specialty_name, page, len(doctors))
+                for doc in doctors:
+                    if doc['id'] not in seen_ids:
+                        seen_ids.add(doc['id'])
+                        state['new'] += 1
+                state['total'] += len(doctors)
+                state['pages'] += 1
+                if last_page is not None:
+                    state['last_page'] = last_page
+
+                if state['last_page'] is None or state['pages'] < state['last_page']:
+                    continue
+
+                done_count += 1
+                schedule.finish(specialty, time.monotonic() - crawl_started, state['last_page'])
+                # doctors/s - от первой страницы этой специальности, взятой воркером
+                metrics.observe_specialty(specialty_name, state['total'])
+                print(f"[{done_count}/{len(specialties)}] {specialty} "
+                      f"-> {state['total']} найдено, {state['new']} новых, всего: {len(seen_ids)}"
+                      + (f", не загружено страниц: {state['failed']}" if state['failed'] else ""))
+
+                row = {'specialty': specialty_name, 'total': state['total'], 'new': state['new']}
+                stats.append(row)
+                stats_sinks[catalogue.city_from_path(specialty)].write(row)
+
+                if done_count % 20 == 0:
+                    print(f"  [Параллельность: {limiter.format()}]")
+
+    # Самопроверка fastscan: разбор в event loop и в каждом процессе пула
+    scan_stats = parsers.add_scan_stats({}, parsers.FAST_SCAN.take_stats())
+    if pool is not None:
+        parsers.add_scan_stats(scan_stats, pool.scan_stats)
+        pool.close()
+    if cache is not None:
+        cache.close()
+    metrics.stop_timeline()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+
+    # Отчёт плана: предсказанное и фактическое завершение специальностей
+    schedule_file = f"{'_'.join(map(catalogue.output_prefix, cities))}_doctors_schedule_{timestamp}.csv"
+    if os.path.exists(schedule_file):
+        os.remove(schedule_file)
+    with sinks.CsvAppendSink(schedule_file, scheduler.REPORT_FIELDS) as schedule_sink:
+        for row in schedule.report():
+            schedule_sink.write(row)
+
+    if not args.reparse_from_cache:
+        # Специальностей, первая страница которых отдала 404, в городе нет - в следующий раз не запрашиваем
+        missing = [path for path in specialties if retry.permanent.get(BASE_URL + path) == 'HTTP 404']
+        for city in cities:
+            slugs = [specialty_name_from_path(path) for path in missing if catalogue.city_from_path(path) == city]
+            if specialty_catalogue.prune(city, slugs) and slugs:
+                print(f"Каталог: в городе {city} нет {len(slugs)} специальностей, убраны")
+        specialty_catalogue.save()
+
+    # Итоговые файлы по городам - выгрузка из уже наполненных баз
+    unique = {}
+    for city, files in outputs.items():
+        with stores[city] as city_store:
+            city_store.save_snapshots(snapshots[city])
+            unique[city] = city_store.export(files['csv'], files['json'])
+
+    if previous is not None:
+        previous.close()
+        changes = delta.write_diff(previous.path, outputs[cities[0]]['db'], outputs[cities[0]]['diff'])
 
     end_time = datetime.now()
     duration = end_time - start_time
 
     print("\n" + "=" * 60)
     print("ГОТОВО!")
-    print(f"Уникальных врачей: {len(all_doctors)}")
+    for city in cities:
+        print(f"Уникальных врачей{'' if len(cities) == 1 else ' (' + city + ')'}: {unique[city]}")
     print(f"Время: {duration}")
-    print(f"CSV: {csv_file}")
-    print(f"JSON: {json_file}")
+    print(f"Загрузка: {timings.format()}")
+    print(f"Параллельность: {limiter.format()}")
+    print(f"Соединения: {connections.format()}")
+    print(f"Страницы: {retry.format()}")
+    print(f"Метрики: {metrics.format_summary()}")
+    if args.metrics_timeline:
+        print(f"Лента событий: {args.metrics_timeline}")
+    if cache is not None:
+        print(f"Кэш валидаторов: {cache.format()}")
+    if html_cache is not None:
+        print(f"Кэш HTML: {html_cache.format()}")
+    if args.parser == 'fastscan':
+        print(f"fastscan: {parsers.format_scan_stats(scan_stats)}")
+    for files in outputs.values():
+        print(f"CSV: {files['csv']}")
+        print(f"JSON: {files['json']}")
+        print(f"База: {files['db']}")
+    print(f"План: {schedule.format()} -> {schedule_file}")
+    print(f"Журнал: {args.journal}")
+    if previous is not None:
+        print(f"Изменения: новых {len(changes['new'])}, пропало {len(changes['removed'])}, "
+              f"изменилось {len(changes['changed'])} -> {outputs[cities[0]]['diff']}")
     print("=" * 60)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    asyncio.run(main(parse_args()))
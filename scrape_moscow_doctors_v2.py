@@ -2,190 +2,156 @@
 """
 Сбор ВСЕХ врачей Москвы с prodoctorov.ru
 v2: Исправлена пагинация - используем общее количество врачей из meta description
+По умолчанию страницы качаются параллельно (--engine async), --engine sync -
+прежний последовательный обход с паузами.
 """
 
+import argparse
+import asyncio
 import requests
 from bs4 import BeautifulSoup
 import time
-import csv
-import json
+import os
 import re
 import math
 from datetime import datetime
 
-BASE_URL = "https://prodoctorov.ru"
+import journal
+import metrics
+import parsers
+import scrape_moscow_async
+import store
+
+# PRODOCTOROV_BASE_URL - например, локальный mockserver.py
+BASE_URL = os.environ.get("PRODOCTOROV_BASE_URL", "https://prodoctorov.ru")
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
     'Accept-Language': 'ru-RU,ru;q=0.9,en;q=0.8',
 }
+PARSER_BACKEND = parsers.DEFAULT_BACKEND  # движок разбора, см. --parser
 
 DOCTORS_PER_PAGE = 20
+LISTING_PATH = "/moskva/vrach/"
+JOURNAL_FILE = 'moscow_all_doctors_journal.jsonl'
 
 
-def get_soup(url, retries=3):
-    """Получает BeautifulSoup объект с повторными попытками"""
+def get_html(url, retries=3):
+    """HTML страницы с повторными попытками; None - не загрузилась"""
     for attempt in range(retries):
+        started = time.monotonic()
+        status = None
+        size = 0
         try:
             resp = requests.get(url, headers=HEADERS, timeout=30)
+            status = resp.status_code
+            size = len(resp.content)
             resp.raise_for_status()
-            return BeautifulSoup(resp.text, 'html.parser')
         except Exception as e:
+            metrics.observe_fetch(url, status, time.monotonic() - started, size)
             print(f"  Ошибка (попытка {attempt + 1}): {e}")
             if attempt < retries - 1:
+                metrics.RETRIES.inc()
                 time.sleep(5)
+            continue
+        metrics.observe_fetch(url, status, time.monotonic() - started, size)
+        return resp.text
     return None
 
 
-def get_total_doctors(soup):
-    """Получает общее количество врачей из meta description или текста страницы"""
-    if not soup:
-        return None
-
-    # Метод 1: Meta description
-    meta = soup.select_one('meta[name="description"]')
-    if meta:
-        content = meta.get('content', '')
-        # Ищем паттерны типа "6537 врачей" или "6537 гинекологов"
-        match = re.search(r'(\d+)\s*(?:врач|доктор|гинеколог|терапевт|специалист)', content, re.IGNORECASE)
-        if match:
-            return int(match.group(1))
+def get_total_doctors(html, analysis):
+    """Общее количество врачей: из meta description (разбор движка --parser), иначе из текста страницы"""
+    if analysis['total']:
+        return analysis['total']
 
-    # Метод 2: H1 или заголовок
+    # Заголовок и текст страницы - только если в meta числа нет
+    soup = BeautifulSoup(html, 'html.parser')
     h1 = soup.select_one('h1')
     if h1:
-        text = h1.get_text()
-        match = re.search(r'(\d+)', text)
+        match = re.search(r'(\d+)', h1.get_text())
         if match:
             return int(match.group(1))
 
-    # Метод 3: Поиск по всему тексту
-    text = soup.get_text()
-    matches = re.findall(r'(\d{3,6})\s*(?:врач|доктор)', text, re.IGNORECASE)
+    matches = re.findall(r'(\d{3,6})\s*(?:врач|доктор)', soup.get_text(), re.IGNORECASE)
     if matches:
         return int(matches[0])
 
     return None
 
 
-def get_last_page(soup, total_doctors=None):
-    """Определяет номер последней страницы"""
-    if total_doctors:
-        return math.ceil(total_doctors / DOCTORS_PER_PAGE)
-
-    # Fallback: старый метод через пагинатор
-    if not soup:
-        return 1
-    pagination = soup.select('ul.b-pagination-vuetify-imitation a')
-    pages = [int(a.text.strip()) for a in pagination if a.text.strip().isdigit()]
-    return max(pages) if pages else 1
-
-
-def clean_text(text):
-    if not text:
-        return ""
-    return ' '.join(text.split())
-
-
-def clean_url(url):
-    if '#' in url:
-        url = url.split('#')[0]
-    return url
-
-
-def parse_doctors_from_page(soup):
-    """Извлекает данные врачей со страницы"""
-    doctors = []
-    if not soup:
-        return doctors
-
-    for card in soup.select('div.b-doctor-card[data-doctor-id]'):
-        doctor_id = card.get('data-doctor-id')
-        name = card.get('data-doctor-name', '')
-
-        link_el = card.select_one('a.b-doctor-card__name-link')
-        href = link_el.get('href') if link_el else None
-
-        # Рейтинг
-        rating_el = card.select_one('div.b-stars-rate__progress')
-        rating = None
-        if rating_el:
-            style = rating_el.get('style', '')
-            if 'width:' in style:
-                try:
-                    rating = float(style.split('width:')[1].split('em')[0].strip())
-                except:
-                    pass
-
-        # Количество отзывов
-        reviews_el = card.select_one('a[href*="#otzivi"]')
-        reviews_count = None
-        if reviews_el:
-            text = reviews_el.get_text(strip=True)
-            try:
-                reviews_count = int(''.join(filter(str.isdigit, text)))
-            except:
-                pass
-
-        # Специальность
-        spec_el = card.select_one('div.b-doctor-card__spec')
-        specialty = clean_text(spec_el.get_text()) if spec_el else None
-
-        if href and doctor_id:
-            doctors.append({
-                'id': doctor_id,
-                'name': name,
-                'url': clean_url(BASE_URL + href),
-                'rating': rating,
-                'reviews_count': reviews_count,
-                'specialty_display': specialty,
-            })
+def analyze_page(url, html):
+    """Первая страница - одним разбором движка --parser: total из meta, число страниц, врачи"""
+    started = time.monotonic()
+    analysis = parsers.analyze_page(html, PARSER_BACKEND, BASE_URL)
+    metrics.observe_parse(url, time.monotonic() - started)
+    return analysis
 
+
+def parse_doctors_from_page(url, html):
+    """Врачи со страницы движком --parser (parsers.py); не загрузилась - пусто"""
+    if not html:
+        return []
+    started = time.monotonic()
+    doctors = parsers.parse_doctors(html, PARSER_BACKEND, BASE_URL)
+    metrics.observe_parse(url, time.monotonic() - started)
     return doctors
 
 
-def scrape_all_doctors():
-    """Собирает ВСЕХ врачей с /moskva/vrach/"""
+def scrape_all_doctors(log, resume=None):
+    """Собирает ВСЕХ врачей с /moskva/vrach/, каждая страница сразу уходит в журнал"""
     print("=" * 60)
     print("Сбор ВСЕХ врачей Москвы")
     print("=" * 60)
 
-    first_url = BASE_URL + "/moskva/vrach/"
-    soup = get_soup(first_url)
-
-    if not soup:
-        print("Ошибка загрузки первой страницы!")
-        return {}
-
-    total_doctors = get_total_doctors(soup)
-    if total_doctors:
-        print(f"Всего врачей на сайте: {total_doctors}")
-        last_page = get_last_page(soup, total_doctors)
+    resume = resume or journal.ResumeState()
+    first_url = BASE_URL + LISTING_PATH
+    seen_ids = resume.seen_ids  # id найденных врачей, сами записи - в журнале
+    last_page = resume.last_pages.get(LISTING_PATH)
+    started = time.monotonic()
+    found = 0
+
+    if last_page is None:
+        html = get_html(first_url)
+
+        if not html:
+            print("Ошибка загрузки первой страницы!")
+            return seen_ids
+
+        analysis = analyze_page(first_url, html)
+        total_doctors = get_total_doctors(html, analysis)
+        if total_doctors:
+            print(f"Всего врачей на сайте: {total_doctors}")
+            last_page = math.ceil(total_doctors / DOCTORS_PER_PAGE)
+        else:
+            print("Не удалось определить общее количество врачей")
+            # Пробуем определить эмпирически
+            last_page = 7000  # Примерно 124907 / 20
+
+        # Первая страница уже загружена и разобрана
+        doctors = analysis['doctors']
+        log.record(LISTING_PATH, 1, doctors, last_page)
+        metrics.observe_page(LISTING_PATH, 1, len(doctors))
+        found += len(doctors)
+        seen_ids.update(doc['id'] for doc in doctors)
+        print(f"Страница 1: {len(doctors)} врачей, всего: {len(seen_ids)}")
     else:
-        print("Не удалось определить общее количество врачей")
-        # Пробуем определить эмпирически
-        last_page = 7000  # Примерно 124907 / 20
+        print(f"Продолжаем по журналу: готово страниц {len(resume.done)}, всего: {len(seen_ids)}")
 
     print(f"Страниц для обработки: {last_page}")
 
-    all_doctors = {}  # id -> doctor data
-
-    # Первая страница уже загружена
-    doctors = parse_doctors_from_page(soup)
-    for doc in doctors:
-        all_doctors[doc['id']] = doc
-    print(f"Страница 1: {len(doctors)} врачей, всего: {len(all_doctors)}")
-
     # Остальные страницы
     for page in range(2, last_page + 1):
+        if (LISTING_PATH, page) in resume.done:
+            continue
+
         url = f"{first_url}?page={page}"
-        soup = get_soup(url)
+        html = get_html(url)
 
-        if not soup:
+        if not html:
             print(f"  Страница {page}: ошибка загрузки, пропуск")
             continue
 
-        doctors = parse_doctors_from_page(soup)
+        doctors = parse_doctors_from_page(url, html)
 
         if not doctors:
             print(f"  Страница {page}: пустая, возможно достигнут конец")
@@ -193,8 +159,7 @@ def scrape_all_doctors():
             empty_count = 1
             for check_page in range(page + 1, page + 4):
                 check_url = f"{first_url}?page={check_page}"
-                check_soup = get_soup(check_url)
-                if check_soup and parse_doctors_from_page(check_soup):
+                if parse_doctors_from_page(check_url, get_html(check_url)):
                     empty_count = 0
                     break
                 empty_count += 1
@@ -205,63 +170,146 @@ def scrape_all_doctors():
                 break
             continue
 
-        for doc in doctors:
-            if doc['id'] not in all_doctors:
-                all_doctors[doc['id']] = doc
+        log.record(LISTING_PATH, page, doctors)
+        metrics.observe_page(LISTING_PATH, page, len(doctors))
+        found += len(doctors)
+        seen_ids.update(doc['id'] for doc in doctors)
 
         if page % 100 == 0:
-            print(f"Страница {page}/{last_page}: всего уникальных {len(all_doctors)}")
-            # Сохраняем checkpoint
-            with open('moscow_all_doctors_checkpoint.json', 'w', encoding='utf-8') as f:
-                json.dump({
-                    'doctors': list(all_doctors.values()),
-                    'last_page': page
-                }, f, ensure_ascii=False)
+            print(f"Страница {page}/{last_page}: всего уникальных {len(seen_ids)}")
 
         time.sleep(0.8)  # Пауза между запросами
 
-    return all_doctors
+    metrics.observe_specialty(LISTING_PATH, found, time.monotonic() - started)
+    return seen_ids
 
 
-def main():
-    start_time = datetime.now()
+async def scrape_all_doctors_async(log, resume=None, parse_workers=0):
+    """
+    То же, что scrape_all_doctors, но страницы общего списка качаются параллельно
+    в любом порядке (scrape_moscow_async.crawl_listing); конец данных - там же
+    """
+    engine = scrape_moscow_async
+    engine.BASE_URL = BASE_URL
+    engine.PARSER_BACKEND = PARSER_BACKEND
+    print("=" * 60)
+    print("Сбор ВСЕХ врачей Москвы (параллельно)")
+    print("=" * 60)
 
-    all_doctors = scrape_all_doctors()
+    resume = resume or journal.ResumeState()
+    seen_ids = resume.seen_ids
+    if resume.done:
+        print(f"Продолжаем по журналу: готово страниц {len(resume.done)}, всего: {len(seen_ids)}")
+
+    limiter = engine.AdaptiveLimiter()
+    timings = engine.PageTimings()
+    retry = engine.RetryPolicy()
+    pool = engine.ParsePool(parse_workers) if parse_workers > 0 else None
+    last_page = resume.last_pages.get(LISTING_PATH)
+    pages = 0
+    found = 0
+    started = time.monotonic()
+    try:
+        async with engine.create_session() as session:
+            async for _, page, page_count, doctors in engine.crawl_listing(session, limiter, LISTING_PATH, timings,
+                                                                             retry, pool, resume):
+                metrics.observe_page(LISTING_PATH, page, len(doctors))
+                # Не загрузившаяся страница - с пометкой, --resume загрузит её снова
+                failed = retry.failed(engine.page_url(LISTING_PATH, page))
+                log.record(LISTING_PATH, page, doctors, page_count, **({'failed': True} if failed else {}))
+                seen_ids.update(doc['id'] for doc in doctors)
+                found += len(doctors)
+                if page_count is not None:
+                    last_page = page_count
+                    print(f"Страниц по оценке: {last_page}")
+                pages += 1
+                if pages % 100 == 0:
+                    print(f"Страниц {pages}/{last_page or '?'}: всего уникальных {len(seen_ids)}")
+    finally:
+        if pool is not None:
+            pool.close()
+    metrics.observe_specialty(LISTING_PATH, found, time.monotonic() - started)
+
+    print(f"Загрузка: {timings.format()}")
+    print(f"Параллельность: {limiter.format()}")
+    print(f"Страницы: {retry.format()}")
+    return seen_ids
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Сбор всех врачей Москвы с prodoctorov.ru")
+    parser.add_argument('--base-url', default=BASE_URL,
+                        help='адрес сайта, например локальный mockserver.py (или PRODOCTOROV_BASE_URL)')
+    parser.add_argument('--journal', default=JOURNAL_FILE, help='журнал готовых страниц')
+    parser.add_argument('--resume', action='store_true',
+                        help='продолжить прерванный обход по журналу, пропуская готовые страницы')
+    parser.add_argument('--engine', choices=['async', 'sync'], default='async',
+                        help='async - параллельная загрузка, sync - по одной странице с паузами')
+    parser.add_argument('--parse-workers', type=int, default=scrape_moscow_async.PARSE_WORKERS,
+                        help='процессов для парсинга HTML в движке async (0 - в event loop)')
+    parser.add_argument('--parser', choices=list(parsers.BACKENDS), default=PARSER_BACKEND,
+                        help='движок парсинга (fastscan - регулярки с выборочной сверкой)')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='отдавать метрики Prometheus на http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-timeline', metavar='PATH', help='писать ленту событий JSON Lines в PATH')
+    return parser.parse_args(argv)
+
+
+def main(args=None):
+    global BASE_URL, PARSER_BACKEND
+    args = args or parse_args([])
+    BASE_URL = args.base_url.rstrip('/')
+    PARSER_BACKEND = args.parser
+    start_time = datetime.now()
 
-    # Сохранение результатов
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if args.resume and os.path.exists(args.journal):
+        header, entries = journal.read_journal(args.journal)
+        resume = journal.ResumeState.from_entries(entries)
+        timestamp = header['timestamp']
+        log = journal.CrawlJournal(args.journal)
+    else:
+        resume = None
+        timestamp = start_time.strftime("%Y%m%d_%H%M%S")
+        log = journal.CrawlJournal(args.journal, header={'timestamp': timestamp})
 
-    # CSV
     csv_file = f"moscow_all_doctors_{timestamp}.csv"
-    with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['id', 'name', 'url', 'rating', 'reviews_count', 'specialty_display'])
-        for doc in all_doctors.values():
-            writer.writerow([
-                doc['id'],
-                doc['name'],
-                doc['url'],
-                doc.get('rating', ''),
-                doc.get('reviews_count', ''),
-                doc.get('specialty_display', ''),
-            ])
-
-    # JSON
     json_file = f"moscow_all_doctors_{timestamp}.json"
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(list(all_doctors.values()), f, ensure_ascii=False, indent=2)
+    db_file = f"moscow_all_doctors_{timestamp}.sqlite"
+
+    metrics_server = metrics.serve(args.metrics_port) if args.metrics_port else None
+    if args.metrics_timeline:
+        metrics.start_timeline(args.metrics_timeline)
+    try:
+        with log:
+            if args.engine == 'sync':
+                scrape_all_doctors(log, resume)
+            else:
+                asyncio.run(scrape_all_doctors_async(log, resume, args.parse_workers))
+    finally:
+        metrics.stop_timeline()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+
+    # CSV и JSON - из журнала за один проход через хранилище
+    records = journal.journal_records(args.journal)
+    unique = store.build_outputs(records, db_file, csv_file, json_file, with_specialties=False)
 
     end_time = datetime.now()
     duration = end_time - start_time
 
     print("\n" + "=" * 60)
     print("ГОТОВО!")
-    print(f"Уникальных врачей: {len(all_doctors)}")
+    print(f"Уникальных врачей: {unique}")
     print(f"Время выполнения: {duration}")
     print(f"CSV: {csv_file}")
     print(f"JSON: {json_file}")
+    print(f"База: {db_file}")
+    print(f"Журнал: {args.journal}")
+    print(f"Метрики: {metrics.format_summary()}")
+    if args.metrics_timeline:
+        print(f"Лента событий: {args.metrics_timeline}")
     print("=" * 60)
 
 
 if __name__ == "__main__":
-    main()
+    main(parse_args())
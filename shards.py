@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Распределённый обход: координатор делит обход на шарды - диапазоны специальностей
+из каталога городов (catalogue.py) или диапазоны страниц общего списка
+/<город>/vrach/ - и раздаёт их
+воркерам: локальным процессам или процессам на других машинах. Воркер
+обходит шард движком scrape_moscow_async и возвращает записи журнала, координатор
+сливает их в свой журнал, а итоговые файлы собираются как обычно - через
+хранилище с дедупликацией по id.
+
+    python shards.py coordinate --mode specialties --workers 4
+    python shards.py coordinate --city moskva --city spb --workers 8
+    python shards.py coordinate --mode listing --host 0.0.0.0 --port 8765 --workers 0
+    python shards.py worker --connect 10.0.0.5:8765      # на другой машине
+
+Протокол - TCP, одно соединение на запрос, запрос и ответ - JSON в одну строку:
+    {"op": "lease", "worker": w}                      -> {"shard": {...}, "lease": с} | {"wait": с} | {"done": true}
+    {"op": "renew", "worker": w, "shard": id}         -> {"ok": true | false}
+    {"op": "complete", "worker": w, "shard": id, "entries": [...], "lost": n} -> {"ok": true}
+    {"op": "fail", "worker": w, "shard": id, "error": "..."}                 -> {"ok": true}
+Воркер продлевает аренду, пока обходит шард. Шард с истёкшей арендой (воркер упал
+или пропал) или с ошибкой отдаётся заново, после MAX_ATTEMPTS попыток - проваленным.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import catalogue
+import journal
+import scrape_moscow_async as scraper
+import store
+
+LEASE_SECONDS = 60.0
+MAX_ATTEMPTS = 3
+PAGES_PER_SHARD = 250
+MESSAGE_LIMIT = 1024 ** 3  # Записи целого шарда приходят одной строкой
+JOURNAL_FILE = 'moscow_shards_journal.jsonl'
+
+
+def plan_specialties(specialties, shards):
+    """Непрерывные диапазоны специальностей, примерно поровну"""
+    shards = max(1, min(shards, len(specialties)))
+    size, extra = divmod(len(specialties), shards)
+    plan = []
+    start = 0
+    for index in range(shards):
+        end = start + size + (1 if index < extra else 0)
+        plan.append({'id': index, 'mode': 'specialties', 'specialties': specialties[start:end]})
+        start = end
+    return plan
+
+
+def plan_listing(listing_path, last_page, pages_per_shard=PAGES_PER_SHARD, first_page=2, first_ids=()):
+    """
+    Диапазоны страниц списка. Последний шард идёт дальше оценки - до двух
+    оценок, как стоп-кран crawl_listing: конец данных он находит сам по пустым
+    страницам, если оценка занижена. first_ids - id врачей первой страницы:
+    страница за концом, которую сайт отдаёт как первую, тоже пустая.
+    """
+    first_ids = sorted(first_ids)
+    plan = []
+    for start in range(first_page, max(last_page, first_page) + 1, pages_per_shard):
+        plan.append({'id': len(plan), 'mode': 'listing', 'listing': listing_path, 'first_ids': first_ids,
+                     'first': start, 'last': start + pages_per_shard - 1})
+    plan[-1]['last'] = max(2 * last_page, plan[-1]['first'])
+    return plan
+
+
+class ShardQueue:
+    """Очередь шардов с арендой: кто, до какого момента и с какой попытки обходит шард"""
+
+    def __init__(self, shards, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.shards = {shard['id']: shard for shard in shards}
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.pending = collections.deque(shard['id'] for shard in shards)
+        self.leases = {}  # id -> (worker, истекает)
+        self.attempts = collections.Counter()
+        self.completed = {}  # id -> worker
+        self.failed = {}  # id -> последняя ошибка
+        self.reassigned = 0
+
+    def _retry(self, shard_id, error):
+        if self.attempts[shard_id] >= self.max_attempts:
+            self.failed[shard_id] = error
+        else:
+            self.pending.append(shard_id)
+            self.reassigned += 1
+
+    def expire(self, now):
+        for shard_id, (worker, expires) in list(self.leases.items()):
+            if expires <= now:
+                del self.leases[shard_id]
+                self._retry(shard_id, f"аренда истекла у {worker}")
+
+    def lease(self, worker, now):
+        self.expire(now)
+        if not self.pending:
+            return None
+        shard_id = self.pending.popleft()
+        self.attempts[shard_id] += 1
+        self.leases[shard_id] = (worker, now + self.lease_seconds)
+        return self.shards[shard_id]
+
+    def renew(self, shard_id, worker, now):
+        """False - аренда уже у другого воркера или шард готов: обход можно бросать"""
+        lease = self.leases.get(shard_id)
+        if lease is None or lease[0] != worker:
+            return False
+        self.leases[shard_id] = (worker, now + self.lease_seconds)
+        return True
+
+    def complete(self, shard_id, worker):
+        """
+        True - результат принят. Принимается первый результат шарда, даже от воркера,
+        чья аренда уже истекла: данные те же, а повторный обход больше не нужен.
+        """
+        if shard_id in self.completed:
+            return False
+        self.completed[shard_id] = worker
+        self.leases.pop(shard_id, None)
+        self.failed.pop(shard_id, None)
+        if shard_id in self.pending:
+            self.pending.remove(shard_id)
+        return True
+
+    def fail(self, shard_id, worker, error):
+        lease = self.leases.get(shard_id)
+        if lease is None or lease[0] != worker:
+            return
+        del self.leases[shard_id]
+        self._retry(shard_id, error)
+
+    @property
+    def done(self):
+        return not self.pending and not self.leases
+
+    def format(self):
+        return (f"готово {len(self.completed)}/{len(self.shards)}, переназначено {self.reassigned}, "
+                f"провалено {len(self.failed)}")
+
+
+class Coordinator:
+    """Сервер шардов: раздаёт аренды, принимает записи и пишет их в журнал"""
+
+    def __init__(self, queue, log, base_url, host='127.0.0.1', port=0):
+        self.queue = queue
+        self.log = log
+        self.base_url = base_url
+        self.host = host
+        self.port = port
+        self.lost = 0
+        self.pages = 0
+        self._server = None
+        self._processes = []
+        self._spawned = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, limit=MESSAGE_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return f"{self.host}:{self.port}"
+
+    async def handle(self, reader, writer):
+        try:
+            message = json.loads(await reader.readline())
+            reply = self.dispatch(message)
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+            await writer.drain()
+        except (ConnectionError, json.JSONDecodeError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def dispatch(self, message):
+        op = message.get('op')
+        worker = message.get('worker')
+        now = time.monotonic()
+        if op == 'lease':
+            shard = self.queue.lease(worker, now)
+            if shard is not None:
+                return {'shard': dict(shard, base_url=self.base_url), 'lease': self.queue.lease_seconds}
+            return {'done': True} if self.queue.done else {'wait': 1.0}
+        if op == 'renew':
+            return {'ok': self.queue.renew(message['shard'], worker, now)}
+        if op == 'complete':
+            if self.queue.complete(message['shard'], worker):
+                for entry in message['entries']:
+                    extra = {'failed': True} if entry.get('failed') else {}
+                    self.log.record(entry['specialty'], entry['page'], entry['doctors'], entry.get('last_page'), **extra)
+                self.pages += len(message['entries'])
+                self.lost += message.get('lost', 0)
+                print(f"  шард {message['shard']} от {worker}: страниц {len(message['entries'])} "
+                      f"[{self.queue.format()}]")
+            return {'ok': True}
+        if op == 'fail':
+            print(f"  шард {message['shard']} от {worker}: ошибка {message.get('error')}")
+            self.queue.fail(message['shard'], worker, message.get('error'))
+            return {'ok': True}
+        return {'error': f"неизвестная операция {op!r}"}
+
+    def spawn_worker(self, parse_workers=0, extra_args=()):
+        cmd = [sys.executable, os.path.abspath(__file__), 'worker', '--connect', f"{self.host}:{self.port}",
+               '--parse-workers', str(parse_workers), *extra_args]
+        process = subprocess.Popen(cmd)
+        self._processes.append(process)
+        self._spawned += 1
+        return process
+
+    async def run(self, workers=0, parse_workers=0, poll=0.2):
+        """
+        Ждёт, пока все шарды не будут готовы или провалены. Локальные воркеры
+        запускаются здесь; упавшие заменяются новыми, пока есть работа.
+        """
+        for _ in range(workers):
+            self.spawn_worker(parse_workers)
+        max_spawned = workers * (MAX_ATTEMPTS + 1)
+        while not self.queue.done:
+            await asyncio.sleep(poll)
+            self.queue.expire(time.monotonic())
+            alive = [process for process in self._processes if process.poll() is None]
+            if workers and len(alive) < workers and self.queue.pending and self._spawned < max_spawned:
+                self.spawn_worker(parse_workers)
+
+        self._server.close()
+        await self._server.wait_closed()
+        # Воркеры сами выходят по {"done": true} или когда координатор закрылся
+        for process in self._processes:
+            try:
+                await asyncio.to_thread(process.wait, 30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+async def request(address, message):
+    host, _, port = address.rpartition(':')
+    reader, writer = await asyncio.open_connection(host, int(port), limit=MESSAGE_LIMIT)
+    try:
+        writer.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n')
+        await writer.drain()
+        line = await reader.readline()
+    finally:
+        writer.close()
+    if not line:
+        raise ConnectionError("координатор закрыл соединение")
+    return json.loads(line)
+
+
+async def crawl_shard(shard, parse_workers=0):
+    """Обход одного шарда: (записи журнала, потерянных страниц)"""
+    scraper.BASE_URL = shard['base_url']
+    limiter = scraper.AdaptiveLimiter()
+    retry = scraper.RetryPolicy()
+    pool = scraper.ParsePool(parse_workers) if parse_workers > 0 else None
+    entries = []
+    try:
+        async with scraper.create_session() as session:
+            if shard['mode'] == 'specialties':
+                pages = scraper.crawl(session, limiter, shard['specialties'], retry=retry, pool=pool)
+            else:
+                pages = scraper.crawl_listing(session, limiter, shard['listing'], retry=retry, pool=pool,
+                                              first_page=shard['first'], last_page=shard['last'],
+                                              first_ids=shard.get('first_ids', ()))
+            async for specialty, page, last_page, doctors in pages:
+                entry = {'specialty': specialty, 'page': page, 'last_page': last_page, 'doctors': doctors}
+                if retry.failed(scraper.page_url(specialty, page)):
+                    entry['failed'] = True
+                entries.append(entry)
+    finally:
+        if pool is not None:
+            pool.close()
+    return entries, len(retry.dead_letters) + len(retry.permanent)
+
+
+async def keep_lease(address, worker, shard, task):
+    """
+    Продлевает аренду; если шард уже у другого воркера - обход бросается,
+    а в shard ставится revoked, чтобы отличить это от отмены самого воркера.
+    """
+    while True:
+        await asyncio.sleep(shard['lease'] / 3)
+        try:
+            reply = await request(address, {'op': 'renew', 'worker': worker, 'shard': shard['id']})
+        except OSError:
+            continue  # координатор недоступен - аренда истечёт сама, если он не вернётся
+        if not reply.get('ok'):
+            shard['revoked'] = True
+            task.cancel()
+            return
+
+
+async def work(address, parse_workers=0):
+    """Цикл воркера: аренда, обход, результат - пока координатор не скажет done"""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    while True:
+        try:
+            reply = await request(address, {'op': 'lease', 'worker': worker})
+        except OSError:
+            return  # координатора уже нет - работа закончена
+        if reply.get('done'):
+            return
+        if 'wait' in reply:
+            await asyncio.sleep(reply['wait'])
+            continue
+
+        shard = dict(reply['shard'], lease=reply['lease'])
+        task = asyncio.create_task(crawl_shard(shard, parse_workers))
+        keeper = asyncio.create_task(keep_lease(address, worker, shard, task))
+        try:
+            entries, lost = await task
+        except asyncio.CancelledError:
+            if shard.get('revoked'):
+                continue  # шард отдан другому воркеру
+            task.cancel()
+            raise
+        except Exception as e:
+            message = {'op': 'fail', 'worker': worker, 'shard': shard['id'], 'error': repr(e)}
+        else:
+            message = {'op': 'complete', 'worker': worker, 'shard': shard['id'], 'entries': entries, 'lost': lost}
+        finally:
+            keeper.cancel()
+        try:
+            await request(address, message)
+        except OSError:
+            return  # координатора уже нет - шард он всё равно не примет
+
+
+async def plan_listing_shards(listing_path, pages_per_shard, log):
+    """Первая страница списка - здесь: по ней оценка числа страниц, она же первая запись журнала"""
+    limiter = scraper.AdaptiveLimiter()
+    retry = scraper.RetryPolicy()
+    async with scraper.create_session() as session:
+        first_url = scraper.BASE_URL + listing_path
+        html = await scraper.fetch_page(session, first_url, limiter, retry=retry)
+        if html is None:
+            raise SystemExit(f"Не загрузилась первая страница {first_url}")
+        last_page, doctors = scraper.parse_page(html, first_page=True)
+        if last_page is None:
+            last_page, _ = await scraper.discover_pages(session, limiter, listing_path, doctors, retry=retry)
+    log.record(listing_path, 1, doctors, last_page)
+    print(f"Страниц по оценке: {last_page}")
+    return plan_listing(listing_path, last_page, pages_per_shard, first_ids=(doc['id'] for doc in doctors))
+
+
+async def plan_catalogue(args, cities):
+    """Специальности городов из каталога - как в scrape_moscow_async.main, с обновлением индекса"""
+    specialty_catalogue = catalogue.Catalogue(args.catalogue)
+    if not args.no_index:
+        async with scraper.create_session() as session:
+            found = await scraper.discover_catalogue(session, scraper.AdaptiveLimiter(), specialty_catalogue, cities,
+                                                     args.index_ttl)
+        for city, count in found.items():
+            if count:
+                print(f"Каталог {city}: {count} специальностей с сайта")
+            else:
+                print(f"Каталог {city}: список с сайта не загружен, остаётся прежний")
+        specialty_catalogue.save()
+    specialties = specialty_catalogue.jobs(cities)
+    return specialties[:args.limit] if args.limit else specialties
+
+
+async def coordinate(args):
+    scraper.BASE_URL = args.base_url.rstrip('/')
+    start_time = datetime.now()
+    timestamp = start_time.strftime("%Y%m%d_%H%M%S")
+    cities = list(dict.fromkeys(args.city or [catalogue.DEFAULT_CITY]))
+    listing = args.listing or catalogue.specialty_path(cities[0], 'vrach')
+    log = journal.CrawlJournal(args.journal, header={'timestamp': timestamp, 'mode': args.mode, 'cities': cities})
+
+    with log:
+        if args.mode == 'specialties':
+            specialties = await plan_catalogue(args, cities)
+            plan = plan_specialties(specialties, args.shards or max(1, args.workers) * 4)
+        else:
+            plan = await plan_listing_shards(listing, args.pages_per_shard, log)
+
+        queue = ShardQueue(plan, args.lease)
+        coordinator = Coordinator(queue, log, scraper.BASE_URL, args.host, args.port)
+        address = await coordinator.start()
+        print(f"Координатор: {address}, шардов {len(plan)}, локальных воркеров {args.workers}")
+        await coordinator.run(args.workers, args.parse_workers)
+
+    # Итоговые файлы - по городам, как у scrape_moscow_async
+    outputs = {}
+    for city in (cities if args.mode == 'specialties' else cities[:1]):
+        if args.mode == 'specialties':
+            prefix, specialty_name = f"{catalogue.output_prefix(city)}_doctors_sharded", scraper.specialty_name_from_path
+        else:
+            prefix, specialty_name = f"{catalogue.output_prefix(city)}_all_doctors_sharded", None
+
+        def in_city(path, city=city):
+            return catalogue.city_from_path(path) == city
+
+        files = outputs[city] = {'csv': f"{prefix}_{timestamp}.csv", 'json': f"{prefix}_{timestamp}.json",
+                                 'db': f"{prefix}_{timestamp}.sqlite"}
+        records = journal.journal_records(args.journal, specialty_name, keep=in_city)
+        files['unique'] = store.build_outputs(records, files['db'], files['csv'], files['json'],
+                                              with_specialties=specialty_name is not None)
+
+    print("\n" + "=" * 60)
+    print("ГОТОВО!")
+    for city, files in outputs.items():
+        print(f"Уникальных врачей{'' if len(outputs) == 1 else ' (' + city + ')'}: {files['unique']}")
+    print(f"Время: {datetime.now() - start_time}")
+    print(f"Шарды: {queue.format()}, страниц {coordinator.pages}, потеряно {coordinator.lost}")
+    for shard_id, error in sorted(queue.failed.items()):
+        print(f"  провален шард {shard_id}: {error}")
+    for files in outputs.values():
+        print(f"CSV: {files['csv']}")
+        print(f"JSON: {files['json']}")
+        print(f"База: {files['db']}")
+    print(f"Журнал: {args.journal}")
+    print("=" * 60)
+    return queue
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Распределённый обход prodoctorov.ru по шардам")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    coord = commands.add_parser('coordinate', help='раздавать шарды и собрать результат')
+    coord.add_argument('--mode', choices=['specialties', 'listing'], default='specialties',
+                       help='шарды - диапазоны специальностей или страниц общего списка')
+    coord.add_argument('--listing', help='общий список для --mode listing (по умолчанию /<город>/vrach/)')
+    coord.add_argument('--city', action='append', metavar='CITY',
+                       help=f"город (можно несколько, для --mode listing - один): {', '.join(catalogue.CITIES)}; "
+                            f"по умолчанию {catalogue.DEFAULT_CITY}")
+    coord.add_argument('--catalogue', default=catalogue.CATALOGUE_FILE, metavar='PATH',
+                       help='каталог специальностей по городам ("" - без файла)')
+    coord.add_argument('--index-ttl', type=float, default=catalogue.INDEX_TTL_DAYS, metavar='DAYS',
+                       help='через сколько дней заново загружать список специальностей с сайта')
+    coord.add_argument('--no-index', action='store_true',
+                       help='не загружать список специальностей, только каталог на диске')
+    coord.add_argument('--host', default='127.0.0.1', help='адрес координатора (0.0.0.0 - для других машин)')
+    coord.add_argument('--port', type=int, default=0, help='порт координатора (0 - любой свободный)')
+    coord.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='локальных процессов-воркеров')
+    coord.add_argument('--parse-workers', type=int, default=0, help='процессов разбора у каждого воркера')
+    coord.add_argument('--shards', type=int, help='шардов специальностей (по умолчанию 4 на воркер)')
+    coord.add_argument('--limit', type=int, help='только первые N специальностей')
+    coord.add_argument('--pages-per-shard', type=int, default=PAGES_PER_SHARD)
+    coord.add_argument('--lease', type=float, default=LEASE_SECONDS, help='срок аренды шарда, с')
+    coord.add_argument('--journal', default=JOURNAL_FILE)
+    coord.add_argument('--base-url', default=scraper.BASE_URL,
+                       help='адрес сайта для всех воркеров (или PRODOCTOROV_BASE_URL)')
+
+    worker = commands.add_parser('worker', help='обходить шарды координатора')
+    worker.add_argument('--connect', required=True, metavar='HOST:PORT')
+    worker.add_argument('--parse-workers', type=int, default=0, help='процессов разбора HTML')
+    args = parser.parse_args(argv)
+    if args.command == 'coordinate' and args.mode == 'listing' and args.city and len(set(args.city)) > 1:
+        parser.error('--mode listing обходит общий список одного города')
+    return args
+
+
+def main(args):
+    if args.command == 'worker':
+        asyncio.run(work(args.connect, args.parse_workers))
+    else:
+        asyncio.run(coordinate(args))
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Потоковая запись результатов: врачи пишутся на диск по мере парсинга страниц.
+Итоговые CSV/JSON с дедупликацией собирает store.build_outputs, здесь - только
+их формат (write_csv, write_json).
+"""
+
+import csv
+import json
+import os
+
+DOCTOR_FIELDS = ['id', 'name', 'url', 'rating', 'reviews_count', 'specialty_display']
+
+
+class JsonLinesSink:
+    """JSON Lines: одна запись на строку, сбрасывается на диск пачками по chunk_size"""
+
+    def __init__(self, path, chunk_size=500):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.written = 0
+        self._buffer = []
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        self._buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self._buffer:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self.written += len(self._buffer)
+            self._buffer = []
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvAppendSink:
+    """CSV, дописываемый построчно; заголовок - только в новый файл"""
+
+    def __init__(self, path, fieldnames):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=fieldnames)
+        if new_file:
+            self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def doctor_records(doctors, specialty=None):
+    """Записи для потока: врач + специальность, на странице которой он найден"""
+    for doc in doctors:
+        record = {field: doc.get(field) for field in DOCTOR_FIELDS}
+        if specialty is not None:
+            record['specialty'] = specialty
+        yield record
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def write_csv(path, doctors, with_specialties=True):
+    fields = DOCTOR_FIELDS + (['specialties'] if with_specialties else [])
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(fields)
+        for doc in doctors:
+            row = [doc['id'], doc['name'], doc['url']]
+            row += [doc.get(field, '') for field in ('rating', 'reviews_count', 'specialty_display')]
+            if with_specialties:
+                row.append('; '.join(doc.get('specialties', [])))
+            writer.writerow(row)
+
+
+def write_json(path, doctors):
+    """JSON-массив по одному врачу на строку, без построения общей строки в памяти"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i, doc in enumerate(doctors):
+            f.write(',\n' if i else '\n')
+            json.dump(doc, f, ensure_ascii=False)
+        f.write('\n]\n')
+
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Хранилище врачей на SQLite: дедупликация по id через upsert, специальности -
+в отдельной таблице связей. Итоговые CSV/JSON выгружаются запросом, без словаря
+всех врачей в памяти.
+"""
+
+import itertools
+import os
+import sqlite3
+
+import sinks
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS doctors (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    url TEXT,
+    rating REAL,
+    reviews_count INTEGER,
+    specialty_display TEXT
+);
+CREATE TABLE IF NOT EXISTS doctor_specialties (
+    doctor_id TEXT NOT NULL,
+    specialty TEXT NOT NULL,
+    UNIQUE (doctor_id, specialty)
+);
+CREATE TABLE IF NOT EXISTS specialty_snapshots (
+    specialty TEXT PRIMARY KEY,
+    total INTEGER,
+    fingerprint TEXT
+);
+"""
+
+# Первая запись остаётся, пустые rating/reviews_count дополняются из последующих
+UPSERT_DOCTOR = """
+INSERT INTO doctors (id, name, url, rating, reviews_count, specialty_display)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET
+    rating = CASE WHEN (rating IS NULL OR rating = 0) AND excluded.rating
+                  THEN excluded.rating ELSE rating END,
+    reviews_count = CASE WHEN (reviews_count IS NULL OR reviews_count = 0) AND excluded.reviews_count
+                         THEN excluded.reviews_count ELSE reviews_count END
+"""
+
+INSERT_SPECIALTY = "INSERT OR IGNORE INTO doctor_specialties (doctor_id, specialty) VALUES (?, ?)"
+
+# Порядок rowid - порядок первого появления врача и специальности
+SELECT_DOCTORS = """
+SELECT d.id, d.name, d.url, d.rating, d.reviews_count, d.specialty_display, s.specialty
+FROM doctors d LEFT JOIN doctor_specialties s ON s.doctor_id = d.id
+ORDER BY d.rowid, s.rowid
+"""
+
+SELECT_SPECIALTY_DOCTORS = """
+SELECT d.id, d.name, d.url, d.rating, d.reviews_count, d.specialty_display
+FROM doctors d JOIN doctor_specialties s ON s.doctor_id = d.id
+WHERE s.specialty = ?
+ORDER BY s.rowid
+"""
+
+UPSERT_SNAPSHOT = """
+INSERT INTO specialty_snapshots (specialty, total, fingerprint) VALUES (?, ?, ?)
+ON CONFLICT (specialty) DO UPDATE SET total = excluded.total, fingerprint = excluded.fingerprint
+"""
+
+# Снимок без total (или специальность без снимка, как после импорта JSON) -
+# число врачей специальности в базе
+SELECT_SNAPSHOTS = """
+SELECT s.specialty, COALESCE(s.total, n.total, 0), s.fingerprint
+FROM specialty_snapshots s
+LEFT JOIN (SELECT specialty, COUNT(*) AS total FROM doctor_specialties GROUP BY specialty) n
+    ON n.specialty = s.specialty
+UNION ALL
+SELECT specialty, COUNT(*), NULL FROM doctor_specialties
+WHERE specialty NOT IN (SELECT specialty FROM specialty_snapshots)
+GROUP BY specialty
+"""
+
+
+class DoctorStore:
+    """Врачи в SQLite (WAL); записи копятся и пишутся одной транзакцией по batch_size"""
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._doctors = []
+        self._specialties = []
+
+    def add(self, doctors, specialty=None):
+        for doc in doctors:
+            self._doctors.append(tuple(doc.get(field) for field in sinks.DOCTOR_FIELDS))
+            if specialty is not None:
+                self._specialties.append((doc['id'], specialty))
+        if len(self._doctors) >= self.batch_size:
+            self.flush()
+
+    def add_records(self, records):
+        """Записи потока/журнала: врач + необязательная специальность"""
+        for record in records:
+            self.add([record], record.get('specialty'))
+
+    def flush(self):
+        if not self._doctors:
+            return
+        with self._conn:
+            self._conn.executemany(UPSERT_DOCTOR, self._doctors)
+            self._conn.executemany(INSERT_SPECIALTY, self._specialties)
+        self._doctors = []
+        self._specialties = []
+
+    def count(self):
+        self.flush()
+        return self._conn.execute('SELECT COUNT(*) FROM doctors').fetchone()[0]
+
+    def doctors(self, with_specialties=True):
+        """Врачи в порядке первого появления, по одному за раз"""
+        self.flush()
+        rows = self._conn.execute(SELECT_DOCTORS)
+        for _, group in itertools.groupby(rows, key=lambda row: row[0]):
+            group = list(group)
+            doc = dict(zip(sinks.DOCTOR_FIELDS, group[0]))
+            if with_specialties:
+                doc['specialties'] = [row[-1] for row in group if row[-1] is not None]
+            yield doc
+
+    def specialty_doctors(self, specialty):
+        """Врачи одной специальности в порядке, в котором они были найдены"""
+        self.flush()
+        for row in self._conn.execute(SELECT_SPECIALTY_DOCTORS, (specialty,)):
+            yield dict(zip(sinks.DOCTOR_FIELDS, row))
+
+    def save_snapshots(self, snapshots):
+        """{специальность: (total, fingerprint)} - по ним следующий прогон ищет изменения"""
+        with self._conn:
+            self._conn.executemany(UPSERT_SNAPSHOT, [(name, *snapshot) for name, snapshot in snapshots.items()])
+
+    def snapshots(self):
+        self.flush()
+        return {name: (total, fingerprint) for name, total, fingerprint in self._conn.execute(SELECT_SNAPSHOTS)}
+
+    def export(self, csv_path, json_path, with_specialties=True):
+        sinks.write_csv(csv_path, self.doctors(with_specialties), with_specialties)
+        sinks.write_json(json_path, self.doctors(with_specialties))
+        return self.count()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fresh_store(db_path):
+    """Пустое хранилище на месте прежней базы (вместе с -wal/-shm)"""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    return DoctorStore(db_path)
+
+
+def build_outputs(records, db_path, csv_path, json_path, with_specialties=True, snapshots=None):
+    """Пересобирает хранилище из записей и выгружает CSV/JSON; возвращает число уникальных врачей"""
+    with fresh_store(db_path) as store:
+        store.add_records(records)
+        if snapshots:
+            store.save_snapshots(snapshots)
+        return store.export(csv_path, json_path, with_specialties)
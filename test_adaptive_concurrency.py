@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Тест адаптивной параллельности на локальном сервере с ограничением частоты запросов
+"""
+
+import asyncio
+import time
+
+from aiohttp import web
+
+import scrape_moscow_async as scraper
+
+
+def make_app(capacity=6, latency=0.02, retry_after=None):
+    """Сервер-заглушка: больше capacity одновременных запросов -> 429"""
+    state = {'in_flight': 0, 'peak': 0, 'throttled': 0, 'served': 0}
+
+    async def handler(request):
+        if state['in_flight'] >= capacity:
+            state['throttled'] += 1
+            headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+            return web.Response(status=429, headers=headers)
+        state['in_flight'] += 1
+        state['peak'] = max(state['peak'], state['in_flight'])
+        try:
+            await asyncio.sleep(latency)
+            state['served'] += 1
+            return web.Response(text='<html></html>', content_type='text/html')
+        finally:
+            state['in_flight'] -= 1
+
+    app = web.Application()
+    app.router.add_get('/moskva/{specialty}/', handler)
+    return app, state
+
+
+async def serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/moskva/test/"
+
+
+async def run_crawl(capacity, pages, **limiter_kwargs):
+    app, state = make_app(capacity=capacity)
+    runner, url = await serve(app)
+    limiter = scraper.AdaptiveLimiter(**limiter_kwargs)
+    try:
+        async with scraper.create_session() as session:
+            urls = [f"{url}?page={page}" for page in range(1, pages + 1)]
+            results = await scraper.fetch_pages(session, limiter, urls)
+    finally:
+        await runner.cleanup()
+    return limiter, state, results
+
+
+def test_grows_when_healthy():
+    limiter, state, results = asyncio.run(run_crawl(capacity=100, pages=200, initial=2, max_limit=12))
+    assert all(results)
+    assert state['throttled'] == 0
+    assert limiter.summary()['max'] > 2
+
+
+def test_backs_off_on_429():
+    limiter, state, results = asyncio.run(run_crawl(capacity=6, pages=300, initial=4, max_limit=30))
+    summary = limiter.summary()
+    assert state['throttled'] > 0
+    assert summary['failures'] == state['throttled']
+    # После перегрузки лимит должен был снижаться
+    limits = [limit for _, limit in limiter.history]
+    assert any(b < a for a, b in zip(limits, limits[1:]))
+    # Большая часть страниц всё равно загружена
+    assert sum(1 for html in results if html) > 0.8 * len(results)
+
+
+def test_honours_retry_after():
+    async def scenario():
+        app, state = make_app(capacity=0, retry_after=1)
+        runner, url = await serve(app)
+        limiter = scraper.AdaptiveLimiter(initial=2)
+        try:
+            async with scraper.create_session() as session:
+                await scraper.fetch_page(session, url, limiter)
+                started = time.monotonic()
+                await scraper.fetch_page(session, url, limiter)
+                return time.monotonic() - started
+        finally:
+            await runner.cleanup()
+
+    waited = asyncio.run(scenario())
+    assert waited >= 0.9
+
+
+def test_parse_retry_after():
+    assert scraper.parse_retry_after('5') == 5.0
+    assert scraper.parse_retry_after('') is None
+    assert scraper.parse_retry_after('garbage') is None
+    assert scraper.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def main():
+    for test in (test_grows_when_healthy, test_backs_off_on_429, test_honours_retry_after, test_parse_retry_after):
+        test()
+        print(f"OK {test.__name__}")
+
+    limiter, state, _ = asyncio.run(run_crawl(capacity=6, pages=300))
+    print(f"\nСервер: пик {state['peak']}, 429: {state['throttled']}, отдано: {state['served']}")
+    print(f"Параллельность: {limiter.format()}")
+    print("История лимита (сек, лимит):", limiter.history)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Тест каталога городов: очередь вперемешку по городам, сохранение каталога,
+обход двух городов заглушкой с итоговыми файлами по каждому городу и
+удалением из каталога специальности, которой в городе нет (404).
+Список специальностей с главной страницы города: разбор, срок жизни,
+подсказка числа страниц для поиска без total в meta.
+"""
+
+import asyncio
+import csv
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+import catalogue
+import mockserver
+import scrape_moscow_async as scraper
+
+
+def test_jobs_interleave():
+    cat = catalogue.Catalogue('')
+    cat.update('moskva', ['a', 'b', 'c'])
+    cat.update('spb', ['a'])
+    assert cat.jobs(['moskva', 'spb']) == ['/moskva/a/', '/spb/a/', '/moskva/b/', '/moskva/c/']
+    # Города нет в каталоге - все специальности
+    assert cat.specialties('kazan') == catalogue.SPECIALTY_SLUGS
+    assert catalogue.city_from_path('/spb/a/') == 'spb'
+    assert catalogue.output_prefix('moskva') == 'moscow' and catalogue.output_prefix('spb') == 'spb'
+
+
+def test_prune_roundtrip():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalogue.json')
+        cat = catalogue.Catalogue(path)
+        cat.update('spb', ['a', 'b', 'c'])
+        assert cat.prune('spb', ['b']) and not cat.prune('spb', ['b'])
+        assert cat.prune('kazan', [])  # новый город записывается в каталог
+        cat.save()
+        loaded = catalogue.Catalogue(path)
+    assert loaded.specialties('spb') == ['a', 'c']
+    assert loaded.specialties('kazan') == catalogue.SPECIALTY_SLUGS
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def find_output(tmp, prefix, suffix):
+    return os.path.join(tmp, next(name for name in os.listdir(tmp) if name.startswith(prefix) and name.endswith(suffix)))
+
+
+def run_main(tmp, base, *argv):
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    original = scraper.BASE_URL
+    try:
+        asyncio.run(scraper.main(scraper.parse_args(['--base-url', base, '--parse-workers', '0', *argv])))
+        return catalogue.Catalogue('catalogue.json')
+    finally:
+        scraper.BASE_URL = original
+        os.chdir(cwd)
+
+
+def test_multi_city_crawl():
+    site = mockserver.MockSite({'a': 65, 'spb/a': 25, 'b': 30}, default_doctors=10, overlap=0, missing={'spb/b'})
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        cat = catalogue.Catalogue(os.path.join(tmp, 'catalogue.json'))
+        for city in ('moskva', 'spb'):
+            cat.update(city, ['a', 'b'])
+        cat.save()
+
+        pruned = run_main(tmp, base, '--city', 'moskva', '--city', 'spb', '--no-index')
+        moscow = read_csv(find_output(tmp, 'moscow_doctors_full_', '.csv'))
+        spb = read_csv(find_output(tmp, 'spb_doctors_full_', '.csv'))
+        spb_stats = read_csv(find_output(tmp, 'spb_doctors_stats_', '.csv'))
+
+    assert len(moscow) == 65 + 30 and len(spb) == 25
+    assert {row['specialty'] for row in spb_stats} == {'a', 'b'}
+    assert pruned.specialties('moskva') == ['a', 'b'] and pruned.specialties('spb') == ['a']
+    assert site.requests[404] == 1
+
+
+def test_parse_index():
+    site = mockserver.MockSite({'terapevt': 1234, 'spb/akusher': 7}, index=['terapevt', 'akusher'])
+    html = site.render_index('spb').replace('1234', '1&nbsp;234')
+    assert catalogue.parse_index(html, 'spb') == {'terapevt': 1234, 'akusher': 7}
+    assert catalogue.parse_index(html, 'moskva') == {}
+
+    cat = catalogue.Catalogue('')
+    assert cat.is_stale('spb') and cat.load_index('spb', html) == 2 and not cat.is_stale('spb')
+    assert cat.is_stale('spb', now=datetime.now() + timedelta(days=catalogue.INDEX_TTL_DAYS + 1))
+    assert cat.paths('spb') == ['/spb/terapevt/', '/spb/akusher/'] and cat.count('/spb/akusher/') == 7
+    # Пустой индекс не затирает каталог, удаление 404 не продлевает срок
+    assert cat.load_index('spb', '<html></html>') == 0 and cat.specialties('spb') == ['terapevt', 'akusher']
+    updated = cat.cities['spb']['updated'] = '2000-01-01T00:00:00'
+    assert cat.prune('spb', ['akusher']) and cat.cities['spb']['updated'] == updated
+    assert cat.counts('spb') == {'terapevt': 1234} and cat.is_stale('spb')
+
+
+def test_index_discovery_crawl():
+    site = mockserver.MockSite({'a': 305, 'b': 45}, hide_total=True, index=['b', 'a'])
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        cat = run_main(tmp, base)
+        first_run = site.requests[200]
+        # Индекс свежий - второй раз главная страница не запрашивается
+        run_main(tmp, base, '--journal', 'second.jsonl')
+        second_run = site.requests[200] - first_run
+
+    assert cat.specialties('moskva') == ['b', 'a'] and cat.counts('moskva') == {'a': 305, 'b': 45}
+    assert cat.paths('moskva') == ['/moskva/a/', '/moskva/b/']
+    # Индекс + страницы + по одной пустой пробной странице за последней
+    assert first_run == 1 + 16 + 3 + 2
+    assert second_run == first_run - 1
+
+
+def main():
+    for test in (test_jobs_interleave, test_prune_roundtrip, test_multi_city_crawl, test_parse_index,
+                 test_index_discovery_crawl):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
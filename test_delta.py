@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Тест дельта-обхода: сравнение снимков специальностей и разница двух баз
+"""
+
+import json
+import os
+import tempfile
+
+import delta
+import store
+from test_sinks import doctor
+
+
+def test_is_unchanged():
+    page = [doctor('1', 4.5, 10), doctor('2')]
+    current = delta.snapshot({'total': 40, 'doctors': page})
+    assert delta.is_unchanged((40, current['fingerprint']), current)
+    assert delta.is_unchanged((40, None), current)
+    assert not delta.is_unchanged((41, current['fingerprint']), current)
+    assert not delta.is_unchanged(None, current)
+    # Поменялся рейтинг на первой странице - отпечаток другой
+    changed = delta.snapshot({'total': 40, 'doctors': [doctor('1', 4.6, 10), doctor('2')]})
+    assert not delta.is_unchanged((40, current['fingerprint']), changed)
+
+
+def test_previous_from_json_and_diff():
+    with tempfile.TemporaryDirectory() as tmp:
+        previous_json = os.path.join(tmp, 'moscow_doctors_full_1.json')
+        with open(previous_json, 'w', encoding='utf-8') as f:
+            json.dump([
+                {**doctor('1', 4.5, 10), 'specialties': ['terapevt']},
+                {**doctor('2', 4.0, 3), 'specialties': ['terapevt', 'pediatr']},
+                {**doctor('3'), 'specialties': ['pediatr']},
+            ], f)
+
+        previous = delta.open_previous(previous_json)
+        assert previous.snapshots() == {'terapevt': (2, None), 'pediatr': (2, None)}
+        assert [doc['id'] for doc in previous.specialty_doctors('pediatr')] == ['2', '3']
+        previous.close()
+
+        current_db = os.path.join(tmp, 'current.sqlite')
+        with store.DoctorStore(current_db) as current:
+            current.add([doctor('1', 4.5, 10), doctor('2', 4.1, 5)], 'terapevt')
+            current.add([doctor('4')], 'pediatr')
+
+        changes = delta.diff(previous.path, current_db)
+        assert [doc['id'] for doc in changes['new']] == ['4']
+        assert [doc['id'] for doc in changes['removed']] == ['3']
+        assert changes['changed'] == [{'id': '2', 'name': 'Врач 2', 'rating': [4.0, 4.1], 'reviews_count': [3, 5]}]
+
+
+def main():
+    for test in (test_is_unchanged, test_previous_from_json_and_diff):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
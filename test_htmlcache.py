@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Тест кэша сырого HTML: замена версий страницы, вытеснение по размеру, разбор без сети
+и наполнение кэша при включённом кэше валидаторов (304)
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+import htmlcache
+import scrape_moscow_async as scraper
+import validators
+from test_parsers import load_fixtures
+from test_retry_policy import serve
+from test_validators import make_app
+
+
+def test_put_replace_and_evict():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = htmlcache.RawHtmlCache(tmp)
+        cache.put('/moskva/a/', 1, '<html>v1</html>')
+        cache.put('/moskva/a/', 1, '<html>v1</html>')
+        assert (cache.written, cache.unchanged) == (1, 1)
+        cache.put('/moskva/a/', 1, '<html>v2</html>')
+        assert cache.get('/moskva/a/', 1) == '<html>v2</html>'
+        assert len(os.listdir(os.path.join(tmp, 'moskva__a'))) == 1
+
+        # Индекс восстанавливается при открытии
+        cache = htmlcache.RawHtmlCache(tmp)
+        assert cache.get('/moskva/a/', 1) == '<html>v2</html>'
+        assert cache.get('/moskva/a/', 2) is None
+
+        cache.max_bytes = cache.size * 2
+        cache.put('/moskva/b/', 1, '<html>b</html>')
+        cache.get('/moskva/a/', 1)  # a прочитана позже b - вытесняется b
+        cache.put('/moskva/c/', 1, '<html>c</html>')
+        assert cache.evicted == 1
+        assert cache.get('/moskva/b/', 1) is None
+        assert cache.get('/moskva/c/', 1) == '<html>c</html>'
+        assert cache.size <= cache.max_bytes
+
+        # После открытия порядок вытеснения - по mtime; недописанный .tmp удаляется
+        past = time.time() - 100
+        os.utime(cache.pages('/moskva/c/')[1], (past, past))
+        broken = os.path.join(tmp, 'moskva__a', f"2-{'0' * 40}.html.{cache.codec}.tmp")
+        with open(broken, 'wb') as f:
+            f.write(b'partial')
+        cache = htmlcache.RawHtmlCache(tmp, max_bytes=cache.max_bytes)
+        assert not os.path.exists(broken) and sorted(cache.pages('/moskva/a/')) == [1]
+        cache.put('/moskva/d/', 1, '<html>d</html>')
+        assert cache.get('/moskva/c/', 1) is None and cache.get('/moskva/a/', 1) == '<html>v2</html>'
+
+
+def test_reparse_matches_parse_page():
+    html = load_fixtures()['listing_full.html']
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = htmlcache.RawHtmlCache(tmp)
+        cache.put('/moskva/ginekolog/', 1, html)
+        cache.put('/moskva/ginekolog/', 2, html)
+
+        async def collect():
+            return [item async for item in scraper.reparse_cache(cache, ['/moskva/ginekolog/'])]
+
+        pages = sorted(asyncio.run(collect()), key=lambda item: item[1])
+
+    first = scraper.parse_page(html, first_page=True)
+    assert pages[0] == ('/moskva/ginekolog/', 1, first[0], first[1])
+    assert pages[1] == ('/moskva/ginekolog/', 2, None, first[1])
+
+
+def test_not_modified_pages_reach_html_cache():
+    """Кэш HTML включён после прогона с валидаторами: страницы без копии качаются целиком, на 304 - отметка"""
+    async def crawl_once(tmp, html_cache):
+        with validators.ValidatorCache(os.path.join(tmp, 'validators.sqlite')) as cache:
+            async with scraper.create_session() as session:
+                async for _ in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/etag/', '/moskva/plain/'],
+                                             retry=scraper.RetryPolicy(), cache=cache, html_cache=html_cache):
+                    pass
+
+    async def scenario(tmp):
+        app, statuses = make_app()
+        runner, base = await serve(app)
+        scraper.BASE_URL = base
+        try:
+            await crawl_once(tmp, None)
+            html_cache = htmlcache.RawHtmlCache(os.path.join(tmp, 'html'))
+            await crawl_once(tmp, html_cache)
+            first = (html_cache.written, statuses[304])
+            await crawl_once(tmp, html_cache)
+        finally:
+            await runner.cleanup()
+        return first, html_cache, statuses
+
+    original = scraper.BASE_URL
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            first, html_cache, statuses = asyncio.run(scenario(tmp))
+            pages = {page for path in ('/moskva/etag/', '/moskva/plain/') for page in html_cache.pages(path)}
+    finally:
+        scraper.BASE_URL = original
+
+    assert first == (6, 0) and pages == {1, 2, 3}
+    # Третий прогон: страницы /etag/ - 304 и отметка в кэше, /plain/ - то же содержимое
+    assert statuses[304] == 3 and html_cache.written == 6 and html_cache.unchanged == 6
+
+
+def main():
+    for test in (test_put_replace_and_evict, test_reparse_matches_parse_page, test_not_modified_pages_reach_html_cache):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Тест журнала обхода: оборванные записи, восстановление состояния и пропуск готовых страниц
+"""
+
+import asyncio
+import csv
+import json
+import os
+import tempfile
+
+import journal
+import mockserver
+import scrape_moscow_async as scraper
+import scrape_moscow_doctors_v2 as v2
+from test_retry_policy import make_app, serve
+from test_sinks import doctor
+
+
+def test_partial_tail_is_dropped():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        with journal.CrawlJournal(path, header={'timestamp': 'T'}) as log:
+            log.record('/moskva/a/', 1, [doctor('1'), doctor('2')], last_page=2)
+        # Падение посреди записи второй страницы
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('{"type": "unit", "specialty": "/moskva/a/", "pa')
+
+        with journal.CrawlJournal(path) as log:
+            log.record('/moskva/a/', 2, [doctor('2'), doctor('3')])
+
+        header, entries = journal.read_journal(path)
+        assert header['timestamp'] == 'T'
+        state = journal.ResumeState.from_entries(entries)
+        assert state.done == {('/moskva/a/', 1), ('/moskva/a/', 2)}
+        assert state.is_complete('/moskva/a/')
+        assert state.seen_ids == {'1', '2', '3'}
+        assert state.found['/moskva/a/'] == 4
+        assert state.new['/moskva/a/'] == 3
+
+
+def test_journal_records_skip_repeated_pages():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        with journal.CrawlJournal(path, header={'timestamp': 'T'}) as log:
+            log.record('/moskva/a/', 1, [doctor('1')], last_page=1)
+            log.record('/moskva/a/', 1, [doctor('1')], last_page=1)
+            log.record('/moskva/b/', 1, [doctor('1')], last_page=1)
+        records = list(journal.journal_records(path, lambda path: path.strip('/').split('/')[-1]))
+        assert [record['specialty'] for record in records] == ['a', 'b']
+
+
+def test_crawl_skips_done_pages():
+    """По журналу с первой и третьей страницей догружается только вторая"""
+    state = journal.ResumeState.from_entries([
+        {'specialty': '/moskva/test/', 'page': 1, 'last_page': 3, 'doctors': []},
+        {'specialty': '/moskva/test/', 'page': 3, 'last_page': None, 'doctors': []},
+    ])
+
+    async def scenario():
+        app, hits = make_app(failures_per_url=0)
+        runner, base = await serve(app)
+        scraper.BASE_URL = base
+        pages = []
+        try:
+            async with scraper.create_session() as session:
+                async for item in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/test/'],
+                                                resume=state):
+                    pages.append(item)
+        finally:
+            await runner.cleanup()
+        return pages, hits
+
+    original = scraper.BASE_URL
+    try:
+        pages, hits = asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+    assert [page for _, page, _, _ in pages] == [2]
+    assert list(hits) == ['/moskva/test/?page=2']
+
+
+def count_rows(tmp, prefix):
+    name = next(name for name in os.listdir(tmp) if name.startswith(prefix) and name.endswith('.csv'))
+    with open(os.path.join(tmp, name), encoding='utf-8-sig') as f:
+        return len(list(csv.DictReader(f)))
+
+
+def test_failed_pages_are_retried_on_resume():
+    """Страница, которая так и не загрузилась, пишется с пометкой failed и догружается при --resume"""
+    site = mockserver.MockSite({'a': 65, 'b': 30, 'vrach': 105}, overlap=0, broken={('a', 2), ('b', 1), ('vrach', 1)})
+    cwd = os.getcwd()
+    original = scraper.BASE_URL, v2.BASE_URL
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        os.chdir(tmp)
+        try:
+            with open('catalogue.json', 'w', encoding='utf-8') as f:
+                json.dump({'cities': {'moskva': {'specialties': ['a', 'b']}}}, f)
+            args = ['--base-url', base, '--parse-workers', '0', '--no-index', '--journal', 'async.jsonl']
+            asyncio.run(scraper.main(scraper.parse_args(args)))
+            v2_args = ['--base-url', base, '--parse-workers', '0', '--journal', 'v2.jsonl']
+            v2.main(v2.parse_args(v2_args))
+
+            state = journal.ResumeState.from_entries(journal.read_journal('async.jsonl')[1])
+            assert ('/moskva/a/', 2) not in state.done and not state.is_complete('/moskva/a/')
+            assert '/moskva/b/' not in state.last_pages and not state.is_complete('/moskva/b/')
+            failed = [entry for entry in journal.read_journal('async.jsonl')[1] if entry.get('failed')]
+            assert sorted((entry['specialty'], entry['page']) for entry in failed) == [('/moskva/a/', 2),
+                                                                                      ('/moskva/b/', 1)]
+            assert ('/moskva/vrach/', 1) not in journal.ResumeState.from_entries(journal.read_journal('v2.jsonl')[1]).done
+
+            # Сайт починился - продолжение догружает только незагруженные страницы
+            site.broken.clear()
+            requests_before = site.requests[200]
+            reads = []
+            read_journal = journal.read_journal
+            journal.read_journal = lambda path: reads.append(path) or read_journal(path)
+            try:
+                asyncio.run(scraper.main(scraper.parse_args(args + ['--resume'])))
+            finally:
+                journal.read_journal = read_journal
+            assert site.requests[200] - requests_before == 1 + 2
+            # База и снимки - по ходу продолжения, журнал читается один раз
+            assert reads == ['async.jsonl']
+            v2.main(v2.parse_args(v2_args + ['--resume']))
+            assert count_rows(tmp, 'moscow_doctors_full_') == 65 + 30
+            assert count_rows(tmp, 'moscow_all_doctors_') == 105
+        finally:
+            scraper.BASE_URL, v2.BASE_URL = original
+            os.chdir(cwd)
+
+
+def main():
+    for test in (test_partial_tail_is_dropped, test_journal_records_skip_repeated_pages, test_crawl_skips_done_pages,
+                 test_failed_pages_are_retried_on_resume):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Тест метрик: текстовый формат Prometheus, счётчики обхода асинхронным
+скрапером через заглушку, /metrics по HTTP и лента событий
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import requests
+
+import metrics
+import mockserver
+import scrape_moscow_async as scraper
+
+
+def test_render_format():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter('x_total', 'счётчик', ['status']))
+    histogram = registry.register(metrics.Histogram('x_seconds', 'время', (0.1, 1.0)))
+    counter.inc(status=200)
+    counter.inc(2, status=200)
+    counter.inc(status='error')
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+
+    text = registry.render()
+    assert '# TYPE x_total counter' in text
+    assert 'x_total{status="200"} 3' in text
+    assert 'x_total{status="error"} 1' in text
+    assert 'x_seconds_bucket{le="0.1"} 2' in text
+    assert 'x_seconds_bucket{le="1.0"} 3' in text
+    assert 'x_seconds_bucket{le="+Inf"} 4' in text
+    assert 'x_seconds_count 4' in text
+
+
+def test_crawl_metrics_and_timeline():
+    site = mockserver.MockSite({'a': 95, 'b': 30}, error_rate=0.2, seed=1)
+    metrics.REGISTRY.reset()
+
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        retry = scraper.RetryPolicy(max_attempts=6, base_delay=0.01)
+        try:
+            async with scraper.create_session() as session:
+                async for specialty, page, _, doctors in scraper.crawl(
+                        session, scraper.AdaptiveLimiter(), ['/moskva/a/', '/moskva/b/'], retry=retry):
+                    metrics.observe_page(specialty, page, len(doctors))
+        finally:
+            await runner.cleanup()
+
+    original = scraper.BASE_URL
+    with tempfile.TemporaryDirectory() as tmp:
+        timeline_path = os.path.join(tmp, 'timeline.jsonl')
+        metrics.start_timeline(timeline_path)
+        try:
+            asyncio.run(scenario())
+        finally:
+            scraper.BASE_URL = original
+            metrics.stop_timeline()
+        with open(timeline_path, encoding='utf-8') as f:
+            events = [json.loads(line) for line in f]
+
+    assert metrics.REQUESTS.get(status=200) == site.requests[200] == 7
+    assert metrics.REQUESTS.get(status=503) == site.requests[503] == metrics.RETRIES.get()
+    assert metrics.IN_FLIGHT.get() == 0
+    assert metrics.FETCH_SECONDS.get()['count'] == 7 + site.requests[503]
+    assert metrics.PARSE_SECONDS.get()['count'] == 7
+    assert (metrics.PAGES.get(), metrics.DOCTORS.get()) == (7, 125)
+    assert metrics.BYTES.get() > 0
+    kinds = [event['event'] for event in events]
+    assert kinds.count('fetch') == 7 + site.requests[503] and kinds.count('page') == 7
+    assert events == sorted(events, key=lambda event: event['t'])
+
+
+def test_specialty_rate_from_own_start():
+    metrics.REGISTRY.reset()
+    metrics.SPECIALTY_STARTED.clear()
+    metrics.start_specialty('a')
+    time.sleep(0.2)
+    metrics.start_specialty('b')
+    metrics.start_specialty('a')  # повторный вызов время не сдвигает
+    metrics.observe_specialty('b', 10)
+    metrics.observe_specialty('a', 10)
+    # b считается от своего начала, а не от начала обхода (a)
+    assert metrics.SPECIALTY_RATE.get(specialty='b') > 50 > metrics.SPECIALTY_RATE.get(specialty='a') > 0
+    assert metrics.SPECIALTIES_DONE.get() == 2
+    assert 'a' not in metrics.SPECIALTY_STARTED and 'b' not in metrics.SPECIALTY_STARTED
+
+
+def test_v2_sync_metrics():
+    """v2 с --engine sync считает загрузки, разбор и страницы так же, как асинхронный движок, и пишет ленту"""
+    import scrape_moscow_doctors_v2 as v2
+
+    site = mockserver.MockSite({'vrach': 45}, overlap=0)
+    metrics.REGISTRY.reset()
+    cwd = os.getcwd()
+    original = v2.BASE_URL, v2.time.sleep
+    v2.time.sleep = lambda seconds: None
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        os.chdir(tmp)
+        try:
+            v2.main(v2.parse_args(['--base-url', base, '--engine', 'sync', '--journal', 'v2.jsonl',
+                                   '--metrics-timeline', 'timeline.jsonl']))
+            with open('timeline.jsonl', encoding='utf-8') as f:
+                events = [json.loads(line) for line in f]
+        finally:
+            v2.BASE_URL, v2.time.sleep = original
+            os.chdir(cwd)
+
+    assert metrics.REQUESTS.get(status=200) == site.requests[200] == 3
+    assert metrics.PARSE_SECONDS.get()['count'] == 3
+    assert (metrics.PAGES.get(), metrics.DOCTORS.get()) == (3, 45)
+    assert metrics.SPECIALTIES_DONE.get() == 1
+    kinds = [event['event'] for event in events]
+    assert kinds.count('fetch') == 3 and kinds.count('page') == 3 and kinds.count('specialty') == 1
+
+
+def test_http_endpoint():
+    registry = metrics.Registry()
+    registry.register(metrics.Gauge('y_in_flight', 'запросов')).set(3)
+    server = metrics.serve(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        resp = requests.get(f"{url}/metrics")
+        assert resp.status_code == 200 and resp.headers['Content-Type'].startswith('text/plain')
+        assert 'y_in_flight 3' in resp.text
+        assert requests.get(f"{url}/other").status_code == 404
+    finally:
+        server.shutdown()
+
+
+def main():
+    for test in (test_render_format, test_crawl_metrics_and_timeline, test_specialty_rate_from_own_start,
+                 test_v2_sync_metrics, test_http_endpoint):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
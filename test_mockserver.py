@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Тест заглушки prodoctorov.ru: синтетические страницы разбираются скраперами,
+ошибки отдаются с заданной долей, записанные страницы подменяют синтетические
+"""
+
+import asyncio
+import tempfile
+
+import requests
+
+import htmlcache
+import mockserver
+import parsers
+import scrape_moscow_async as scraper
+
+
+def test_synthetic_pages_parse():
+    site = mockserver.MockSite({'terapevt': 45})
+    first = parsers.analyze_page(site.render('terapevt', 1))
+    assert (first['total'], first['last_page'], len(first['doctors'])) == (45, 3, 20)
+    last = parsers.parse_doctors(site.render('terapevt', 3))
+    assert len(last) == 5
+    # Каждый пятый врач общий для всех специальностей
+    other = parsers.parse_doctors(site.render('pediatr', 1))
+    assert {doc['id'] for doc in first['doctors']} & {doc['id'] for doc in other} == {
+        str(site.doctor_id('terapevt', index)) for index in range(0, 20, 5)
+    }
+
+
+def test_crawl_through_errors():
+    site = mockserver.MockSite({'a': 95, 'b': 30}, error_rate=0.2, seed=1)
+
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        retry = scraper.RetryPolicy(max_attempts=6, base_delay=0.01)
+        pages = []
+        try:
+            async with scraper.create_session() as session:
+                async for item in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/a/', '/moskva/b/'],
+                                                retry=retry):
+                    pages.append(item)
+        finally:
+            await runner.cleanup()
+        return pages
+
+    original = scraper.BASE_URL
+    try:
+        pages = asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+    assert len(pages) == 7
+    assert sum(len(doctors) for _, _, _, doctors in pages) == 125
+    assert site.requests[503] > 0
+
+
+def test_server_thread_serves_recordings():
+    with tempfile.TemporaryDirectory() as tmp:
+        htmlcache.RawHtmlCache(tmp).put('/moskva/ginekolog/', 2, '<html>recorded</html>')
+        site = mockserver.MockSite(recordings=tmp)
+        with mockserver.ServerThread(site) as base:
+            assert requests.get(f"{base}/moskva/ginekolog/?page=2").text == '<html>recorded</html>'
+            assert 'data-doctor-id' in requests.get(f"{base}/moskva/ginekolog/").text
+
+
+def main():
+    for test in (test_synthetic_pages_parse, test_crawl_through_errors, test_server_thread_serves_recordings):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Тест поиска числа страниц без total в meta: галоп и двоичный поиск находят
+последнюю страницу за O(log страниц) запросов, обход собирает всех врачей.
+Общий список (crawl_listing) находит конец данных по пустым страницам.
+"""
+
+import asyncio
+import csv
+import math
+import os
+import tempfile
+
+import journal
+import mockserver
+import pagination
+import scrape_moscow_async as scraper
+import scrape_moscow_doctors as sync_scraper
+import scrape_moscow_doctors_v2 as v2
+
+
+def search_last_page(last_page, width=pagination.GALLOP_WIDTH, hint=None):
+    search = pagination.PageCountSearch(width, hint)
+    while True:
+        pages = search.next_pages()
+        if not pages:
+            break
+        for page in reversed(pages):
+            search.record(page, page <= last_page)
+    assert search.done
+    return search.last_page, search.probed
+
+
+def test_search():
+    for last_page in (1, 2, 3, 7, 8, 9, 100, 327, 5000):
+        for width in (1, 4):
+            found, probed = search_last_page(last_page, width)
+            assert found == last_page, (last_page, width, found)
+            assert probed <= 2 * math.log2(last_page + 1) + width + 1, (last_page, width, probed)
+
+
+def test_search_hint():
+    # Верная подсказка - два запроса, неверная - поиск продолжается от неё
+    assert search_last_page(327, hint=327) == (327, 2)
+    assert search_last_page(1, hint=1) == (1, 1)
+    for last_page, hint in ((327, 300), (327, 400), (5, 1), (1, 50), (5000, 16)):
+        found, probed = search_last_page(last_page, hint=hint)
+        assert found == last_page, (last_page, hint, found)
+        assert probed <= 2 * math.log2(last_page + hint + 1) + pagination.GALLOP_WIDTH + 2, (last_page, hint, probed)
+
+
+def test_search_failed_probe():
+    # Не загрузившаяся страница не сдвигает границы и остаётся в last_page
+    search = pagination.PageCountSearch()
+    while True:
+        pages = search.next_pages()
+        if not pages:
+            break
+        for page in pages:
+            if page == 12:
+                search.record_failure(page)
+            else:
+                search.record(page, page <= 12)
+    assert search.done and search.lo == 11 and search.last_page == 12 and search.failed == {12}
+    # Не загрузилась вся пачка галопа - поиск не уходит в бесконечность
+    search = pagination.PageCountSearch(width=2)
+    assert search.next_pages() == [2, 4]
+    search.record(2, True)
+    search.record(4, True)
+    assert search.next_pages() == [8, 16]
+    search.record_failure(8)
+    search.record_failure(16)
+    assert search.next_pages() == [6]
+    search.record(6, True)
+    assert search.next_pages() == [7]
+    search.record(7, False)
+    assert search.done and search.last_page == 6
+
+
+def test_redirect_counts_as_empty():
+    first = [{'id': '1'}, {'id': '2'}]
+    assert pagination.is_empty_page([])
+    assert pagination.is_empty_page(first, {'1', '2'})
+    assert not pagination.is_empty_page([{'id': '3'}], {'1', '2'})
+
+
+def test_crawl_without_total():
+    site = mockserver.MockSite({'a': 305, 'b': 15, 'c': 40}, hide_total=True)
+
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        retry = scraper.RetryPolicy()
+        pages = []
+        try:
+            async with scraper.create_session() as session:
+                async for item in scraper.crawl(session, scraper.AdaptiveLimiter(),
+                                                ['/moskva/a/', '/moskva/b/', '/moskva/c/'], retry=retry):
+                    pages.append(item)
+        finally:
+            await runner.cleanup()
+        return pages, retry
+
+    original = scraper.BASE_URL
+    try:
+        pages, retry = asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+    last_pages = {specialty: last_page for specialty, page, last_page, _ in pages if page == 1}
+    assert last_pages == {'/moskva/a/': 16, '/moskva/b/': 1, '/moskva/c/': 2}
+    # Каждая страница ровно один раз, пустые пробные - не в обходе и не в полноте
+    assert sorted((specialty, page) for specialty, page, _, _ in pages) == sorted(
+        [('/moskva/a/', page) for page in range(1, 17)] + [('/moskva/b/', 1)] + [('/moskva/c/', 1), ('/moskva/c/', 2)])
+    assert sum(len(doctors) for _, _, _, doctors in pages) == 360
+    assert retry.completeness() == 1.0 and len(retry.requested) == 19
+    # Лишние запросы - только пустые пробные страницы
+    assert site.requests[200] - 19 <= 3 * 6
+
+
+def test_sync_without_total():
+    site = mockserver.MockSite({'a': 305}, hide_total=True)
+    original = sync_scraper.BASE_URL, sync_scraper.time.sleep
+    with mockserver.ServerThread(site) as base:
+        sync_scraper.BASE_URL = base
+        sync_scraper.time.sleep = lambda seconds: None
+        try:
+            doctors = sync_scraper.scrape_specialty('/moskva/a/')
+        finally:
+            sync_scraper.BASE_URL, sync_scraper.time.sleep = original
+    assert len(doctors) == 305
+    assert site.requests[200] <= 16 + 6
+
+
+def test_crawl_broken_probe():
+    site = mockserver.MockSite({'a': 230}, hide_total=True, broken={('a', 12)})
+
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        retry = scraper.RetryPolicy(max_attempts=2, base_delay=0.01)
+        pages = []
+        try:
+            async with scraper.create_session() as session:
+                async for item in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/a/'], retry=retry):
+                    pages.append(item)
+        finally:
+            await runner.cleanup()
+        return pages, retry
+
+    original = scraper.BASE_URL
+    try:
+        pages, retry = asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+    # Страница 12 - не конец списка, а потеря: в last_page, в dead-letter и в полноте
+    assert [last_page for _, page, last_page, _ in pages if page == 1] == [12]
+    assert sorted(page for _, page, _, _ in pages) == list(range(1, 13))
+    assert sum(len(doctors) for _, _, _, doctors in pages) == 220
+    assert list(retry.dead_letters) == [url for url in retry.requested if url.endswith('?page=12')]
+    assert retry.completeness() < 1.0
+
+
+def crawl_listing(site, resume=None):
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        retry = scraper.RetryPolicy(max_attempts=6, base_delay=0.01)
+        pages = []
+        try:
+            async with scraper.create_session() as session:
+                async for item in scraper.crawl_listing(session, scraper.AdaptiveLimiter(max_limit=8), '/moskva/vrach/',
+                                                        retry=retry, resume=resume):
+                    pages.append(item)
+        finally:
+            await runner.cleanup()
+        return pages, retry
+
+    original = scraper.BASE_URL
+    try:
+        return asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+
+def test_listing_end_of_data():
+    for hide_total in (False, True):
+        site = mockserver.MockSite({'vrach': 1005}, error_rate=0.1, seed=2, hide_total=hide_total)
+        pages, retry = crawl_listing(site)
+        assert sorted(page for _, page, _, _ in pages) == list(range(1, 52)), hide_total
+        assert sum(len(doctors) for _, _, _, doctors in pages) == 1005
+        assert pages[0][2] == (None if hide_total else 51)
+        assert retry.completeness() == 1.0 and len(retry.requested) == 51
+        # За концом - не больше окна воркеров и серии пустых страниц
+        assert site.requests[200] <= 51 + 8 + scraper.END_OF_DATA_EMPTY
+
+
+def test_listing_resume():
+    site = mockserver.MockSite({'vrach': 205})
+    resume = journal.ResumeState()
+    for page in (1, 2, 5):
+        resume.add({'specialty': '/moskva/vrach/', 'page': page, 'doctors': [], 'last_page': 11 if page == 1 else None})
+    pages, _ = crawl_listing(site, resume)
+    assert sorted(page for _, page, _, _ in pages) == [3, 4, 6, 7, 8, 9, 10, 11]
+
+
+def test_v2_async_outputs():
+    site = mockserver.MockSite({'vrach': 333})
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            v2.main(v2.parse_args(['--base-url', base, '--parse-workers', '0']))
+            csv_files = [name for name in os.listdir(tmp) if name.endswith('.csv')]
+            with open(csv_files[0], encoding='utf-8-sig') as f:
+                rows = list(csv.DictReader(f))
+        finally:
+            os.chdir(cwd)
+    assert len(rows) == 333
+
+
+def main():
+    for test in (test_search, test_search_hint, test_search_failed_probe, test_redirect_counts_as_empty,
+                 test_crawl_without_total, test_crawl_broken_probe, test_sync_without_total,
+                 test_listing_end_of_data, test_listing_resume, test_v2_async_outputs):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Тест эквивалентности движков парсинга на сохранённых страницах из fixtures/
+и самопроверки fastscan: сырые байты ответа, счётчики из процессов пула;
+синхронные движки разбирают выбранным --parser
+"""
+
+import asyncio
+import glob
+import os
+import tempfile
+
+import mockserver
+import parsers
+import scrape_moscow_async as scraper
+import scrape_moscow_doctors as sync_scraper
+import scrape_moscow_doctors_v2 as v2
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixtures():
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+
+def test_backends_match_reference():
+    """Каждый доступный движок даёт те же словари, что и bs4"""
+    for name, html in load_fixtures().items():
+        reference = parsers.parse_doctors_bs4(html)
+        for backend in parsers.BACKENDS:
+            assert parsers.parse_doctors(html, backend) == reference, f"{backend} на {name}"
+
+
+def test_full_page():
+    html = load_fixtures()['listing_full.html']
+    doctors = parsers.parse_doctors_bs4(html)
+    assert len(doctors) == 20
+    first = doctors[0]
+    assert first['id'] == '500000'
+    assert first['url'] == 'https://prodoctorov.ru/moskva/vrach/500000-doctor-500000/'
+    assert first['rating'] == 3.82
+    assert first['reviews_count'] == 155
+    assert first['specialty_display'] == 'Гинеколог'
+
+
+def test_edge_cases():
+    html = load_fixtures()['listing_edge_cases.html']
+    doctors = {doc['id']: doc for doc in parsers.parse_doctors_bs4(html)}
+    # Без ссылки на имя и с пустым id карточки пропускаются
+    assert '600004' not in doctors
+    assert '' not in doctors
+    assert len(doctors) == 6
+    assert doctors['600001']['rating'] is None
+    assert doctors['600002']['reviews_count'] is None
+    assert doctors['600003']['rating'] is None and doctors['600003']['reviews_count'] is None
+    assert doctors['600006']['name'] == 'Д\'Артаньян & Ко "Шарль"'
+    assert doctors['600007']['specialty_display'] == ''
+    assert doctors['600008']['specialty_display'] == 'Стоматолог терапевт ортопед'
+
+
+def test_corpus_pages():
+    """Неполная последняя страница, пустая страница за концом списка и карточки без рейтинга"""
+    fixtures = load_fixtures()
+    partial = parsers.analyze_page(fixtures['listing_partial_last.html'])
+    assert (partial['total'], partial['last_page'], len(partial['doctors'])) == (6537, 327, 17)
+
+    empty = parsers.analyze_page(fixtures['listing_empty.html'])
+    assert (empty['total'], empty['pagination_last'], empty['doctors']) == (6537, None, [])
+
+    no_ratings = parsers.analyze_page(fixtures['listing_no_ratings.html'])
+    assert (no_ratings['total'], no_ratings['last_page'], len(no_ratings['doctors'])) == (412, 21, 20)
+    assert all(doc['rating'] is None and doc['reviews_count'] is None for doc in no_ratings['doctors'])
+    assert no_ratings['doctors'][0]['specialty_display'] == 'Генетик'
+
+
+def test_empty_html():
+    for backend in parsers.BACKENDS:
+        assert parsers.parse_doctors('', backend) == []
+        assert parsers.parse_doctors('<html><body></body></html>', backend) == []
+
+
+def test_base_url_override():
+    html = load_fixtures()['listing_full.html']
+    for backend in parsers.BACKENDS:
+        doctors = parsers.parse_doctors(html, backend, base_url='http://127.0.0.1:8080')
+        assert doctors[0]['url'] == 'http://127.0.0.1:8080/moskva/vrach/500000-doctor-500000/'
+
+
+def test_analyze_page():
+    """Разбор за один проход совпадает у всех движков и с отдельным parse_doctors"""
+    fixtures = load_fixtures()
+    for name, html in fixtures.items():
+        reference = parsers.analyze_page(html, 'bs4')
+        assert reference['doctors'] == parsers.parse_doctors_bs4(html)
+        for backend in parsers.ANALYZERS:
+            assert parsers.analyze_page(html, backend) == reference, f"{backend} на {name}"
+
+    full = parsers.analyze_page(fixtures['listing_full.html'])
+    assert (full['total'], full['pagination_last'], full['last_page']) == (6537, 327, 327)
+
+    # Без total в meta число страниц берётся из пагинатора
+    edge = parsers.analyze_page(fixtures['listing_edge_cases.html'])
+    assert (edge['total'], edge['pagination_last'], edge['last_page']) == (None, 9, 9)
+
+    empty = parsers.analyze_page('')
+    assert (empty['total'], empty['last_page'], empty['doctors']) == (None, 1, [])
+
+
+def test_fastscan_accepts_bytes():
+    html = load_fixtures()['listing_full.html']
+    assert parsers.parse_doctors_fastscan(html.encode('utf-8')) == parsers.parse_doctors_bs4(html)
+
+
+def test_fastscan_falls_back_when_cards_vanish():
+    """Карточки есть, а fastscan их не видит - страница уходит на полный парсер"""
+    html = load_fixtures()['listing_full.html'].replace('b-doctor-card__name-link', 'b-doctor-card__title-link')
+    fast = parsers.FastScanParser(reference='bs4', sample_every=1000)
+    fast(load_fixtures()['listing_full.html'])
+    assert parsers.parse_doctors_fastscan(html) == []
+    assert fast(html) == parsers.parse_doctors_bs4(html)
+    assert fast.stats()['fallbacks'] == 1
+
+
+def test_fastscan_disables_itself_on_mismatch():
+    """Выборочная сверка ловит тихие расхождения и отключает fastscan"""
+    # Полный парсер видит одинарные кавычки, регулярки fastscan - нет
+    html = load_fixtures()['listing_full.html'].replace(
+        'class="b-stars-rate__progress" style="width: 3.8200em;"',
+        "class='b-stars-rate__progress' style='width: 3.8200em;'",
+    )
+    fast = parsers.FastScanParser(reference='bs4', sample_every=1)
+    assert fast(html) == parsers.parse_doctors_bs4(html)
+    assert fast.stats()['disabled']
+    assert fast(html) == parsers.parse_doctors_bs4(html)
+    # Прирост с прошлого вызова: второй раз - только новые страницы
+    assert fast.take_stats() == {'pages': 2, 'checked': 1, 'fallbacks': 0, 'disabled': True}
+    fast(html)
+    assert fast.take_stats() == {'pages': 1, 'checked': 0, 'fallbacks': 0, 'disabled': True}
+
+
+def test_fastscan_gets_raw_bytes_and_pool_stats():
+    """Обход с fastscan отдаёт парсеру байты ответа, счётчики процессов пула доходят до родителя"""
+    site = mockserver.MockSite({'a': 65})
+    seen = []
+
+    def recording(html, base_url=parsers.BASE_URL):
+        seen.append(type(html))
+        return parsers.FAST_SCAN(html, base_url)
+
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        try:
+            async with scraper.create_session() as session:
+                pages = [item async for item in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/a/'])]
+            html = load_fixtures()['listing_full.html'].encode('utf-8')
+            with scraper.ParsePool(1) as pool:
+                for _ in range(3):
+                    await pool.parse(html)
+                return pages, pool.scan_stats
+        finally:
+            await runner.cleanup()
+
+    original = scraper.BASE_URL, scraper.PARSER_BACKEND, parsers.BACKENDS['fastscan']
+    scraper.PARSER_BACKEND = 'fastscan'
+    parsers.BACKENDS['fastscan'] = recording
+    try:
+        pages, stats = asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL, scraper.PARSER_BACKEND, parsers.BACKENDS['fastscan'] = original
+
+    assert sum(len(doctors) for _, _, _, doctors in pages) == 65
+    assert seen and set(seen) == {bytes}
+    assert stats['pages'] == 3 and stats['fallbacks'] == 0 and not stats['disabled']
+
+
+def test_sync_engines_use_parser_backend():
+    site = mockserver.MockSite({'a': 45, 'vrach': 45})
+    original = [(module, module.BASE_URL, module.PARSER_BACKEND, module.time.sleep) for module in (sync_scraper, v2)]
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            sync_scraper.BASE_URL = base
+            sync_scraper.PARSER_BACKEND = 'fastscan'
+            sync_scraper.time.sleep = lambda seconds: None
+            before = parsers.FAST_SCAN.stats()['pages']
+            assert len(sync_scraper.scrape_specialty('/moskva/a/')) == 45
+            v2.main(v2.parse_args(['--base-url', base, '--engine', 'sync', '--parser', 'fastscan']))
+            # По 3 страницы на специальность и на общий список - все через fastscan
+            assert parsers.FAST_SCAN.stats()['pages'] - before == 6
+        finally:
+            os.chdir(cwd)
+            for module, base_url, backend, sleep in original:
+                module.BASE_URL, module.PARSER_BACKEND, module.time.sleep = base_url, backend, sleep
+
+
+def main():
+    print(f"Движки: {', '.join(parsers.BACKENDS)}")
+    for test in (test_backends_match_reference, test_full_page, test_edge_cases, test_corpus_pages, test_empty_html,
+                 test_base_url_override, test_analyze_page, test_fastscan_accepts_bytes,
+                 test_fastscan_falls_back_when_cards_vanish, test_fastscan_disables_itself_on_mismatch,
+                 test_fastscan_gets_raw_bytes_and_pool_stats, test_sync_engines_use_parser_backend):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
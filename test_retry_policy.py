@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Тест повторов с экспоненциальной задержкой и dead-letter на локальном сервере со сбоями
+"""
+
+import asyncio
+import collections
+
+from aiohttp import web
+
+import scrape_moscow_async as scraper
+
+
+def make_app(failures_per_url):
+    """Сервер-заглушка: первые failures_per_url запросов к каждой странице -> 503"""
+    hits = collections.Counter()
+
+    async def handler(request):
+        key = request.path_qs
+        hits[key] += 1
+        if hits[key] <= failures_per_url:
+            return web.Response(status=503)
+        total = 60
+        page = int(request.query.get('page', 1))
+        cards = ''.join(
+            f'<div class="b-doctor-card" data-doctor-id="{i}" data-doctor-name="Врач {i}">'
+            f'<a class="b-doctor-card__name-link" href="/moskva/vrach/{i}-vrach/">Врач {i}</a></div>'
+            for i in range((page - 1) * 20, min(page * 20, total))
+        )
+        return web.Response(
+            text=f'<html><head><meta name="description" content="{total} врачей"></head><body>{cards}</body></html>',
+            content_type='text/html',
+        )
+
+    app = web.Application()
+    app.router.add_get('/moskva/{specialty}/', handler)
+    return app, hits
+
+
+async def serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_backoff_full_jitter():
+    retry = scraper.RetryPolicy(base_delay=0.5, max_delay=4.0)
+    for attempt in range(10):
+        delay = retry.backoff(attempt)
+        assert 0 <= delay <= min(4.0, 0.5 * 2 ** attempt)
+
+
+def test_classification():
+    retry = scraper.RetryPolicy()
+    assert retry.is_retryable(429, None)
+    assert retry.is_retryable(503, None)
+    assert retry.is_retryable(500, None)
+    assert not retry.is_retryable(404, None)
+    assert retry.is_retryable(None, asyncio.TimeoutError())
+    assert not retry.is_retryable(None, ValueError())
+
+
+def test_retries_transient_errors():
+    async def scenario():
+        app, hits = make_app(failures_per_url=2)
+        runner, base = await serve(app)
+        retry = scraper.RetryPolicy(max_attempts=4, base_delay=0.01)
+        try:
+            async with scraper.create_session() as session:
+                urls = [f"{base}/moskva/test/?page={page}" for page in range(1, 21)]
+                results = await scraper.fetch_pages(session, scraper.AdaptiveLimiter(), urls, retry=retry)
+        finally:
+            await runner.cleanup()
+        return results, retry
+
+    results, retry = asyncio.run(scenario())
+    assert all(results)
+    assert retry.retries == 40
+    assert retry.completeness() == 1.0
+
+
+def test_dead_letter_final_pass():
+    """Страницы, исчерпавшие бюджет, догружаются в конце обхода"""
+    async def scenario():
+        app, hits = make_app(failures_per_url=2)
+        runner, base = await serve(app)
+        scraper.BASE_URL = base
+        retry = scraper.RetryPolicy(max_attempts=2, base_delay=0.01)
+        pages = []
+        try:
+            async with scraper.create_session() as session:
+                async for item in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/test/'], retry=retry):
+                    pages.append(item)
+        finally:
+            await runner.cleanup()
+        return pages, retry
+
+    original = scraper.BASE_URL
+    try:
+        pages, retry = asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+    assert sorted(page for _, page, _, _ in pages) == [1, 2, 3]
+    assert sum(len(doctors) for _, _, _, doctors in pages) == 60
+    assert retry.recovered == 3
+    assert not retry.dead_letters
+    assert retry.completeness() == 1.0
+
+
+def test_worker_error_is_raised():
+    """Исключение в воркере (пул парсинга, SQLite) поднимается из обхода, а не вешает его"""
+    def broken_parse(*args, **kwargs):
+        raise RuntimeError("пул парсинга упал")
+
+    async def scenario(listing):
+        app, _ = make_app(failures_per_url=0)
+        runner, base = await serve(app)
+        scraper.BASE_URL = base
+        try:
+            async with scraper.create_session() as session:
+                if listing:
+                    pages = scraper.crawl_listing(session, scraper.AdaptiveLimiter(), '/moskva/vrach/')
+                else:
+                    pages = scraper.crawl(session, scraper.AdaptiveLimiter(), [f'/moskva/s{i}/' for i in range(4)])
+                await asyncio.wait_for(collect(pages), 5)
+        finally:
+            await runner.cleanup()
+
+    async def collect(pages):
+        return [item async for item in pages]
+
+    original = scraper.BASE_URL, scraper.parse_listing
+    scraper.parse_listing = broken_parse
+    try:
+        for listing in (False, True):
+            try:
+                asyncio.run(scenario(listing))
+            except RuntimeError as e:
+                assert str(e) == "пул парсинга упал"
+            else:
+                raise AssertionError("обход не поднял ошибку воркера")
+    finally:
+        scraper.BASE_URL, scraper.parse_listing = original
+
+
+def main():
+    for test in (test_backoff_full_jitter, test_classification, test_retries_transient_errors,
+                 test_dead_letter_final_pass, test_worker_error_is_raised):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
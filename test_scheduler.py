@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика LPT: приоритет страниц, отчёт план/факт и обход заглушки,
+в котором крупная специальность из конца списка не остаётся в хвосте
+"""
+
+import asyncio
+import os
+import tempfile
+
+import mockserver
+import scheduler
+import scrape_moscow_async as scraper
+import validators
+
+
+def test_priority_and_plan():
+    schedule = scheduler.Schedule()
+    schedule.estimate('/moskva/small/', 2, 'index')
+    schedule.estimate('/moskva/unknown/', None, 'cache')
+    schedule.estimate('/moskva/big/', 30, 'journal')
+    assert schedule.plan() == ['/moskva/unknown/', '/moskva/big/', '/moskva/small/']
+    assert schedule.estimates['/moskva/unknown/'] == (None, 'probe')
+
+    keys = sorted(schedule.priority(path, page) for path, page in
+                  [('/moskva/small/', 2), ('/moskva/big/', 7), ('/moskva/unknown/', 1), ('/moskva/big/', 2)])
+    assert keys[0] == schedule.priority('/moskva/unknown/', 1)
+    assert keys[1:3] == [schedule.priority('/moskva/big/', 2), schedule.priority('/moskva/big/', 7)]
+    # Первая страница показала размер - приоритет по факту
+    schedule.set_pages('/moskva/unknown/', 50)
+    assert schedule.priority('/moskva/unknown/', 3) < schedule.priority('/moskva/big/', 2)
+    assert scheduler.Schedule(largest_first=False).priority('/moskva/big/', 2) == ()
+
+
+def test_report():
+    schedule = scheduler.Schedule()
+    schedule.estimate('/moskva/a/', 10, 'index')
+    schedule.estimate('/moskva/b/', 5, 'index')
+    schedule.estimate('/moskva/c/')
+    schedule.finish('/moskva/c/', 1.0, 5)
+    schedule.finish('/moskva/a/', 3.0, 10)
+    schedule.finish('/moskva/b/', 5.0, 10)  # оценка занижена вдвое
+    rows = schedule.report()
+    # 25 страниц за 5 секунд - 5 страниц в секунду
+    assert [row['specialty'] for row in rows] == ['/moskva/c/', '/moskva/a/', '/moskva/b/']
+    assert [row['predicted_seconds'] for row in rows] == [1.0, 3.0, 4.0]
+    assert [row['actual_seconds'] for row in rows] == [1.0, 3.0, 5.0]
+    assert rows[0]['source'] == 'probe' and rows[1]['estimated_pages'] == 10
+    assert "с оценкой 2/3, ошибка оценки страниц 25%" in schedule.format()
+
+
+def crawl_order(site, specialties, schedule):
+    async def scenario():
+        runner, base = await mockserver.start(site)
+        scraper.BASE_URL = base
+        items = []
+        try:
+            async with scraper.create_session() as session:
+                async for specialty, page, _, _ in scraper.crawl(session, scraper.AdaptiveLimiter(max_limit=4),
+                                                                 specialties, schedule=schedule):
+                    items.append((specialty, page))
+        finally:
+            await runner.cleanup()
+        return items
+
+    original = scraper.BASE_URL
+    try:
+        return asyncio.run(scenario())
+    finally:
+        scraper.BASE_URL = original
+
+
+def test_largest_first_crawl():
+    site = mockserver.MockSite({'big': 605}, default_doctors=25)
+    specialties = [f"/moskva/s{i}/" for i in range(10)] + ['/moskva/big/']
+
+    fifo = crawl_order(site, specialties, scheduler.Schedule(largest_first=False))
+    assert fifo[-1][0] == '/moskva/big/'
+
+    # Без оценок: сначала все первые страницы, потом крупная специальность
+    schedule = scheduler.Schedule()
+    for path in specialties:
+        schedule.estimate(path)
+    items = crawl_order(site, specialties, schedule)
+    assert len(items) == len(fifo) == 10 * 2 + 31
+    last_big = max(index for index, item in enumerate(items) if item[0] == '/moskva/big/')
+    assert last_big < len(items) - 5
+
+
+def test_cached_last_page():
+    with tempfile.TemporaryDirectory() as tmp:
+        with validators.ValidatorCache(os.path.join(tmp, 'validators.sqlite')) as cache:
+            cache.store('http://x/moskva/big/', 'digest', 31, [])
+            cache.store('http://x/moskva/big/?page=2', 'digest', None, [])
+            assert cache.cached_last_page('http://x/moskva/big/') == 31
+            assert cache.cached_last_page('http://x/moskva/big/?page=2') is None
+            assert cache.cached_last_page('http://x/moskva/other/') is None
+            assert cache.parsed == 2
+
+
+def main():
+    for test in (test_priority_and_plan, test_report, test_largest_first_crawl, test_cached_last_page):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,11 @@
 import requests
 from bs4 import BeautifulSoup
 import time
+import os
 import json
 
-BASE_URL = "https://prodoctorov.ru"
+# PRODOCTOROV_BASE_URL - например, локальный mockserver.py
+BASE_URL = os.environ.get("PRODOCTOROV_BASE_URL", "https://prodoctorov.ru")
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
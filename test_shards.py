@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Тест шардированного обхода: аренды и переназначение в очереди шардов, обход
+заглушки несколькими процессами-воркерами, один из которых убивается с арендой
+на руках; план специальностей из каталога городов с итоговыми файлами по городам
+"""
+
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import catalogue
+import journal
+import mockserver
+import scrape_moscow_async as scraper
+import shards
+import store
+
+
+def test_queue_leases():
+    queue = shards.ShardQueue(shards.plan_specialties([f"/moskva/s{i}/" for i in range(7)], 3), lease_seconds=10,
+                              max_attempts=2)
+    assert [len(shard['specialties']) for shard in queue.shards.values()] == [3, 2, 2]
+
+    assert queue.lease('a', 0)['id'] == 0
+    assert queue.lease('b', 0)['id'] == 1
+    assert queue.renew(0, 'a', 5) and not queue.renew(0, 'b', 5)
+    # Аренда b истекла - шард 1 уходит в конец очереди
+    assert queue.lease('c', 11)['id'] == 2
+    assert list(queue.pending) == [1] and queue.reassigned == 1
+    assert queue.lease('c', 11)['id'] == 1
+    # Опоздавший b всё же прислал результат - принимается первый
+    assert queue.complete(1, 'b') and not queue.complete(1, 'c')
+    queue.fail(2, 'c', 'boom')
+    assert queue.lease('c', 12)['id'] == 2
+    queue.fail(2, 'c', 'boom')
+    assert queue.failed == {2: 'boom'}
+    assert queue.complete(0, 'a') and queue.done
+    assert queue.format() == "готово 2/3, переназначено 2, провалено 1"
+
+
+def test_plan_listing():
+    plan = shards.plan_listing('/moskva/vrach/', 51, pages_per_shard=20)
+    assert [(shard['first'], shard['last']) for shard in plan] == [(2, 21), (22, 41), (42, 102)]
+    assert [(shard['first'], shard['last']) for shard in shards.plan_listing('/moskva/vrach/', 1)] == [(2, 2)]
+    plan = shards.plan_listing('/moskva/vrach/', 3, first_ids={'b', 'a'})
+    assert plan[0]['first_ids'] == ['a', 'b']
+
+
+def run_coordinator(site, plan, path, workers=2, crash_first=True):
+    async def scenario():
+        with journal.CrawlJournal(path, header={'timestamp': 'test'}) as log:
+            queue = shards.ShardQueue(plan, lease_seconds=1.0)
+            coordinator = shards.Coordinator(queue, log, base)
+            address = await coordinator.start()
+            if crash_first:
+                # Воркер пропадает с арендой на руках: убиваем его, как только он взял шард
+                crashed = await asyncio.create_subprocess_exec(
+                    sys.executable, shards.__file__, 'worker', '--connect', address)
+                holder = f":{crashed.pid}"
+                while crashed.returncode is None and not any(worker.endswith(holder)
+                                                             for worker, _ in queue.leases.values()):
+                    await asyncio.sleep(0.01)
+                crashed.kill()
+                assert await crashed.wait() != 0
+            await coordinator.run(workers)
+        return queue
+
+    with mockserver.ServerThread(site) as base:
+        return asyncio.run(scenario())
+
+
+def test_worker_shutdown():
+    site = mockserver.MockSite({'s0': 400}, latency=0.2)
+
+    async def scenario(path):
+        with journal.CrawlJournal(path, header={'timestamp': 'test'}) as log:
+            queue = shards.ShardQueue(shards.plan_specialties(['/moskva/s0/'], 1), lease_seconds=5.0)
+            coordinator = shards.Coordinator(queue, log, base)
+            address = await coordinator.start()
+            # Отмена самого воркера не глотается, как отобранный шард
+            worker = asyncio.create_task(shards.work(address))
+            while not queue.leases:
+                await asyncio.sleep(0.01)
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            assert worker.cancelled()
+
+            # Шард упал, а координатора уже нет - воркер выходит без ошибки
+            async def broken_shard(shard, parse_workers=0):
+                coordinator._server.close()
+                await coordinator._server.wait_closed()
+                raise RuntimeError('boom')
+
+            queue.expire(time.monotonic() + 10)
+            original = shards.crawl_shard
+            shards.crawl_shard = broken_shard
+            try:
+                await asyncio.wait_for(shards.work(address), 5)
+            finally:
+                shards.crawl_shard = original
+
+    original = scraper.BASE_URL
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        try:
+            asyncio.run(scenario(os.path.join(tmp, 'journal.jsonl')))
+        finally:
+            scraper.BASE_URL = original
+
+
+def test_sharded_specialties():
+    specialties = [f"/moskva/s{i}/" for i in range(10)]
+    # Задержка ответов - чтобы воркер не успел сдать шард до того, как его убьют
+    site = mockserver.MockSite({'s3': 95, 's7': 5}, default_doctors=45, latency=0.2)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        queue = run_coordinator(site, shards.plan_specialties(specialties, 5), path)
+        assert len(queue.completed) == 5 and queue.reassigned >= 1 and not queue.failed
+
+        records = journal.journal_records(path, scraper.specialty_name_from_path)
+        unique = store.build_outputs(records, os.path.join(tmp, 'out.sqlite'), os.path.join(tmp, 'out.csv'),
+                                     os.path.join(tmp, 'out.json'))
+        _, entries = journal.read_journal(path)
+        pages = sorted((entry['specialty'], entry['page']) for entry in entries)
+
+    expected = set()
+    for index, specialty in enumerate(specialties):
+        total = site.total(f"s{index}")
+        expected |= {site.doctor_id(f"s{index}", n) for n in range(total)}
+        assert [page for name, page in pages if name == specialty] == list(range(1, -(-total // 20) + 1))
+    assert unique == len(expected)
+
+
+def test_sharded_listing():
+    site = mockserver.MockSite({'vrach': 1005})
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        plan = shards.plan_listing('/moskva/vrach/', 40, pages_per_shard=10)  # оценка занижена
+        queue = run_coordinator(site, plan, path, workers=3, crash_first=False)
+        entries = list(journal.read_journal(path)[1])
+        pages = sorted(entry['page'] for entry in entries)
+        doctors = sum(len(entry['doctors']) for entry in entries)
+    assert len(queue.completed) == len(plan)
+    # Первую страницу в настоящем прогоне пишет координатор, здесь её нет
+    assert pages == list(range(2, 52)) and doctors == 1005 - 20
+
+
+def test_sharded_listing_redirect():
+    # Страницы за концом сайт отдаёт как первую - шард узнаёт их по id первой страницы
+    site = mockserver.MockSite({'vrach': 205}, redirect_past_end=True)
+    first_ids = [str(site.doctor_id('vrach', n)) for n in range(20)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'journal.jsonl')
+        plan = shards.plan_listing('/moskva/vrach/', 8, pages_per_shard=4, first_ids=first_ids)
+        queue = run_coordinator(site, plan, path, crash_first=False)
+        entries = list(journal.read_journal(path)[1])
+    assert len(queue.completed) == len(plan) and not queue.failed
+    assert sorted(entry['page'] for entry in entries) == list(range(2, 12))
+    assert sum(len(entry['doctors']) for entry in entries) == 205 - 20
+    assert site.requests[302] <= 16 - 11 + 1
+
+
+def test_sharded_catalogue():
+    site = mockserver.MockSite({'a': 45, 'spb/a': 25, 'spb/b': 5}, default_doctors=10, overlap=0)
+    with tempfile.TemporaryDirectory() as tmp, mockserver.ServerThread(site) as base:
+        cat = catalogue.Catalogue(os.path.join(tmp, 'catalogue.json'))
+        cat.update('moskva', ['a'])
+        cat.update('spb', ['a', 'b'])
+        cat.save()
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            asyncio.run(shards.coordinate(shards.parse_args(
+                ['coordinate', '--city', 'moskva', '--city', 'spb', '--no-index', '--workers', '2',
+                 '--base-url', base])))
+        finally:
+            os.chdir(cwd)
+        outputs = {}
+        for prefix in ('moscow_doctors_sharded_', 'spb_doctors_sharded_'):
+            name = next(name for name in os.listdir(tmp) if name.startswith(prefix) and name.endswith('.csv'))
+            with open(os.path.join(tmp, name), encoding='utf-8-sig') as f:
+                outputs[prefix] = list(csv.DictReader(f))
+        pages = sorted((entry['specialty'], entry['page']) for entry in journal.read_journal(
+            os.path.join(tmp, shards.JOURNAL_FILE))[1])
+
+    assert len(outputs['moscow_doctors_sharded_']) == 45 and len(outputs['spb_doctors_sharded_']) == 25 + 5
+    assert pages == [('/moskva/a/', 1), ('/moskva/a/', 2), ('/moskva/a/', 3), ('/spb/a/', 1), ('/spb/a/', 2),
+                     ('/spb/b/', 1)]
+
+
+def main():
+    for test in (test_queue_leases, test_plan_listing, test_worker_shutdown, test_sharded_specialties, test_sharded_listing,
+                 test_sharded_listing_redirect, test_sharded_catalogue):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
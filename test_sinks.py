@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Тест потоковой записи и сборки итоговых CSV/JSON из потока через store.build_outputs
+"""
+
+import csv
+import json
+import os
+import tempfile
+
+import sinks
+import store
+
+
+def doctor(doc_id, rating=None, reviews_count=None):
+    return {
+        'id': doc_id,
+        'name': f'Врач {doc_id}',
+        'url': f'https://prodoctorov.ru/moskva/vrach/{doc_id}-vrach/',
+        'rating': rating,
+        'reviews_count': reviews_count,
+        'specialty_display': 'Терапевт',
+    }
+
+
+def test_stream_roundtrip_and_merge():
+    with tempfile.TemporaryDirectory() as tmp:
+        stream_file = os.path.join(tmp, 'stream.jsonl')
+        with sinks.JsonLinesSink(stream_file, chunk_size=2) as stream:
+            stream.write_many(sinks.doctor_records([doctor('1'), doctor('2', 4.5)], 'terapevt'))
+            # Данные, которые ещё не сброшены, не должны теряться при close
+            stream.write_many(sinks.doctor_records([doctor('1', 4.1, 12)], 'pediatr'))
+
+        assert len(list(sinks.read_records(stream_file))) == 3
+
+        csv_file = os.path.join(tmp, 'out.csv')
+        json_file = os.path.join(tmp, 'out.json')
+        db_file = os.path.join(tmp, 'out.sqlite')
+        assert store.build_outputs(sinks.read_records(stream_file), db_file, csv_file, json_file) == 2
+
+        with open(json_file, encoding='utf-8') as f:
+            doctors = {doc['id']: doc for doc in json.load(f)}
+        assert doctors['1']['rating'] == 4.1
+        assert doctors['1']['reviews_count'] == 12
+        assert doctors['1']['specialties'] == ['terapevt', 'pediatr']
+        assert doctors['2']['specialties'] == ['terapevt']
+
+        with open(csv_file, encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == sinks.DOCTOR_FIELDS + ['specialties']
+        assert rows[1][-1] == 'terapevt; pediatr'
+
+
+def test_outputs_without_specialties():
+    with tempfile.TemporaryDirectory() as tmp:
+        stream_file = os.path.join(tmp, 'stream.jsonl')
+        with sinks.JsonLinesSink(stream_file) as stream:
+            stream.write_many(sinks.doctor_records([doctor('1'), doctor('1')]))
+        csv_file = os.path.join(tmp, 'out.csv')
+        json_file = os.path.join(tmp, 'out.json')
+        db_file = os.path.join(tmp, 'out.sqlite')
+        assert store.build_outputs(sinks.read_records(stream_file), db_file, csv_file, json_file,
+                                   with_specialties=False) == 1
+        with open(json_file, encoding='utf-8') as f:
+            assert 'specialties' not in json.load(f)[0]
+        with open(csv_file, encoding='utf-8') as f:
+            assert next(csv.reader(f)) == sinks.DOCTOR_FIELDS
+
+
+def test_csv_append_header_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'stats.csv')
+        for total in (5, 7):
+            with sinks.CsvAppendSink(path, ['specialty', 'total']) as sink:
+                sink.write({'specialty': 'terapevt', 'total': total})
+        with open(path, encoding='utf-8') as f:
+            assert f.read().splitlines() == ['specialty,total', 'terapevt,5', 'terapevt,7']
+
+
+def main():
+    for test in (test_stream_roundtrip_and_merge, test_outputs_without_specialties, test_csv_append_header_once):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Тест хранилища на SQLite: слияние врачей upsert-ом и выгрузка CSV/JSON
+"""
+
+import json
+import os
+import tempfile
+
+import sinks
+import store
+from test_sinks import doctor
+
+
+def test_upsert_merge():
+    records = list(sinks.doctor_records([doctor('1'), doctor('2', 4.5)], 'terapevt'))
+    records += sinks.doctor_records([doctor('1', 4.1, 12), doctor('2', 3.0, 7)], 'pediatr')
+    records += sinks.doctor_records([doctor('1', 2.0, 1)], 'terapevt')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with store.DoctorStore(os.path.join(tmp, 'doctors.sqlite'), batch_size=2) as db:
+            db.add_records(records)
+            assert db.count() == 2
+            doctors = list(db.doctors())
+
+    # Первая запись остаётся, пустые поля дополняются, повтор специальности не дублируется
+    assert doctors == [dict(doctor('1', 4.1, 12), specialties=['terapevt', 'pediatr']),
+                       dict(doctor('2', 4.5, 7), specialties=['terapevt', 'pediatr'])]
+
+
+def test_build_outputs_rebuilds_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'doctors.sqlite')
+        csv_file = os.path.join(tmp, 'out.csv')
+        json_file = os.path.join(tmp, 'out.json')
+        for _ in range(2):
+            records = sinks.doctor_records([doctor('1'), doctor('2'), doctor('1')])
+            assert store.build_outputs(records, db_file, csv_file, json_file, with_specialties=False) == 2
+        with open(json_file, encoding='utf-8') as f:
+            doctors = json.load(f)
+        assert [doc['id'] for doc in doctors] == ['1', '2']
+        assert 'specialties' not in doctors[0]
+
+
+def main():
+    for test in (test_upsert_merge, test_build_outputs_rebuilds_store):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
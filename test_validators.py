@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Тест условных запросов: повторный обход с кэшем валидаторов не парсит страницы заново,
+а после смены парсера или версии разбора - разбирает
+"""
+
+import asyncio
+import collections
+import os
+import sqlite3
+import tempfile
+
+from aiohttp import web
+
+import scrape_moscow_async as scraper
+import validators
+from test_retry_policy import serve
+
+
+def make_app():
+    """Сервер-заглушка: /moskva/etag/ отдаёт ETag и отвечает 304, /moskva/plain/ - без валидаторов"""
+    statuses = collections.Counter()
+
+    async def handler(request):
+        specialty = request.match_info['specialty']
+        total = 45
+        page = int(request.query.get('page', 1))
+        cards = ''.join(
+            f'<div class="b-doctor-card" data-doctor-id="{specialty}{i}" data-doctor-name="Врач {i}">'
+            f'<a class="b-doctor-card__name-link" href="/moskva/vrach/{i}-vrach/">Врач {i}</a></div>'
+            for i in range((page - 1) * 20, min(page * 20, total))
+        )
+        body = f'<html><head><meta name="description" content="{total} врачей"></head><body>{cards}</body></html>'
+        headers = {}
+        if specialty == 'etag':
+            etag = f'"{validators.body_hash(body)}"'
+            if request.headers.get('If-None-Match') == etag:
+                statuses[304] += 1
+                return web.Response(status=304)
+            headers['ETag'] = etag
+        statuses[200] += 1
+        return web.Response(text=body, content_type='text/html', headers=headers)
+
+    app = web.Application()
+    app.router.add_get('/moskva/{specialty}/', handler)
+    return app, statuses
+
+
+def test_second_crawl_reuses_parsed_pages():
+    async def crawl_once(cache):
+        pages = []
+        async with scraper.create_session() as session:
+            async for item in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/etag/', '/moskva/plain/'],
+                                            retry=scraper.RetryPolicy(), cache=cache):
+                pages.append(item)
+        return sorted(pages, key=lambda item: (item[0], item[1]))
+
+    async def scenario(path):
+        app, statuses = make_app()
+        runner, base = await serve(app)
+        scraper.BASE_URL = base
+        try:
+            with validators.ValidatorCache(path) as cache:
+                first = await crawl_once(cache)
+            with validators.ValidatorCache(path) as cache:
+                second = await crawl_once(cache)
+        finally:
+            await runner.cleanup()
+        return first, second, cache, statuses
+
+    original = scraper.BASE_URL
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            first, second, cache, statuses = asyncio.run(scenario(os.path.join(tmp, 'validators.sqlite')))
+    finally:
+        scraper.BASE_URL = original
+
+    assert second == first
+    assert sum(len(doctors) for _, _, _, doctors in second) == 90
+    assert statuses[304] == 3
+    assert cache.not_modified == 3
+    assert cache.body_hits == 3
+    assert cache.parsed == 0
+
+
+def test_parser_change_invalidates_results():
+    async def crawl_once(path, parser):
+        with validators.ValidatorCache(path, parser=parser) as cache:
+            async with scraper.create_session() as session:
+                async for _ in scraper.crawl(session, scraper.AdaptiveLimiter(), ['/moskva/etag/', '/moskva/plain/'],
+                                             retry=scraper.RetryPolicy(), cache=cache):
+                    pass
+        return cache
+
+    async def scenario(path):
+        app, statuses = make_app()
+        runner, base = await serve(app)
+        scraper.BASE_URL = base
+        try:
+            caches = [await crawl_once(path, parser) for parser in ('bs4:1', 'bs4:2', 'bs4:2', 'lxml:2')]
+        finally:
+            await runner.cleanup()
+        return caches, statuses
+
+    original = scraper.BASE_URL
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            caches, statuses = asyncio.run(scenario(os.path.join(tmp, 'validators.sqlite')))
+    finally:
+        scraper.BASE_URL = original
+
+    # Новая версия и другой движок - без условных запросов и с разбором всех 6 страниц
+    assert [cache.parsed for cache in caches] == [6, 6, 0, 6]
+    assert [cache.not_modified + cache.body_hits for cache in caches] == [0, 0, 6, 0]
+    assert statuses[304] == 3
+
+
+def test_old_schema_is_migrated():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'validators.sqlite')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE validators (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                     'body_hash TEXT, last_page INTEGER, doctors TEXT)')
+        conn.execute("INSERT INTO validators VALUES ('u', '\"e\"', NULL, ?, 3, '[]')", (validators.body_hash('x'),))
+        conn.commit()
+        conn.close()
+        with validators.ValidatorCache(path, parser='bs4:1') as cache:
+            assert cache.conditional_headers('u') == {}
+            assert cache.match_body('u', 'x') == (validators.body_hash('x'), None)
+        with validators.ValidatorCache(path) as cache:
+            assert cache.conditional_headers('u') == {'If-None-Match': '"e"'}
+
+
+def main():
+    for test in (test_second_crawl_reuses_parsed_pages, test_parser_change_invalidates_results,
+                 test_old_schema_is_migrated):
+        test()
+        print(f"OK {test.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Кэш валидаторов страниц списка: ETag, Last-Modified и хэш тела по URL вместе с
+разобранным результатом. Повторный обход шлёт условные запросы; на 304 или при
+том же хэше тела берётся сохранённый список врачей, страница не парсится.
+Результат помечен парсером (parsers.parser_identity): запись другого движка
+или старой версии разбора - промах, страница загружается и разбирается заново.
+"""
+
+import hashlib
+import json
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body_hash TEXT,
+    last_page INTEGER,
+    doctors TEXT,
+    parser TEXT
+)
+"""
+
+# fetch_page возвращает это вместо html на ответ 304
+NOT_MODIFIED = object()
+
+
+def body_hash(html):
+    """Хэш тела ответа: str или сырые байты (fastscan) дают один и тот же хэш"""
+    data = html if isinstance(html, bytes) else html.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+class ValidatorCache:
+    """
+    Валидаторы в SQLite; записи коммитятся пачками по commit_every.
+    parser - метка разбора; None - принимать записи любого парсера.
+    """
+
+    def __init__(self, path, commit_every=200, parser=None):
+        self.path = path
+        self.commit_every = commit_every
+        self.parser = parser
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(SCHEMA)
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(validators)')}
+        if 'parser' not in columns:
+            # Кэш прошлой версии: записи без метки парсера считаются чужими
+            self._conn.execute('ALTER TABLE validators ADD COLUMN parser TEXT')
+        self._pending = {}  # url -> (etag, last_modified) из ответа, ещё не разобранного
+        self._uncommitted = 0
+        self.not_modified = 0
+        self.body_hits = 0
+        self.parsed = 0
+
+    def _row(self, url):
+        return self._conn.execute(
+            'SELECT etag, last_modified, body_hash, last_page, doctors, parser FROM validators WHERE url = ?', (url,)
+        ).fetchone()
+
+    def _usable(self, row):
+        """Запись есть и разобрана тем же парсером"""
+        return row is not None and (self.parser is None or row[5] == self.parser)
+
+    def conditional_headers(self, url):
+        """If-None-Match / If-Modified-Since для запроса url; без годного разбора - обычный запрос"""
+        row = self._row(url)
+        headers = {}
+        if not self._usable(row):
+            return headers
+        etag, last_modified = row[0], row[1]
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def remember(self, url, response_headers):
+        self._pending[url] = (response_headers.get('ETag'), response_headers.get('Last-Modified'))
+
+    def cached_result(self, url):
+        """(last_page, doctors) для ответа 304"""
+        self.not_modified += 1
+        row = self._row(url)
+        return row[3], json.loads(row[4])
+
+    def cached_last_page(self, url):
+        """Число страниц из прошлого разбора первой страницы url (None - неизвестно)"""
+        row = self._row(url)
+        return row[3] if row is not None else None
+
+    def match_body(self, url, html):
+        """(хэш тела, сохранённый результат или None): тот же хэш - разбор не нужен"""
+        digest = body_hash(html)
+        row = self._row(url)
+        if not self._usable(row) or row[2] != digest:
+            return digest, None
+        self.body_hits += 1
+        doctors = json.loads(row[4])
+        # Валидаторы из нового ответа всё равно сохраняем
+        self.store(url, digest, row[3], doctors, count=False)
+        return digest, (row[3], doctors)
+
+    def store(self, url, digest, last_page, doctors, count=True):
+        if count:
+            self.parsed += 1
+        etag, last_modified = self._pending.pop(url, (None, None))
+        self._conn.execute(
+            'INSERT OR REPLACE INTO validators (url, etag, last_modified, body_hash, last_page, doctors, parser) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (url, etag, last_modified, digest, last_page, json.dumps(doctors, ensure_ascii=False), self.parser),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def format(self):
+        hits = self.not_modified + self.body_hits
+        pages = hits + self.parsed
+        rate = hits / pages * 100 if pages else 0.0
+        return (f"попаданий {hits}/{pages} ({rate:.0f}%): 304 - {self.not_modified}, "
+                f"тот же хэш - {self.body_hits}, разобрано {self.parsed}")